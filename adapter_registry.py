@@ -0,0 +1,70 @@
+"""
+多 LoRA 管理
+基座模型只加载一次，多个 LoRA（必须基于同一个基座模型训练）按名字注册，
+第一次被请求时才加载；已加载 LoRA 的总内存超过上限时，卸载最久没用的。
+每多一个 LoRA 只增加 LoRA 本身的内存（几 MB ~ 几十 MB），而不是一整份模型。
+"""
+
+from collections import OrderedDict
+
+DEFAULT_ADAPTER = "default"  # PeftModel.from_pretrained 默认的 LoRA 名字（lora_path 挂载的那个）
+
+
+def adapter_nbytes(model, name):
+    """名为 name 的 LoRA 参数占用的内存"""
+    marker = f".{name}."
+    return sum(p.numel() * p.element_size() for n, p in model.named_parameters() if marker in n)
+
+
+class AdapterRegistry:
+    """
+    注意：load / 切换 LoRA 会修改模型，调用方需要持有模型锁
+    DEFAULT_ADAPTER 不归这里管理，永远不会被卸载
+    """
+
+    def __init__(self, adapters=None, max_bytes=512 * 1024 * 1024):
+        self.paths = dict(adapters or {})
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.loaded = OrderedDict()  # name -> nbytes，按最近使用排序
+        self.stats = {"hits": 0, "loads": 0, "evictions": 0}
+
+    def register(self, name, path):
+        if name == DEFAULT_ADAPTER:
+            raise ValueError(f"LoRA 名字 {DEFAULT_ADAPTER!r} 已被保留")
+        self.paths[name] = path
+
+    def names(self):
+        return list(self.paths)
+
+    def load(self, model, name):
+        """确保名为 name 的 LoRA 已加载，返回（可能被 PeftModel 包装过的）模型"""
+        from peft import PeftModel
+
+        if name in self.loaded:
+            self.loaded.move_to_end(name)
+            self.stats["hits"] += 1
+            return model
+        if name not in self.paths:
+            raise KeyError(f"未注册的 LoRA: {name}（已注册: {', '.join(self.paths) or '无'}）")
+
+        if isinstance(model, PeftModel):
+            model.load_adapter(self.paths[name], adapter_name=name)
+        else:
+            model = PeftModel.from_pretrained(model, self.paths[name], adapter_name=name)
+        model.eval()
+        size = adapter_nbytes(model, name)
+        self.loaded[name] = size
+        self.nbytes += size
+        self.stats["loads"] += 1
+        print(f"✅ 已加载 LoRA [{name}]: {self.paths[name]} ({size / 1024 / 1024:.1f} MB)")
+
+        while self.nbytes > self.max_bytes and len(self.loaded) > 1:
+            old = next(iter(self.loaded))
+            if old == name:
+                break
+            model.delete_adapter(old)
+            self.nbytes -= self.loaded.pop(old)
+            self.stats["evictions"] += 1
+            print(f"♻️ 已卸载 LoRA [{old}]")
+        return model
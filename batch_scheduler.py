@@ -0,0 +1,365 @@
+"""
+连续批处理 (continuous batching) 调度器
+多个用户同时提问时，把正在生成的请求放进同一个 batch 一起解码；
+每解码一步就检查一次新请求并加入 batch，结束的请求立即移出，
+这样总吞吐量 (tokens/s) 随并发用户数增长，而不是一个个排队。
+"""
+
+import queue
+import threading
+import time
+
+import torch
+import torch.nn.functional as F
+
+from kv_cache import cache_to_layers, layers_to_cache
+
+
+class GenerationRequest:
+    """
+    一个生成请求
+    - 迭代它可以逐个拿到新生成的 token id（流式输出）
+    - wait() 阻塞到生成结束，返回全部生成的 token id
+    - cancel() 提前结束（例如客户端断开），调度器下一步解码前把它移出 batch
+    """
+
+    def __init__(self, input_ids, max_new_tokens, do_sample, temperature, top_p, top_k, prefix=None,
+                 keep_cache=False):
+        self.input_ids = list(input_ids)
+        self.prefix = prefix  # (前缀 token 数, 前缀的 layers)，prefill 时只计算后缀
+        self.keep_cache = keep_cache
+        self.cache_layers = None  # keep_cache=True 时，结束后保存这条序列的 KV Cache（去掉左侧补齐）
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.generated = []
+        self.error = None
+        self.cancelled = False
+        self.submitted_at = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self._queue = queue.Queue()
+        self._done = threading.Event()
+
+    @property
+    def cache_ids(self):
+        """cache_layers 覆盖的 token：prompt + 已生成（最后一个 token 还没有算 KV）"""
+        if self.cache_layers is None:
+            return None
+        length = self.cache_layers[0][0].shape[2]
+        return (self.input_ids + self.generated)[:length]
+
+    def _emit(self, token_id):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.generated.append(token_id)
+        self._queue.put(token_id)
+
+    def _finish(self, error=None):
+        if self._done.is_set():
+            return
+        self.error = error
+        self.finished_at = time.perf_counter()
+        self._queue.put(None)
+        self._done.set()
+
+    def cancel(self):
+        """请求调度器停止生成；已经生成的 token 保留，迭代 / wait() 正常结束"""
+        self.cancelled = True
+
+    def __iter__(self):
+        while True:
+            token_id = self._queue.get()
+            if token_id is None:
+                break
+            yield token_id
+        if self.error is not None:
+            raise self.error
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return list(self.generated)
+
+
+class ContinuousBatchScheduler:
+    """
+    后台线程维护一个解码 batch：
+    - 新请求先单独 prefill，得到自己的 KV Cache 和第一个 token（带前缀 KV Cache 时只算后缀）
+    - 再把 KV Cache 左侧补齐 (left padding) 后拼进 batch，参与之后的每一步解码
+    - 每条序列遇到 EOS 或达到 max_new_tokens 就单独停止并移出 batch
+    """
+
+    def __init__(self, model, tokenizer, device, max_batch_size=8, model_lock=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.model_lock = model_lock or threading.Lock()
+
+        gen_config = model.generation_config
+        eos = gen_config.eos_token_id if gen_config.eos_token_id is not None else tokenizer.eos_token_id
+        self.eos_token_ids = set(eos if isinstance(eos, (list, tuple)) else [eos])
+        self.defaults = {
+            "do_sample": bool(gen_config.do_sample),
+            "temperature": gen_config.temperature or 1.0,
+            "top_p": gen_config.top_p or 1.0,
+            "top_k": gen_config.top_k or 0,
+        }
+
+        self._pending = queue.Queue()
+        self._active = []          # 当前 batch 里的请求，顺序与 batch 维一致
+        self._layers = None        # 每层 (key, value)，形状 [B, heads, T, head_dim]
+        self._mask = None          # [B, T]，左侧补齐的位置为 0
+        self._positions = None     # [B]，每条序列下一个 token 的位置
+        self._last_tokens = None   # [B]，每条序列上一步生成的 token
+
+        self.stats = {"requests": 0, "generated_tokens": 0, "decode_steps": 0, "batch_tokens": 0, "busy_time": 0.0}
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    # ---------- 对外接口 ----------
+
+    def submit(self, input_ids, max_new_tokens=256, do_sample=None, temperature=None, top_p=None, top_k=None,
+               prefix=None, keep_cache=False):
+        """参数不合法时直接抛 ValueError，不会进入调度线程"""
+        request = GenerationRequest(
+            input_ids, *self._check_params(
+                max_new_tokens,
+                self.defaults["do_sample"] if do_sample is None else do_sample,
+                self.defaults["temperature"] if temperature is None else temperature,
+                self.defaults["top_p"] if top_p is None else top_p,
+                self.defaults["top_k"] if top_k is None else top_k,
+            ),
+            prefix=prefix,
+            keep_cache=keep_cache,
+        )
+        self._pending.put(request)
+        return request
+
+    @staticmethod
+    def _check_params(max_new_tokens, do_sample, temperature, top_p, top_k):
+        """校验并转换采样参数（HTTP 请求里的参数可能是字符串）"""
+        if not isinstance(do_sample, (bool, int)):
+            raise ValueError(f"do_sample 必须是 true / false: {do_sample!r}")
+        try:
+            max_new_tokens, top_k = int(max_new_tokens), int(top_k)
+            temperature, top_p = float(temperature), float(top_p)
+        except (TypeError, ValueError):
+            raise ValueError(f"生成参数不合法: max_new_tokens={max_new_tokens!r}, temperature={temperature!r}, "
+                             f"top_p={top_p!r}, top_k={top_k!r}") from None
+        if max_new_tokens < 1 or temperature < 0 or not 0 < top_p <= 1 or top_k < 0:
+            raise ValueError(f"生成参数超出范围: max_new_tokens={max_new_tokens}, temperature={temperature}, "
+                             f"top_p={top_p}, top_k={top_k}")
+        return max_new_tokens, bool(do_sample), temperature, top_p, top_k
+
+    def throughput(self):
+        """汇总统计：总 tokens/s 和平均 batch 大小"""
+        stats = dict(self.stats)
+        busy = stats["busy_time"]
+        stats["tokens_per_sec"] = stats["generated_tokens"] / busy if busy else 0.0
+        steps = stats["decode_steps"]
+        stats["avg_batch_size"] = stats["batch_tokens"] / steps if steps else 0.0
+        return stats
+
+    # ---------- 采样 ----------
+
+    def _sample(self, logits, requests):
+        """logits: [B, vocab]，每行按对应请求自己的采样参数取下一个 token"""
+        logits = logits.float()
+        tokens = []
+        for row, request in zip(logits, requests):
+            if not request.do_sample:
+                tokens.append(int(row.argmax()))
+                continue
+            row = row / max(request.temperature, 1e-5)
+            if request.top_k and request.top_k > 0:
+                kth = torch.topk(row, min(request.top_k, row.numel())).values[-1]
+                row = row.masked_fill(row < kth, float("-inf"))
+            probs = F.softmax(row, dim=-1)
+            if request.top_p < 1.0:
+                sorted_probs, sorted_idx = torch.sort(probs, descending=True)
+                cumulative = sorted_probs.cumsum(dim=-1)
+                # 保留累计概率刚超过 top_p 的最小集合
+                remove = cumulative - sorted_probs > request.top_p
+                sorted_probs = sorted_probs.masked_fill(remove, 0.0)
+                probs = torch.zeros_like(probs).scatter(0, sorted_idx, sorted_probs)
+            tokens.append(int(torch.multinomial(probs / probs.sum(), 1)))
+        return tokens
+
+    def _is_finished(self, request, token_id):
+        return token_id in self.eos_token_ids or len(request.generated) >= request.max_new_tokens
+
+    # ---------- 调度循环 ----------
+
+    def _loop(self):
+        # 任何异常都只结束受影响的请求，调度线程本身不能退出，否则之后的请求会一直等待
+        while True:
+            try:
+                if not self._active:
+                    self._admit(self._pending.get())  # 空闲时阻塞等待新请求
+                while len(self._active) < self.max_batch_size:
+                    try:
+                        self._admit(self._pending.get_nowait())
+                    except queue.Empty:
+                        break
+                if self._active:
+                    self._decode_step()
+            except Exception as e:
+                self._fail_active(e)
+
+    def _fail_active(self, error):
+        """batch 里的请求全部以 error 结束，并清空 batch 状态"""
+        for request in self._active:
+            request._finish(error)
+        self._active = []
+        self._layers = self._mask = self._positions = self._last_tokens = None
+
+    def _prefill(self, request):
+        input_ids, past = request.input_ids, None
+        if request.prefix is not None:
+            prefix_len, prefix_layers = request.prefix
+            input_ids, past = input_ids[prefix_len:], layers_to_cache(prefix_layers)
+        input_ids = torch.tensor([input_ids], device=self.device)
+        with self.model_lock, torch.no_grad():
+            out = self.model(input_ids=input_ids, past_key_values=past, use_cache=True)
+        return cache_to_layers(out.past_key_values), out.logits[:, -1, :]
+
+    def _admit(self, request):
+        """新请求出错只结束它自己；合并进 batch 时先算好新状态再整体替换，batch 不会处于半更新状态"""
+        if request.cancelled:
+            request._finish()
+            return
+        start = time.perf_counter()
+        try:
+            layers, logits = self._prefill(request)
+            self.stats["requests"] += 1
+
+            token_id = self._sample(logits, [request])[0]
+            if token_id in self.eos_token_ids:
+                self._finish(request, layers)
+                return
+            request._emit(token_id)
+            self.stats["generated_tokens"] += 1
+            if self._is_finished(request, token_id):
+                self._finish(request, layers)
+                return
+
+            length = len(request.input_ids)
+            mask = torch.ones((1, length), dtype=torch.long, device=self.device)
+            if self._active:
+                total = max(self._mask.shape[1], length)
+                state = (
+                    [
+                        (torch.cat([self._pad_left(bk, total), self._pad_left(k, total)]),
+                         torch.cat([self._pad_left(bv, total), self._pad_left(v, total)]))
+                        for (bk, bv), (k, v) in zip(self._layers, layers)
+                    ],
+                    torch.cat([self._pad_left(self._mask, total), self._pad_left(mask, total)]),
+                    torch.cat([self._positions, torch.tensor([length], device=self.device)]),
+                    torch.cat([self._last_tokens, torch.tensor([token_id], device=self.device)]),
+                )
+            else:
+                state = (layers, mask, torch.tensor([length], device=self.device),
+                         torch.tensor([token_id], device=self.device))
+        except Exception as e:
+            request._finish(e)
+            return
+        self._layers, self._mask, self._positions, self._last_tokens = state
+        self._active.append(request)
+        self.stats["busy_time"] += time.perf_counter() - start
+
+    @staticmethod
+    def _pad_left(tensor, total):
+        """在序列维左侧补零：KV 张量序列维是 dim=2，mask 是 dim=1"""
+        seq_dim = 2 if tensor.dim() == 4 else 1
+        missing = total - tensor.shape[seq_dim]
+        if missing <= 0:
+            return tensor
+        shape = list(tensor.shape)
+        shape[seq_dim] = missing
+        return torch.cat([tensor.new_zeros(shape), tensor], dim=seq_dim)
+
+    def _decode_step(self):
+        # 先移出已取消的请求（不保存 KV Cache，回答不完整，不能给下一轮复用）
+        keep = [i for i, request in enumerate(self._active) if not request.cancelled]
+        if len(keep) < len(self._active):
+            for request in self._active:
+                if request.cancelled:
+                    request._finish()
+            self._remove_finished(keep)
+            if not self._active:
+                return
+
+        start = time.perf_counter()
+        batch_size = len(self._active)
+        mask = torch.cat([self._mask, self._mask.new_ones((batch_size, 1))], dim=1)
+        try:
+            with self.model_lock, torch.no_grad():
+                out = self.model(
+                    input_ids=self._last_tokens.unsqueeze(1),
+                    attention_mask=mask,
+                    position_ids=self._positions.unsqueeze(1),
+                    past_key_values=layers_to_cache(self._layers),
+                    use_cache=True,
+                )
+        except Exception as e:
+            self._fail_active(e)
+            return
+
+        self._layers = cache_to_layers(out.past_key_values)
+        self._mask = mask
+        self._positions = self._positions + 1
+
+        tokens = self._sample(out.logits[:, -1, :], self._active)
+        keep = []
+        for i, (request, token_id) in enumerate(zip(self._active, tokens)):
+            if token_id in self.eos_token_ids:
+                self._finish(request, self._row_layers(i))
+                continue
+            request._emit(token_id)
+            if self._is_finished(request, token_id):
+                self._finish(request, self._row_layers(i))
+            else:
+                keep.append(i)
+        self._last_tokens = torch.tensor(tokens, device=self.device)
+
+        self.stats["decode_steps"] += 1
+        self.stats["batch_tokens"] += batch_size
+        self.stats["generated_tokens"] += sum(1 for t in tokens if t not in self.eos_token_ids)
+
+        if len(keep) < batch_size:
+            self._remove_finished(keep)
+        self.stats["busy_time"] += time.perf_counter() - start
+
+    def _row_layers(self, i):
+        """取出 batch 中第 i 条序列的 KV Cache，去掉左侧补齐的位置"""
+        length = int(self._mask[i].sum())
+        return [(k[i:i + 1, :, -length:], v[i:i + 1, :, -length:]) for k, v in self._layers]
+
+    @staticmethod
+    def _finish(request, layers):
+        if request.keep_cache:
+            # 拷贝一份，避免一直引用整个 batch 的大张量
+            request.cache_layers = [(k.clone(), v.clone()) for k, v in layers]
+        request._finish()
+
+    def _remove_finished(self, keep):
+        self._active = [self._active[i] for i in keep]
+        if not keep:
+            self._layers = self._mask = self._positions = self._last_tokens = None
+            return
+        index = torch.tensor(keep, device=self.device)
+        self._layers = [(k.index_select(0, index), v.index_select(0, index)) for k, v in self._layers]
+        self._mask = self._mask.index_select(0, index)
+        self._positions = self._positions.index_select(0, index)
+        self._last_tokens = self._last_tokens.index_select(0, index)
+        # 去掉所有序列都是补齐位置的左侧列，避免 batch 越拖越长
+        valid = self._mask.sum(dim=0).nonzero()
+        first = int(valid[0]) if len(valid) else 0
+        if first > 0:
+            self._layers = [(k[:, :, first:], v[:, :, first:]) for k, v in self._layers]
+            self._mask = self._mask[:, first:]
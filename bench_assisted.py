@@ -0,0 +1,129 @@
+"""
+辅助解码 (speculative decoding) 基准测试
+在 FAQ 问题上对比：大模型单独贪心生成 vs 小模型起草 + 大模型验证，
+统计 tokens/秒、加速比、草稿 token 接受率，并检查两种方式的输出是否一致；
+另外通过 LocalLLM.chat（带 system 提示词，和线上调用路径相同）再生成一次，检查它和普通解码是否一致。
+
+运行：
+    python bench_assisted.py --target D:/AI_LLM_Project/models/qwen/Qwen/Qwen2.5-1.5B-Instruct
+    python bench_assisted.py --num-prompts 20 --max-new-tokens 128 --num-assistant-tokens 8
+"""
+
+import argparse
+import json
+import time
+
+from bench_generation import load_prompts
+from config import setup_environment, ASSISTED_DRAFT_MODEL, ASSISTED_NUM_TOKENS, ASSISTED_TARGET_MODEL, TRAIN_DATA_LARGE
+
+
+class CallCounter:
+    """统计模型前向调用次数：主模型每次调用是一轮验证，草稿模型每次调用起草一个 token"""
+
+    def __init__(self, model):
+        self.calls = 0
+        model.register_forward_hook(self._hook)
+
+    def _hook(self, module, args, output):
+        self.calls += 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="辅助解码基准测试")
+    parser.add_argument("--target", default=ASSISTED_TARGET_MODEL, help="主模型（大模型）")
+    parser.add_argument("--draft", default=ASSISTED_DRAFT_MODEL, help="草稿模型（小模型）")
+    parser.add_argument("--data", default=TRAIN_DATA_LARGE)
+    parser.add_argument("--num-prompts", type=int, default=10)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--num-assistant-tokens", type=int, default=ASSISTED_NUM_TOKENS)
+    parser.add_argument("--output", help="把结果写入 json 文件")
+    args = parser.parse_args()
+    if not args.target:
+        parser.error("请通过 --target 或 config.ASSISTED_TARGET_MODEL 指定主模型")
+
+    setup_environment()
+    import torch
+    from llm_service import LocalLLM
+
+    # 主模型 / 草稿模型都由 LocalLLM 加载，直接 generate 测速，LocalLLM.chat 检查线上路径的输出
+    llm = LocalLLM(base_model=args.target, draft_model=args.draft, num_assistant_tokens=args.num_assistant_tokens,
+                   cpu_precision=None)
+    device, tokenizer, target, draft = llm.device, llm.tokenizer, llm.model, llm.assistant
+    print(f"主模型: {args.target}\n草稿模型: {args.draft}\n设备: {device}")
+    draft.generation_config.num_assistant_tokens_schedule = "constant"  # 固定起草长度，便于对比
+    target_calls, draft_calls = CallCounter(target), CallCounter(draft)
+
+    prompts = load_prompts(args.data, args.num_prompts)
+    print(f"测试问题: {len(prompts)} 条，每条最多生成 {args.max_new_tokens} tokens\n")
+
+    def run(inputs, **kwargs):
+        start = time.perf_counter()
+        with torch.no_grad():
+            out = target.generate(**inputs, max_new_tokens=args.max_new_tokens, do_sample=False, **kwargs)
+        return out[0][inputs["input_ids"].shape[1]:], time.perf_counter() - start
+
+    # 预热，排除首次调用的初始化开销
+    warmup = tokenizer.apply_chat_template(prompts[0], add_generation_prompt=True, return_tensors="pt",
+                                           return_dict=True).to(device)
+    run(warmup)
+    run(warmup, assistant_model=draft)
+
+    totals = {"plain_tokens": 0, "plain_time": 0.0, "assisted_tokens": 0, "assisted_time": 0.0,
+              "rounds": 0, "proposed": 0, "accepted": 0, "identical": 0, "chat_identical": 0}
+    for messages in prompts:
+        if messages[0]["role"] != "system":
+            messages = [{"role": "system", "content": "你是一个有帮助的助手。"}] + messages
+        inputs = tokenizer.apply_chat_template(messages, add_generation_prompt=True, return_tensors="pt",
+                                               return_dict=True).to(device)
+        plain, plain_time = run(inputs)
+
+        target_calls.calls = draft_calls.calls = 0
+        assisted, assisted_time = run(inputs, assistant_model=draft)
+        # 每轮验证产出 (接受的草稿 token + 1 个主模型 token)
+        accepted = max(len(assisted) - target_calls.calls, 0)
+
+        totals["plain_tokens"] += len(plain)
+        totals["plain_time"] += plain_time
+        totals["assisted_tokens"] += len(assisted)
+        totals["assisted_time"] += assisted_time
+        totals["rounds"] += target_calls.calls
+        totals["proposed"] += draft_calls.calls
+        totals["accepted"] += accepted
+        totals["identical"] += int(torch.equal(plain, assisted))
+        chat_reply = llm.chat(messages, max_new_tokens=args.max_new_tokens, do_sample=False)
+        chat_identical = chat_reply == tokenizer.decode(plain, skip_special_tokens=True)
+        totals["chat_identical"] += int(chat_identical)
+        print(f"{messages[-1]['content'][:20]:<22} 普通 {len(plain) / plain_time:6.1f} tok/s | "
+              f"辅助 {len(assisted) / assisted_time:6.1f} tok/s | 接受 {accepted}/{draft_calls.calls}"
+              f"{'' if chat_identical else ' | ⚠️ LocalLLM.chat 输出不一致'}")
+
+    plain_tps = totals["plain_tokens"] / totals["plain_time"]
+    assisted_tps = totals["assisted_tokens"] / totals["assisted_time"]
+    summary = {
+        "target": args.target,
+        "draft": args.draft,
+        "device": device,
+        "num_prompts": len(prompts),
+        "max_new_tokens": args.max_new_tokens,
+        "num_assistant_tokens": args.num_assistant_tokens,
+        "plain_tokens_per_sec": plain_tps,
+        "assisted_tokens_per_sec": assisted_tps,
+        "speedup": assisted_tps / plain_tps,
+        "acceptance_rate": totals["accepted"] / totals["proposed"] if totals["proposed"] else 0.0,
+        "tokens_per_round": totals["assisted_tokens"] / totals["rounds"] if totals["rounds"] else 0.0,
+        "identical_outputs": totals["identical"],
+        "chat_identical_outputs": totals["chat_identical"],
+    }
+
+    print("\n" + "=" * 50)
+    print(f"普通解码:   {plain_tps:.1f} tokens/s")
+    print(f"辅助解码:   {assisted_tps:.1f} tokens/s (加速 {summary['speedup']:.2f}x)")
+    print(f"草稿接受率: {summary['acceptance_rate']:.1%}，每轮验证平均产出 {summary['tokens_per_round']:.2f} tokens")
+    print(f"输出一致:   {totals['identical']}/{len(prompts)}")
+    print(f"LocalLLM.chat 一致: {totals['chat_identical']}/{len(prompts)}")
+    print("=" * 50)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"✅ 结果已保存到 {args.output}")
@@ -0,0 +1,329 @@
+"""
+生成性能基准测试
+预热后对一组 FAQ 问题重复生成 N 轮，统计：
+- TTFT（首 token 延迟）、prefill tokens/秒（prompt 长度 / TTFT）
+- decode tokens/秒（首 token 之后的生成速度）
+- 单次请求延迟的 p50 / p95
+- 峰值内存：CPU 上为进程 RSS 峰值，GPU 上为 torch 峰值显存；另外记录相对测试开始时（模型已加载）的增量
+CPU 上测多个方案时每个方案在单独的子进程里运行：同一进程里前一个方案释放的内存不一定还给系统，
+峰值 RSS 会互相影响，没法直接比较。
+结果写成 json（附带机器、版本和 git commit 信息），不同提交 / 不同机器的结果可以直接 diff。
+step9_quantization.py 用它对比各量化方案。
+
+运行：
+    python bench_generation.py                                   # 当前 BASE_MODEL，默认精度
+    python bench_generation.py --precision fp32 bf16 int8 --output bench_cpu.json
+    python bench_generation.py --lora ./fine_tuned_model --num-prompts 20 --repeats 5
+    python bench_generation.py --precision fp32 int8 --onnx     # 同一组问题再测 onnx_export.py 导出的模型
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+from config import setup_environment, BASE_MODEL, ONNX_MODEL_DIR, TRAIN_DATA_LARGE
+
+# ==========================================
+# 计时 / 内存采样
+# ==========================================
+
+class TokenTimer:
+    """作为 generate 的 streamer，记录每个新 token 的生成时间（第一次 put 是 prompt，跳过）"""
+
+    def __init__(self):
+        self.times = []
+        self._prompt_seen = False
+
+    def put(self, value):
+        if not self._prompt_seen:
+            self._prompt_seen = True
+            return
+        self.times.append(time.perf_counter())
+
+    def end(self):
+        pass
+
+
+class PeakMemory:
+    """
+    with 块内的峰值内存 (MB)：GPU 读 torch 峰值显存，CPU 后台线程采样进程 RSS
+    baseline_mb 是进入 with 时的值，peak_mb - baseline_mb 是生成过程额外占用的内存（KV Cache、激活等）
+    """
+
+    def __init__(self, device, interval=0.005):
+        self.device = device
+        self.interval = interval
+        self.peak_mb = None
+        self.baseline_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.device == "cuda":
+            import torch
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+            self.baseline_mb = torch.cuda.memory_allocated() / 1024 ** 2
+            return self
+        try:
+            import psutil
+        except ImportError:
+            print("⚠️ 未安装 psutil，不统计峰值内存 (pip install psutil)")
+            return self
+        process = psutil.Process()
+        self.peak_mb = self.baseline_mb = process.memory_info().rss / 1024 ** 2
+
+        def sample():
+            while not self._stop.wait(self.interval):
+                self.peak_mb = max(self.peak_mb, process.memory_info().rss / 1024 ** 2)
+
+        self._thread = threading.Thread(target=sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.device == "cuda":
+            import torch
+            torch.cuda.synchronize()
+            self.peak_mb = torch.cuda.max_memory_allocated() / 1024 ** 2
+        elif self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        return False
+
+
+def percentile(values, q):
+    import numpy as np
+    return float(np.percentile(values, q)) if values else 0.0
+
+# ==========================================
+# 基准测试
+# ==========================================
+
+def load_prompts(path=TRAIN_DATA_LARGE, limit=10):
+    """取训练数据里的对话（去掉最后一条标准答案）作为测试 prompt"""
+    prompts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                prompts.append(json.loads(line)["messages"][:-1])
+            if len(prompts) >= limit:
+                break
+    return prompts
+
+
+def time_generate(model, inputs, max_new_tokens):
+    """单次贪心生成，返回 (输出 token, 开始时间, 每个 token 的生成时间)"""
+    import torch
+
+    timer = TokenTimer()
+    start = time.perf_counter()
+    with torch.no_grad():
+        outputs = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False, streamer=timer)
+    return outputs[0][inputs["input_ids"].shape[1]:], start, timer.times
+
+
+def benchmark(model, tokenizer, prompts, device, warmup=2, repeats=3, max_new_tokens=64):
+    """
+    prompts: 消息列表的列表；每条 prompt 重复 repeats 次
+    返回汇总指标字典（时间单位秒，内存单位 MB）
+    """
+    encoded = [
+        tokenizer.apply_chat_template(messages, add_generation_prompt=True, return_tensors="pt",
+                                      return_dict=True).to(device)
+        for messages in prompts
+    ]
+    # 预热：排除首次调用的 kernel 初始化、内存分配等开销
+    for _ in range(warmup):
+        time_generate(model, encoded[0], max_new_tokens)
+
+    latencies, ttfts = [], []
+    prefill_tokens = prefill_time = decode_tokens = decode_time = 0.0
+    with PeakMemory(device) as memory:
+        for _ in range(repeats):
+            for inputs in encoded:
+                new_tokens, start, times = time_generate(model, inputs, max_new_tokens)
+                if not times:
+                    continue
+                ttft = times[0] - start
+                latencies.append(times[-1] - start)
+                ttfts.append(ttft)
+                prefill_tokens += inputs["input_ids"].shape[1]
+                prefill_time += ttft
+                # 首 token 之后的 token 才算 decode
+                decode_tokens += len(times) - 1
+                decode_time += times[-1] - times[0]
+
+    sample = tokenizer.decode(time_generate(model, encoded[0], max_new_tokens)[0], skip_special_tokens=True)
+    return {
+        "num_prompts": len(prompts),
+        "repeats": repeats,
+        "warmup": warmup,
+        "max_new_tokens": max_new_tokens,
+        "requests": len(latencies),
+        "ttft_p50": percentile(ttfts, 50),
+        "ttft_p95": percentile(ttfts, 95),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "prefill_tokens_per_sec": prefill_tokens / prefill_time if prefill_time else 0.0,
+        "decode_tokens_per_sec": decode_tokens / decode_time if decode_time else 0.0,
+        "peak_memory_mb": memory.peak_mb,
+        "memory_delta_mb": memory.peak_mb - memory.baseline_mb if memory.peak_mb is not None else None,
+        "memory_kind": "gpu_allocated" if device == "cuda" else "process_rss",
+        "sample_response": sample,
+    }
+
+
+def print_result(name, result):
+    memory = "-"
+    if result["peak_memory_mb"] is not None:
+        memory = f"{result['peak_memory_mb']:.0f} MB (生成 +{result['memory_delta_mb']:.0f} MB)"
+    print(f"[{name}] TTFT p50 {result['ttft_p50'] * 1000:.0f} ms | "
+          f"prefill {result['prefill_tokens_per_sec']:.0f} tok/s | "
+          f"decode {result['decode_tokens_per_sec']:.1f} tok/s | "
+          f"延迟 p50 {result['latency_p50']:.2f}s p95 {result['latency_p95']:.2f}s | 峰值内存 {memory}")
+
+
+def environment_info(device):
+    """记录运行环境，方便对比不同机器 / 不同提交的结果"""
+    import torch
+    import transformers
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "git_commit": commit,
+        "device": device,
+        "device_name": torch.cuda.get_device_name(0) if device == "cuda" else platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def save_report(path, device, results):
+    """results: 方案名 -> benchmark() 的结果"""
+    report = {"environment": environment_info(device), "results": results}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ 结果已保存到 {path}")
+
+
+def load_variant(model_path, variant, lora=None, device="cpu"):
+    """variant: None（默认精度）/ fp32 / bf16 / int8（CPU）/ "onnx"，返回 (模型, 方案名)"""
+    import torch
+    from transformers import AutoModelForCausalLM
+    from cpu_quantization import prepare_cpu_model
+
+    if variant == "onnx":
+        from optimum.onnxruntime import ORTModelForCausalLM
+        # ONNX 模型导出时已合并 LoRA，这里不再处理 lora
+        return ORTModelForCausalLM.from_pretrained(model_path, use_cache=True), "onnx"
+    model = AutoModelForCausalLM.from_pretrained(model_path, dtype="auto")
+    if lora:
+        from peft import PeftModel
+        model = PeftModel.from_pretrained(model, lora).merge_and_unload()
+    if variant:
+        model = prepare_cpu_model(model, variant)
+    model = model.to(device).eval()
+    return model, variant or str(next(model.parameters()).dtype).replace("torch.", "")
+
+
+def benchmark_in_subprocess(variant, model_path=BASE_MODEL, lora=None, data=TRAIN_DATA_LARGE, num_prompts=10,
+                            warmup=2, repeats=3, max_new_tokens=64):
+    """在新的 Python 进程里加载并测试一个方案，返回 {方案名: 结果}（峰值 RSS 不受之前方案的影响）"""
+    import tempfile
+
+    fd, output = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    cmd = [sys.executable, os.path.abspath(__file__), "--model", model_path, "--variant", variant or "default",
+           "--data", data, "--num-prompts", str(num_prompts), "--warmup", str(warmup),
+           "--repeats", str(repeats), "--max-new-tokens", str(max_new_tokens), "--output", output]
+    if lora:
+        cmd += ["--lora", lora]
+    try:
+        subprocess.run(cmd, check=True)
+        with open(output, "r", encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        os.remove(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成性能基准测试")
+    parser.add_argument("--model", default=BASE_MODEL)
+    parser.add_argument("--lora", help="LoRA 权重目录（测试前先合并进权重）")
+    parser.add_argument("--precision", nargs="+", default=[None],
+                        help="CPU 精度，可填多个依次测试: fp32 bf16 int8（GPU 上忽略）")
+    parser.add_argument("--onnx", nargs="?", const=ONNX_MODEL_DIR,
+                        help=f"同时测试 ONNX Runtime 后端（导出目录，默认 {ONNX_MODEL_DIR}）")
+    parser.add_argument("--data", default=TRAIN_DATA_LARGE)
+    parser.add_argument("--num-prompts", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--output", default="bench_generation.json")
+    parser.add_argument("--variant", help=argparse.SUPPRESS)  # 子进程内部使用：只测这一个方案
+    args = parser.parse_args()
+
+    setup_environment()
+    import torch
+    from transformers import AutoTokenizer
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    settings = dict(warmup=args.warmup, repeats=args.repeats, max_new_tokens=args.max_new_tokens)
+    results = {}
+
+    if args.variant:
+        # 子进程：--model 是要测的模型（onnx 方案时是导出目录），结果只写 {方案名: 结果}
+        variant = None if args.variant == "default" else args.variant
+        model, name = load_variant(args.model, variant, args.lora, device if variant != "onnx" else "cpu")
+        prompts = load_prompts(args.data, args.num_prompts)
+        results[name] = benchmark(model, AutoTokenizer.from_pretrained(args.model), prompts,
+                                  device if variant != "onnx" else "cpu", **settings)
+        if variant != "onnx" and device == "cpu":
+            from cpu_quantization import model_size_mb
+            results[name]["weights_mb"] = model_size_mb(model)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False)
+        sys.exit(0)
+
+    print(f"模型: {args.model}\n设备: {device}\n测试问题: {args.num_prompts} 条 × {args.repeats} 轮，"
+          f"每条最多生成 {args.max_new_tokens} tokens\n")
+    variants = list(args.precision if device == "cpu" else [None])
+    if args.onnx:
+        variants.append("onnx")
+
+    if device == "cpu" and len(variants) > 1:
+        # CPU 上多个方案逐个放到子进程里测，峰值 RSS 才能互相比较
+        for variant in variants:
+            model_path = args.onnx if variant == "onnx" else args.model
+            for name, result in benchmark_in_subprocess(variant, model_path,
+                                                         args.lora if variant != "onnx" else None,
+                                                         args.data, args.num_prompts, **settings).items():
+                results[name] = result
+                print_result(name, result)
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(args.model)
+        prompts = load_prompts(args.data, args.num_prompts)
+        for variant in variants:
+            model_path = args.onnx if variant == "onnx" else args.model
+            model, name = load_variant(model_path, variant, args.lora if variant != "onnx" else None,
+                                       device if variant != "onnx" else "cpu")
+            results[name] = benchmark(model, tokenizer, prompts, device if variant != "onnx" else "cpu", **settings)
+            print_result(name, results[name])
+            del model
+
+    save_report(args.output, device, results)
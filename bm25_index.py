@@ -0,0 +1,129 @@
+"""
+中文字符 n-gram 倒排索引 + BM25 打分
+用于 FAQ 的轻量级词法检索，查询耗时只和命中的倒排链长度有关
+"""
+
+import math
+import re
+from collections import Counter, defaultdict
+
+# ASCII 单词整体作为一个词；其余（中文等）按字切分
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[^\sa-z0-9\W_]", re.UNICODE)
+
+
+def tokenize(text):
+    """
+    把文本切成检索用的词项：
+    - 英文/数字连续片段作为一个词，例如 "wifi"、"2025"
+    - 中文按单字 + 相邻双字（bigram）切分，例如 "年假" -> 年、假、年假
+    标点和空白会被丢弃
+    """
+    text = str(text).lower()
+    terms = []
+    run = []  # 当前连续的中文字符
+
+    def flush_run():
+        terms.extend(run)
+        terms.extend(run[i] + run[i + 1] for i in range(len(run) - 1))
+        run.clear()
+
+    last_end = None
+    for match in _TOKEN_PATTERN.finditer(text):
+        token = match.group(0)
+        # 中间隔了标点/空白，或者遇到英文单词，都会打断双字切分
+        if last_end is not None and match.start() != last_end:
+            flush_run()
+        if len(token) > 1 or token.isascii():
+            flush_run()
+            terms.append(token)
+        else:
+            run.append(token)
+        last_end = match.end()
+    flush_run()
+    return terms
+
+
+class BM25Index:
+    """
+    倒排索引：term -> {doc_id: 词频}
+    支持增量 add / remove，search 只遍历查询词对应的倒排链
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # term -> {doc_id: tf}
+        self.doc_terms = {}                # doc_id -> Counter(term)
+        self.doc_len = {}                  # doc_id -> 词项总数
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_len
+
+    @property
+    def avgdl(self):
+        return self.total_len / len(self.doc_len) if self.doc_len else 0.0
+
+    def add(self, doc_id, text):
+        """加入（或替换）一篇文档"""
+        if doc_id in self.doc_len:
+            self.remove(doc_id)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self.postings[term][doc_id] = tf
+        self.doc_terms[doc_id] = counts
+        self.doc_len[doc_id] = sum(counts.values())
+        self.total_len += self.doc_len[doc_id]
+
+    def remove(self, doc_id):
+        counts = self.doc_terms.pop(doc_id, None)
+        if counts is None:
+            return
+        for term in counts:
+            posting = self.postings[term]
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[term]
+        self.total_len -= self.doc_len.pop(doc_id)
+
+    def clear(self):
+        self.postings.clear()
+        self.doc_terms.clear()
+        self.doc_len.clear()
+        self.total_len = 0
+
+    def idf(self, term):
+        n = len(self.doc_len)
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query, top_k=5):
+        """
+        返回 [(doc_id, score, coverage), ...]，按 score 从高到低排序
+        coverage: 命中的查询词 idf 之和 / 全部查询词 idf 之和，取值 0~1，
+                  可以作为与库大小无关的“匹配程度”阈值
+        """
+        query_terms = Counter(tokenize(query))
+        if not query_terms or not self.doc_len:
+            return []
+
+        avgdl = self.avgdl
+        scores = defaultdict(float)
+        matched_idf = defaultdict(float)
+        total_idf = 0.0
+        for term, qtf in query_terms.items():
+            idf = self.idf(term)
+            total_idf += idf * qtf
+            for doc_id, tf in self.postings.get(term, {}).items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avgdl)
+                scores[doc_id] += qtf * idf * tf * (self.k1 + 1) / norm
+                matched_idf[doc_id] += idf * qtf
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [
+            (doc_id, score, matched_idf[doc_id] / total_idf if total_idf else 0.0)
+            for doc_id, score in ranked
+        ]
@@ -23,10 +23,11 @@ USE_CUSTOM_CACHE = True  # 已启用 D 盘自定义路径
 # 环境变量设置
 # ==========================================
 
-def setup_environment():
+def setup_environment(apply_runtime_profile=True):
     """
     配置运行环境
     在所有脚本开始时调用这个函数
+    apply_runtime_profile：存在本机的运行时配置（python runtime_profile.py 生成）时应用线程数 / 精度 / 注意力实现
     """
     # 设置镜像源（国内加速 - 阿里云镜像）
     os.environ["HF_ENDPOINT"] = "https://mirrors.aliyun.com/huggingface"
@@ -43,6 +44,14 @@ def setup_environment():
         print(f"✅ 已设置模型缓存路径: {CUSTOM_MODEL_CACHE}")
     else:
         print("✅ 使用默认缓存路径")
+
+    if apply_runtime_profile and USE_RUNTIME_PROFILE:
+        from runtime_profile import apply_profile, load_profile
+        profile = load_profile(RUNTIME_PROFILE_FILE)
+        if profile is not None:
+            apply_profile(profile)
+            print(f"✅ 已应用运行时配置: {profile['num_threads']} 线程 / {profile['dtype']} / "
+                  f"{profile['attn_implementation']}")
     
     return os.environ.get("HF_HOME", "default")
 
@@ -75,6 +84,34 @@ EMBEDDING_MODEL = "D:/AI_LLM_Project/models/modelscope/BAAI/bge-small-zh-v1___5"
 DB_FILE = "company_data.db"
 CHROMA_DB_PATH = "./chroma_db"
 
+# 向量库后端：
+#   "chroma" - Chroma + HNSW 近似检索，适合大规模知识库
+#   "numpy"  - 精确暴力检索（.npy memmap + 元数据 json），小知识库启动更快、结果精确
+# numpy 后端的文件也存放在 CHROMA_DB_PATH 目录下
+VECTOR_STORE_BACKEND = "chroma"
+VECTOR_STORE_DTYPE = "float32"  # numpy 后端可改为 "float16" 节省一半内存
+
+# FAQ 词法检索后端：
+#   "memory" - 启动时加载 faq 表到内存，建立 BM25 倒排索引（适合小库）
+#   "fts"    - 使用 SQLite FTS5 全文索引，检索在数据库内完成（适合大库）
+FAQ_RETRIEVER_BACKEND = "memory"
+
+# Embedding 磁盘缓存目录（按模型 + 文本哈希缓存向量，重复入库不再重新编码）
+EMBEDDING_CACHE_DIR = "./embedding_cache"
+
+# 查询向量的内存 LRU 缓存：内存上限（MB）和过期时间（秒，0 表示不过期）
+QUERY_EMBEDDING_CACHE_MB = 16
+QUERY_EMBEDDING_CACHE_TTL = 3600
+
+# Embedding 推理后端：
+#   "torch" - SentenceTransformer (PyTorch)
+#   "onnx"  - ONNX Runtime（先运行 python onnx_embedder.py 导出，会同时输出和原模型的 cos 偏差、速度对比），
+#             分词 / 池化不经过 PyTorch；ONNX_EMBEDDING_INT8=True 时使用 int8 量化版本
+# 切换后端后向量有微小差别，Embedding 缓存会按后端分开存放，向量库下次同步 / 入库时全部重新 Embedding
+EMBEDDING_BACKEND = "torch"
+ONNX_EMBEDDING_DIR = "./onnx_embedding"
+ONNX_EMBEDDING_INT8 = True
+
 # ==========================================
 # 训练输出路径配置
 # ==========================================
@@ -83,10 +120,77 @@ CHROMA_DB_PATH = "./chroma_db"
 FINE_TUNED_MODEL_DIR = "./fine_tuned_model"
 FINE_TUNED_MODEL_4BIT_DIR = "./fine_tuned_model_4bit"
 
+# LoRA 合并后的独立模型（python merge_adapter.py 导出）
+# USE_MERGED_MODEL=True 时，load_llm 发现合并模型比 LoRA 权重新就直接加载它，省去 PeftModel 包装
+MERGED_MODEL_DIR = "./fine_tuned_model_merged"
+USE_MERGED_MODEL = True
+
+# ONNX 导出目录（python onnx_export.py 导出，带 KV Cache 输入输出，LoRA 先合并再导出）
+ONNX_MODEL_DIR = "./onnx_model"
+
 # 训练数据路径
 TRAIN_DATA_SMALL = "train_data.jsonl"
 TRAIN_DATA_LARGE = "train_data_large.jsonl"
 
+# ==========================================
+# 本地推理服务配置
+# ==========================================
+
+# 运行 python inference_server.py 后模型常驻内存，各 step 脚本检测到服务在线会直接调用，
+# 不再各自从磁盘加载模型；服务未启动时自动退回本地加载
+USE_INFERENCE_SERVER = True
+INFERENCE_SERVER_URL = "http://127.0.0.1:8765"
+
+# 连续批处理：多个用户同时提问时合并到同一个 batch 解码，最多同时解码的请求数（1 表示不开启）
+BATCH_SCHEDULER_MAX_BATCH = 8
+
+# 系统提示词前缀的 KV Cache：相同的 system 提示词只 prefill 一次，按 LRU 淘汰（MB，0 表示不开启）
+PREFIX_CACHE_MB = 64
+
+# 多轮对话的会话 KV Cache：每个会话保留上一轮的 KV，下一轮只 prefill 新增内容；
+# 所有会话共用这个内存上限（MB），超出时淘汰最久没用的会话，0 表示不开启
+SESSION_KV_CACHE_MB = 256
+
+# 多轮对话的 prompt 上限（tokens）：超出时从最早的对话开始整轮丢弃，
+# system 提示词和本轮问题（含参考资料）总是保留
+HISTORY_MAX_PROMPT_TOKENS = 1536
+
+# 多 LoRA 服务：inference_server.py 只加载一份基座模型，请求通过 adapter="名字" 选择 LoRA
+# 这里的 LoRA 必须基于 BASE_MODEL 训练；第一次被请求时才加载，
+# 已加载 LoRA 的总内存超过 ADAPTER_CACHE_MB 时卸载最久没用的
+LORA_ADAPTERS = {
+    # "catgirl": "./catgirl_model",  # 示例：注意 catgirl 默认基于 1.5B 模型训练，需改成同一个基座
+}
+ADAPTER_CACHE_MB = 512
+
+# 辅助解码 (speculative decoding)：小模型一次起草几个 token，大模型一次前向验证，
+# 贪心解码结果和大模型单独生成完全一致，CPU 上大模型的生成速度明显提升
+# ASSISTED_TARGET_MODEL 为 None 时不开启；开启后 load_llm / 推理服务以它作为主模型
+# 开启后不复用 prefix / 会话 KV Cache（辅助解码不支持预先填充的 KV Cache），每次请求完整 prefill
+ASSISTED_TARGET_MODEL = None  # 例如 "D:/AI_LLM_Project/models/qwen/Qwen/Qwen2.5-1.5B-Instruct"
+ASSISTED_DRAFT_MODEL = BASE_MODEL
+ASSISTED_NUM_TOKENS = 5  # 草稿模型每轮起草的 token 数
+
+# CPU 推理精度（只在没有 GPU 时生效，可先运行 step9_quantization.py 对比速度和效果）：
+#   None   - 保持模型默认精度 (dtype="auto")
+#   "fp32" - 全精度，CPU 上最稳
+#   "bf16" - 内存减半，支持 BF16 指令的 CPU 上更快
+#   "int8" - Linear 层动态量化，权重内存约 1/4（LoRA 会先合并进权重，之后不能再关闭 / 切换 LoRA，
+#            推理服务不注册 LORA_ADAPTERS，需要基座模型的脚本不会连接它）
+CPU_PRECISION = None
+
+# 推理后端（本地加载模型时）：
+#   "torch" - PyTorch (transformers)，支持 LoRA 切换、连续批处理、KV Cache 复用、辅助解码
+#   "onnx"  - ONNX Runtime，先运行 python onnx_export.py 导出；CPU 上生成更快，
+#             但 LoRA 已合并、不支持上面这些功能；找不到匹配的 ONNX 模型时退回 "torch"
+LLM_BACKEND = "torch"
+
+# 运行时调优配置：运行一次 python runtime_profile.py，在本机实测最快的线程数、精度 (float32 / bfloat16)
+# 和注意力实现 (sdpa / eager)，结果保存到这个文件；之后 setup_environment() 自动设置线程数，
+# LocalLLM 按它加载模型（CPU_PRECISION 不为 None 时精度以 CPU_PRECISION 为准）
+USE_RUNTIME_PROFILE = True
+RUNTIME_PROFILE_FILE = "./runtime_profile.json"
+
 # ==========================================
 # 使用示例
 # ==========================================
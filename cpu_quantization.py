@@ -0,0 +1,41 @@
+"""
+CPU 推理的精度 / 量化选项（不依赖 bitsandbytes，纯 CPU 可用）
+- fp32：CPU 上最稳的默认精度（FP16 矩阵乘法在大多数 CPU 上很慢）
+- bf16：权重和计算都用 bfloat16，内存减半；支持 AVX512-BF16 / AMX 的 CPU 上速度更快
+- int8：Linear 层动态量化（权重 int8，激活在运行时量化），权重内存约为 fp32 的 1/4
+"""
+
+CPU_PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def prepare_cpu_model(model, precision):
+    """按指定精度转换模型，返回转换后的模型（int8 会替换 Linear 层，返回新的模型对象）"""
+    import torch
+
+    if precision == "fp32":
+        return model.float()
+    if precision == "bf16":
+        return model.to(torch.bfloat16)
+    if precision == "int8":
+        from torch.ao.quantization import quantize_dynamic
+        # 动态量化只支持 fp32 的 Linear，先转回 fp32
+        return quantize_dynamic(model.float(), {torch.nn.Linear}, dtype=torch.qint8)
+    raise ValueError(f"不支持的 CPU 精度: {precision}（可选: {', '.join(CPU_PRECISIONS)}）")
+
+
+def model_size_mb(model):
+    """模型权重实际占用的内存（动态量化的 Linear 按 int8 权重计算，共享的权重只算一次）"""
+    from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantizedLinear
+
+    seen, total = set(), 0
+    for module in model.modules():
+        if isinstance(module, DynamicQuantizedLinear):
+            tensors = [module.weight(), module.bias()]
+        else:
+            tensors = list(module.parameters(recurse=False)) + list(module.buffers(recurse=False))
+        for t in tensors:
+            if t is None or id(t) in seen:
+                continue
+            seen.add(id(t))
+            total += t.numel() * t.element_size()
+    return total / 1024 ** 2
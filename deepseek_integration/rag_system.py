@@ -1,16 +1,27 @@
+import hashlib
 import os
 import re
-import chromadb
-from chromadb.config import Settings
+import time
+from concurrent.futures import ThreadPoolExecutor
 from sentence_transformers import SentenceTransformer
 from api_client import DeepSeekClient
 import sys
 
+# Shared retrieval utilities live in the project root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bm25_index import BM25Index
+from hybrid_retriever import HybridRetriever
+from embedding_cache import CachedEmbedder
+from onnx_embedder import load_embedding_model
+from vector_store import open_vector_store
+
 # Add parent directory to path to import global config if needed, 
 # but we will try to be self-contained or use absolute paths.
 # The embedding model path from the root config.py
 LOCAL_EMBEDDING_PATH = "D:/AI_LLM_Project/models/modelscope/BAAI/bge-small-zh-v1___5"
 ONLINE_EMBEDDING_MODEL = "BAAI/bge-small-zh-v1.5"
+# Exported by `python onnx_embedder.py` in the project root
+ONNX_EMBEDDING_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "onnx_embedding")
 
 class DocumentProcessor:
     def __init__(self, file_path):
@@ -68,7 +79,17 @@ class DocumentProcessor:
         return chunks
 
 class RAGSystem:
-    def __init__(self, db_path="./chroma_db", collection_name="company_policy"):
+    def __init__(self, db_path="./chroma_db", collection_name="company_policy",
+                 embedding_cache_dir="./embedding_cache", vector_backend="chroma",
+                 embedding_backend="torch", onnx_embedding_dir=ONNX_EMBEDDING_PATH, onnx_int8=True):
+        """
+        vector_backend: "chroma" (HNSW, for large corpora) or "numpy"
+        (exact brute-force search over a memory-mapped matrix, fast to start
+        for a policy document of a few hundred chunks).
+        embedding_backend: "torch" (SentenceTransformer) or "onnx" (ONNX Runtime
+        export from onnx_embedder.py, optionally int8). Falls back to torch when
+        no export of the same model is found.
+        """
         self.client = DeepSeekClient()
         
         # Initialize Embedding Model
@@ -76,75 +97,174 @@ class RAGSystem:
         try:
             if os.path.exists(LOCAL_EMBEDDING_PATH):
                 print(f"Using local embedding model: {LOCAL_EMBEDDING_PATH}")
-                self.embedding_model = SentenceTransformer(LOCAL_EMBEDDING_PATH)
+                model_id = LOCAL_EMBEDDING_PATH
             else:
                 print(f"Local model not found. Downloading/Using: {ONLINE_EMBEDDING_MODEL}")
-                self.embedding_model = SentenceTransformer(ONLINE_EMBEDDING_MODEL)
+                model_id = ONLINE_EMBEDDING_MODEL
+            # ONNX/int8 vectors differ slightly, so they get their own model id
+            # (separate cache namespace, and ingest re-embeds chunks from another model)
+            model, model_id = load_embedding_model(model_id, embedding_backend, onnx_embedding_dir, onnx_int8)
         except Exception as e:
             print(f"Error loading embedding model: {e}")
             print("Falling back to default sentence-transformers model...")
-            self.embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+            model_id = "all-MiniLM-L6-v2"
+            model = SentenceTransformer(model_id)
+
+        # Content-hash keyed disk cache: unchanged chunks are never re-encoded
+        self.embedding_model = CachedEmbedder(model, model_id, cache_dir=embedding_cache_dir)
+        self.embedding_model_id = model_id
+
+        # Initialize vector store
+        self.collection = open_vector_store(vector_backend, db_path, collection_name, space="cosine")
+
+        # Lexical index over the stored chunks, fused with vector search via RRF.
+        # Chunks are long, so a lexical "decisive" hit is not meaningful here:
+        # the fast path is disabled and both signals are always combined.
+        self.lexical_index = BM25Index()
+        self.chunks = {}  # id -> {"document", "metadata"}
+        stored = self.collection.get(include=["documents", "metadatas"])
+        for doc_id, doc, meta in zip(stored['ids'], stored['documents'], stored['metadatas']):
+            self._index_chunk(doc_id, doc, meta)
+
+        self.retriever = HybridRetriever(
+            lexical_search=self._lexical_search,
+            vector_search=self._vector_search,
+            fast_path=False
+        )
+        self.last_timings = {}
+
+    def _index_chunk(self, doc_id, document, metadata):
+        self.chunks[doc_id] = {"document": document, "metadata": metadata}
+        self.lexical_index.add(doc_id, document)
+
+    def _unindex_chunk(self, doc_id):
+        self.chunks.pop(doc_id, None)
+        self.lexical_index.remove(doc_id)
+
+    def _lexical_search(self, query, top_k):
+        return [
+            {"id": doc_id, "score": score, "coverage": coverage, **self.chunks[doc_id]}
+            for doc_id, score, coverage in self.lexical_index.search(query, top_k=top_k)
+        ]
+
+    @staticmethod
+    def _unpack_results(results, i):
+        return [
+            {"id": doc_id, "document": doc, "metadata": meta, "distance": dist}
+            for doc_id, doc, meta, dist in zip(
+                results['ids'][i], results['documents'][i],
+                results['metadatas'][i], results['distances'][i]
+            )
+        ]
+
+    def _vector_search(self, query, top_k):
+        # Frequent questions are served from the in-memory LRU, skipping the encoder
+        query_embedding = [self.embedding_model.encode_query(query).tolist()]
+        results = self.collection.query(
+            query_embeddings=query_embedding,
+            n_results=top_k
+        )
+        return self._unpack_results(results, 0)
 
-        # Initialize ChromaDB
-        self.chroma_client = chromadb.PersistentClient(path=db_path)
-        self.collection = self.chroma_client.get_or_create_collection(
-            name=collection_name,
-            metadata={"hnsw:space": "cosine"}
+    def _vector_search_many(self, queries, top_k):
+        """One batched encode and one multi-embedding collection.query for all queries."""
+        query_embeddings = self.embedding_model.encode_queries(queries).tolist()
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=top_k
         )
+        return [self._unpack_results(results, i) for i in range(len(queries))]
+
+    def retrieve(self, user_query, n_results=3):
+        """
+        Hybrid (BM25 + vector) retrieval fused with reciprocal-rank fusion.
+        Returns (hits, timings); timings holds per-stage latencies in ms.
+        """
+        return self.retriever.search(user_query, top_k=n_results)
+
+    @staticmethod
+    def chunk_id(chunk):
+        """
+        Stable id derived from source, section path and content hash, so
+        inserting a section elsewhere in the file does not shift other ids.
+        """
+        meta = chunk['metadata']
+        content_hash = hashlib.sha1(chunk['content'].encode('utf-8')).hexdigest()[:16]
+        path_hash = hashlib.sha1(f"{meta['source']}|{meta['section']}".encode('utf-8')).hexdigest()[:8]
+        return f"{path_hash}_{content_hash}"
 
     def ingest_document(self, file_path):
-        """Process and index the document."""
+        """
+        Process and index the document incrementally.
+
+        Only chunks whose (section, content) is new, or whose stored vector came
+        from a different embedding model, are embedded and upserted; chunks that
+        disappeared from the file are deleted from the collection.
+        Returns a report dict with the number of added / deleted / skipped chunks.
+        """
         processor = DocumentProcessor(file_path)
         chunks = processor.parse_markdown()
+        source = os.path.basename(file_path)
         
-        print(f"Found {len(chunks)} chunks. Indexing...")
-        
-        ids = []
-        documents = []
-        metadatas = []
-        embeddings = []
+        print(f"Found {len(chunks)} chunks. Diffing against stored index...")
+
+        # Desired state: stable id -> chunk (identical sections get a counter suffix)
+        desired = {}
+        for chunk in chunks:
+            base_id = self.chunk_id(chunk)
+            doc_id, n = base_id, 1
+            while doc_id in desired:
+                n += 1
+                doc_id = f"{base_id}_{n}"
+            chunk['metadata']['content_hash'] = base_id.split('_')[1]
+            chunk['metadata']['embedding_model'] = self.embedding_model_id
+            desired[doc_id] = chunk
+
+        # Current state for this source: id -> embedding model that produced the vector
+        stored = self.collection.get(where={"source": source}, include=["metadatas"])
+        stored_models = {
+            doc_id: (meta or {}).get('embedding_model')
+            for doc_id, meta in zip(stored['ids'], stored['metadatas'])
+        }
+
+        to_add = [doc_id for doc_id in desired
+                  if doc_id not in stored_models or stored_models[doc_id] != self.embedding_model_id]
+        to_delete = [doc_id for doc_id in stored_models if doc_id not in desired]
+        skipped = len(desired) - len(to_add)
 
         # Batch processing for embeddings to be efficient
         batch_size = 32
-        for i in range(0, len(chunks), batch_size):
-            batch = chunks[i:i+batch_size]
-            batch_texts = [c['content'] for c in batch]
-            
-            # Generate embeddings
-            batch_embeddings = self.embedding_model.encode(batch_texts).tolist()
-            
-            for j, chunk in enumerate(batch):
-                ids.append(f"doc_{i+j}")
-                documents.append(chunk['content'])
-                metadatas.append(chunk['metadata'])
-                embeddings.append(batch_embeddings[j])
-
-        # Add to ChromaDB
-        if ids:
+        for i in range(0, len(to_add), batch_size):
+            batch_ids = to_add[i:i+batch_size]
+            batch = [desired[doc_id] for doc_id in batch_ids]
+            documents = [c['content'] for c in batch]
+            metadatas = [c['metadata'] for c in batch]
+
+            # Generate embeddings (cache hits skip the model entirely)
+            embeddings = self.embedding_model.encode(documents).tolist()
+
             self.collection.upsert(
-                ids=ids,
+                ids=batch_ids,
                 documents=documents,
                 embeddings=embeddings,
                 metadatas=metadatas
             )
-        print("Indexing complete.")
+            for doc_id, doc, meta in zip(batch_ids, documents, metadatas):
+                self._index_chunk(doc_id, doc, meta)
 
-    def query(self, user_query, n_results=3):
-        """Retrieve context and generate answer."""
-        # 1. Embed query
-        query_embedding = self.embedding_model.encode([user_query]).tolist()
-        
-        # 2. Retrieve
-        results = self.collection.query(
-            query_embeddings=query_embedding,
-            n_results=n_results
-        )
-        
-        retrieved_docs = results['documents'][0]
-        retrieved_metas = results['metadatas'][0]
-        
-        # 3. Construct Prompt
-        context_str = "\n\n".join(retrieved_docs)
+        if to_delete:
+            self.collection.delete(ids=to_delete)
+            for doc_id in to_delete:
+                self._unindex_chunk(doc_id)
+
+        report = {"added": len(to_add), "deleted": len(to_delete), "skipped": skipped}
+        print(f"Indexing complete. added={report['added']} deleted={report['deleted']} "
+              f"skipped={report['skipped']} (embedding cache: {self.embedding_model.hits} hits, "
+              f"{self.embedding_model.misses} encoded)")
+        return report
+
+    def _build_prompts(self, user_query, hits):
+        context_str = "\n\n".join(hit['document'] for hit in hits)
         
         system_prompt = """你是一个专业的公司制度咨询助手。
 你的职责是根据提供的【公司制度上下文】回答员工关于公司制度的问题。
@@ -161,25 +281,84 @@ class RAGSystem:
 {context_str}
 
 请根据以上上下文回答用户问题。"""
+        return system_prompt, user_prompt
 
-        # 4. Call LLM
-        print(f"\nThinking... (Retrieving {n_results} chunks)")
+    def query(self, user_query, n_results=3):
+        """Retrieve context and generate answer."""
+        # 1. Retrieve (lexical + vector, fused)
+        hits, timings = self.retrieve(user_query, n_results=n_results)
+        self.last_timings = timings
+        
+        retrieved_metas = [hit['metadata'] for hit in hits]
+        
+        # 2. Construct Prompt
+        system_prompt, user_prompt = self._build_prompts(user_query, hits)
+
+        # 3. Call LLM
+        print(f"\nThinking... (Retrieved {len(hits)} chunks in {timings['total_ms']:.0f}ms)")
         response = self.client.simple_chat(user_prompt, system_prompt=system_prompt)
         
         return response, retrieved_metas
 
+    def query_many(self, questions, n_results=3, max_concurrency=4):
+        """
+        Answer a batch of questions.
+
+        All questions are embedded in one batched encode and retrieved with a
+        single multi-embedding collection.query; the LLM calls then run
+        concurrently, at most `max_concurrency` at a time.
+
+        Returns a list (in input order) of dicts with keys
+        'question', 'answer', 'sources' and 'timings' (ms).
+        """
+        questions = list(questions)
+        if not questions:
+            return []
+
+        # 1. Batched vector retrieval
+        t0 = time.perf_counter()
+        top_k = max(n_results, self.retriever.candidate_k)
+        vector_hits = self._vector_search_many(questions, top_k)
+        vector_ms = (time.perf_counter() - t0) * 1000
+
+        # 2. Per-question lexical pass + fusion (cheap, no model calls)
+        results = []
+        for question, v_hits in zip(questions, vector_hits):
+            hits, timings = self.retriever.search(question, top_k=n_results, vector_hits=v_hits)
+            timings["vector_ms"] = vector_ms / len(questions)  # amortized share of the batch
+            timings["total_ms"] += timings["vector_ms"]
+            results.append({
+                "question": question,
+                "answer": None,
+                "sources": [hit['metadata'] for hit in hits],
+                "timings": timings,
+                "_hits": hits,
+            })
+        print(f"\nRetrieved context for {len(questions)} questions in {vector_ms:.0f}ms (batched). "
+              f"Calling LLM with concurrency {max_concurrency}...")
+
+        # 3. Concurrent LLM calls
+        def generate(item):
+            start = time.perf_counter()
+            system_prompt, user_prompt = self._build_prompts(item["question"], item.pop("_hits"))
+            item["answer"] = self.client.simple_chat(user_prompt, system_prompt=system_prompt)
+            item["timings"]["llm_ms"] = (time.perf_counter() - start) * 1000
+
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            list(executor.map(generate, results))
+
+        for item in results:
+            item["timings"]["total_ms"] = item["timings"]["total_ms"] + item["timings"]["llm_ms"]
+        return results
+
 if __name__ == "__main__":
     # Initialize System
     rag = RAGSystem()
     
-    # Check if we need to ingest (simple check: if collection is empty)
-    if rag.collection.count() == 0:
-        print("Database empty. Ingesting document...")
-        rag.ingest_document("公司制度.txt")
-    else:
-        print(f"Database loaded with {rag.collection.count()} documents.")
-        # Optional: Force re-ingest if needed
-        # rag.ingest_document("公司制度.txt")
+    # Ingestion is incremental: unchanged chunks are skipped, so it is cheap
+    # to sync on every start and picks up edits to the policy file.
+    rag.ingest_document("公司制度.txt")
+    print(f"Database loaded with {rag.collection.count()} documents.")
 
     # Interactive Loop
     print("\n" + "="*50)
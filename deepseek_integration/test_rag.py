@@ -4,9 +4,10 @@ def test_rag():
     print("Initializing RAG System...")
     rag = RAGSystem()
     
-    # Force ingest for the test to ensure data is fresh
+    # Ingest for the test to ensure data is fresh (only changed chunks are re-embedded)
     print("Ingesting document...")
-    rag.ingest_document("公司制度.txt")
+    report = rag.ingest_document("公司制度.txt")
+    print(f"Ingest report: {report}")
     
     test_queries = [
         "迟到怎么扣钱？",
@@ -21,5 +22,12 @@ def test_rag():
         print(f"Answer: {answer}")
         print("Sources:", [m['section'] for m in sources])
 
+    # Batched path: one encode, one collection.query, concurrent LLM calls
+    print("\nTesting query_many...")
+    for item in rag.query_many(test_queries, max_concurrency=4):
+        print(f"\nQuery: {item['question']} ({item['timings']['total_ms']:.0f}ms)")
+        print(f"Answer: {item['answer']}")
+        print("Sources:", [m['section'] for m in item['sources']])
+
 if __name__ == "__main__":
     test_rag()
@@ -0,0 +1,273 @@
+"""
+Embedding 缓存
+- 磁盘缓存：按 (模型标识, 规范化文本哈希) 缓存向量，重复入库时用哈希查找代替模型前向计算
+- 查询缓存：内存 LRU + TTL，高频问题直接跳过 Embedding 前向计算
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+# 注意：本模块也会被 deepseek_integration 引用，那里的 config 是另一个模块，
+# 所以这里不从 config 导入，默认目录由调用方传入（根目录脚本用 config.EMBEDDING_CACHE_DIR）
+DEFAULT_CACHE_DIR = "./embedding_cache"
+
+
+def normalize_text(text):
+    """NFKC 规范化 + 合并空白，避免全角/半角、多余空格导致缓存不命中"""
+    text = unicodedata.normalize("NFKC", str(text))
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def text_hash(text):
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    每个模型一个目录：
+      vectors.f32  所有向量依次追加的 float32 原始数组（读取时 memmap）
+      index.db     SQLite 索引：文本哈希 -> 行号
+      meta.json    模型标识和向量维度
+    只支持单进程写入（进程内多线程由 _lock 保护，没有跨进程文件锁），
+    不要让多个进程同时往同一个缓存目录写。
+    """
+
+    def __init__(self, model_id, cache_dir=DEFAULT_CACHE_DIR):
+        self.model_id = model_id
+        key = hashlib.sha1(model_id.encode("utf-8")).hexdigest()[:16]
+        self.dir = os.path.join(cache_dir, key)
+        os.makedirs(self.dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.meta_path = os.path.join(self.dir, "meta.json")
+        self._lock = threading.Lock()
+        self._memmap = None
+
+        self.dim = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+
+        self._conn = sqlite3.connect(os.path.join(self.dir, "index.db"), check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS entries (hash TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self._conn.commit()
+
+    def _num_rows(self):
+        # 以数据文件大小为准：写数据成功但索引未提交时，多出来的行只是无人引用
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (self.dim * 4)
+
+    def _vectors(self):
+        rows = self._num_rows()
+        if self._memmap is None or self._memmap.shape[0] != rows:
+            self._memmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return self._memmap
+
+    def get_many(self, hashes):
+        """返回 {hash: 向量}，只包含命中的条目"""
+        if not hashes or self.dim is None:
+            return {}
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(hashes))
+            # SQLite 单条语句的参数个数有上限，分批查询
+            for i in range(0, len(unique), 500):
+                batch = unique[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                cursor = self._conn.execute(
+                    f"SELECT hash, row FROM entries WHERE hash IN ({placeholders})", batch
+                )
+                found.update(cursor.fetchall())
+            if not found:
+                return {}
+            vectors = self._vectors()
+            return {h: np.array(vectors[row]) for h, row in found.items()}
+
+    def put_many(self, hashes, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(hashes) == 0:
+            return
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"model_id": self.model_id, "dim": self.dim}, f, ensure_ascii=False)
+            start = self._num_rows()
+            # 上次写到一半中断时文件末尾会多出不足一行的数据，先截掉，否则之后的行号全部错位
+            with open(self.vectors_path, "r+b" if os.path.exists(self.vectors_path) else "wb") as f:
+                f.truncate(start * self.dim * 4)
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(vectors).tobytes())
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (hash, row) VALUES (?, ?)",
+                [(h, start + i) for i, h in enumerate(hashes)]
+            )
+            self._conn.commit()
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+class QueryEmbeddingCache:
+    """
+    规范化查询 -> 向量 的 LRU 缓存
+    max_bytes: 向量占用内存上限；ttl: 过期秒数（0 表示不过期）
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl=3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (向量, 写入时间)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and time.monotonic() - entry[1] > self.ttl:
+                self._pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        if vector.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (vector, time.monotonic())
+            self._bytes += vector.nbytes
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._pop(oldest)
+                self.evictions += 1
+
+    def _pop(self, key):
+        vector, _ = self._entries.pop(key)
+        self._bytes -= vector.nbytes
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class CachedEmbedder:
+    """
+    包装 SentenceTransformer（或 onnx_embedder.OnnxEmbedder），对外保持相同的 encode 接口。
+    只有缓存未命中的文本才会真正送进模型，并且一次批量编码。
+    """
+
+    def __init__(self, model, model_id, cache_dir=DEFAULT_CACHE_DIR,
+                 query_cache_bytes=16 * 1024 * 1024, query_cache_ttl=3600):
+        self.model = model
+        self.model_id = model_id
+        self.cache_dir = cache_dir
+        self._caches = {}
+        self.hits = 0
+        self.misses = 0
+        self.query_cache = QueryEmbeddingCache(query_cache_bytes, query_cache_ttl)
+
+    def encode_queries(self, queries, batch_size=32, **kwargs):
+        """批量编码查询：LRU 命中的直接返回，未命中的合并成一次批量编码"""
+        suffix = f"|{json.dumps(kwargs, sort_keys=True, default=str)}" if kwargs else ""
+        keys = [normalize_text(q) + suffix for q in queries]
+        vectors = {}
+        missing = {}
+        for key, query in zip(keys, queries):
+            if key in vectors or key in missing:
+                continue
+            vector = self.query_cache.get(key)
+            if vector is None:
+                missing[key] = query
+            else:
+                vectors[key] = vector
+        if missing:
+            encoded = self.model.encode(list(missing.values()), batch_size=batch_size, **kwargs)
+            for key, vector in zip(missing.keys(), np.asarray(encoded, dtype=np.float32)):
+                self.query_cache.put(key, vector)
+                vectors[key] = vector
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[k] for k in keys])
+
+    def encode_query(self, query, **kwargs):
+        """
+        编码单条查询：先查内存 LRU，未命中才调用模型。
+        查询不写磁盘缓存，避免用户输入让缓存文件无限增长。
+        """
+        key = normalize_text(query)
+        if kwargs:
+            key = f"{key}|{json.dumps(kwargs, sort_keys=True, default=str)}"
+        vector = self.query_cache.get(key)
+        if vector is None:
+            vector = np.asarray(self.model.encode(query, **kwargs), dtype=np.float32)
+            self.query_cache.put(key, vector)
+        return vector
+
+    def _cache_for(self, encode_kwargs):
+        # normalize_embeddings 等参数会改变输出，单独分一个缓存空间
+        key = json.dumps(encode_kwargs, sort_keys=True, default=str)
+        if key not in self._caches:
+            model_id = self.model_id if key == "{}" else f"{self.model_id}|{key}"
+            self._caches[key] = EmbeddingCache(model_id, self.cache_dir)
+        return self._caches[key]
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, use_cache=True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        if not use_cache:
+            return self.model.encode(sentences, batch_size=batch_size,
+                                     show_progress_bar=show_progress_bar, **kwargs)
+
+        cache = self._cache_for(kwargs)
+        hashes = [text_hash(t) for t in texts]
+        cached = cache.get_many(hashes)
+
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+        self.hits += len(texts) - sum(1 for h in hashes if h in missing)
+        self.misses += len(missing)
+
+        if missing:
+            new_vectors = self.model.encode(list(missing.values()), batch_size=batch_size,
+                                            show_progress_bar=show_progress_bar, **kwargs)
+            new_vectors = np.asarray(new_vectors, dtype=np.float32)
+            cache.put_many(list(missing.keys()), new_vectors)
+            cached.update(zip(missing.keys(), new_vectors))
+
+        if not texts:
+            return np.zeros((0, cache.dim or 0), dtype=np.float32)
+        result = np.stack([cached[h] for h in hashes])
+        return result[0] if single else result
+
+    def __getattr__(self, name):
+        # 其他属性（如 get_sentence_embedding_dimension）透传给原模型
+        return getattr(self.model, name)
@@ -0,0 +1,185 @@
+"""
+批量评测：对比基座模型和 LoRA 微调后的回答准确度
+问答对来自训练数据 (jsonl) 或知识库 faq 表，按 batch 左侧补齐后一起生成，
+统计完全匹配 (EM)、字符重叠 F1 和吞吐量（问题/秒、tokens/秒）。
+
+运行：
+    python eval_adapter.py                             # train_data_large.jsonl，基座 vs fine_tuned_model
+    python eval_adapter.py --source db --batch-size 16 # 用 company_data.db 的 faq 表
+    python eval_adapter.py --lora ./other_adapter --output eval_result.json
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+import unicodedata
+from collections import Counter
+
+from config import setup_environment, DB_FILE, FINE_TUNED_MODEL_DIR, TRAIN_DATA_LARGE
+
+# 与 step6 生成训练数据时使用的 system 提示词一致
+DB_SYSTEM_PROMPT = "你是FutureAI公司的智能助手，必须根据内部知识库准确回答员工问题。"
+
+# ==========================================
+# 加载评测数据
+# ==========================================
+
+def load_jsonl_samples(path):
+    """每行 {"messages": [system, user, assistant]}，最后一条 assistant 作为标准答案"""
+    samples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            messages = json.loads(line)["messages"]
+            if messages[-1]["role"] != "assistant":
+                continue
+            samples.append({
+                "messages": messages[:-1],
+                "question": messages[-2]["content"],
+                "answer": messages[-1]["content"],
+            })
+    return samples
+
+
+def load_db_samples(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        rows = conn.execute("SELECT question, answer FROM faq ORDER BY id").fetchall()
+    finally:
+        conn.close()
+    return [
+        {
+            "messages": [{"role": "system", "content": DB_SYSTEM_PROMPT}, {"role": "user", "content": q}],
+            "question": q,
+            "answer": a,
+        }
+        for q, a in rows
+    ]
+
+# ==========================================
+# 评分
+# ==========================================
+
+def normalize(text):
+    """去掉空白和标点，英文转小写"""
+    return "".join(
+        ch.lower() for ch in unicodedata.normalize("NFKC", text)
+        if not ch.isspace() and not unicodedata.category(ch).startswith("P")
+    )
+
+
+def exact_match(prediction, reference):
+    return float(normalize(prediction) == normalize(reference))
+
+
+def char_f1(prediction, reference):
+    """字符级重叠 F1（中文没有空格分词，按字符计算）"""
+    pred, ref = Counter(normalize(prediction)), Counter(normalize(reference))
+    common = sum((pred & ref).values())
+    if common == 0:
+        return 0.0
+    precision = common / sum(pred.values())
+    recall = common / sum(ref.values())
+    return 2 * precision * recall / (precision + recall)
+
+# ==========================================
+# 批量生成 + 统计
+# ==========================================
+
+def evaluate(llm, samples, use_adapter, batch_size=8, max_new_tokens=128):
+    # 按 prompt 长度排序后分 batch，同一 batch 里长度接近，补齐的 token 更少
+    lengths = [len(llm.tokenizer.apply_chat_template(s["messages"], tokenize=False)) for s in samples]
+    order = sorted(range(len(samples)), key=lambda i: lengths[i])
+
+    predictions = [None] * len(samples)
+    generated_tokens = 0
+    start = time.perf_counter()
+    for i in range(0, len(order), batch_size):
+        batch = order[i:i + batch_size]
+        answers, counts = llm.chat_batch(
+            [samples[j]["messages"] for j in batch],
+            max_new_tokens=max_new_tokens, use_adapter=use_adapter, do_sample=False,
+        )
+        for j, answer in zip(batch, answers):
+            predictions[j] = answer
+        generated_tokens += sum(counts)
+        print(f"  {min(i + batch_size, len(order))}/{len(order)}", end="\r", flush=True)
+    elapsed = time.perf_counter() - start
+
+    em = [exact_match(p, s["answer"]) for p, s in zip(predictions, samples)]
+    f1 = [char_f1(p, s["answer"]) for p, s in zip(predictions, samples)]
+    return {
+        "exact_match": sum(em) / len(samples),
+        "char_f1": sum(f1) / len(samples),
+        "questions": len(samples),
+        "elapsed": elapsed,
+        "questions_per_sec": len(samples) / elapsed,
+        "tokens_per_sec": generated_tokens / elapsed,
+        "predictions": [
+            {"question": s["question"], "answer": s["answer"], "prediction": p, "exact_match": e, "char_f1": f}
+            for s, p, e, f in zip(samples, predictions, em, f1)
+        ],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量评测基座模型 / LoRA 微调模型")
+    parser.add_argument("--source", choices=["jsonl", "db"], default="jsonl", help="问答对来源")
+    parser.add_argument("--data", default=TRAIN_DATA_LARGE, help="jsonl 数据文件")
+    parser.add_argument("--db", default=DB_FILE, help="数据库文件（--source db 时使用）")
+    parser.add_argument("--lora", default=FINE_TUNED_MODEL_DIR, help="要评测的 LoRA 权重目录")
+    parser.add_argument("--no-base", action="store_true", help="不评测基座模型")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--limit", type=int, default=0, help="只评测前 N 条，0 表示全部")
+    parser.add_argument("--output", help="把每条预测和汇总结果写入 json 文件")
+    args = parser.parse_args()
+
+    setup_environment()
+    from llm_service import LocalLLM
+
+    samples = load_jsonl_samples(args.data) if args.source == "jsonl" else load_db_samples(args.db)
+    if args.limit:
+        samples = samples[:args.limit]
+    print(f"评测数据: {len(samples)} 条 (来源: {args.source})")
+
+    lora_path = args.lora if os.path.exists(args.lora) else None
+    if lora_path is None:
+        print(f"⚠️ 未找到 LoRA 权重 {args.lora}，只评测基座模型")
+    # 只加载一次模型，基座模型的结果通过临时关闭 LoRA 得到
+    llm = LocalLLM(lora_path=lora_path)
+
+    variants = []
+    if not args.no_base or lora_path is None:
+        variants.append(("base", False))
+    if lora_path:
+        variants.append(("lora", True))
+
+    results = {}
+    for name, use_adapter in variants:
+        print(f"\n正在评测: {name}")
+        results[name] = evaluate(llm, samples, use_adapter, args.batch_size, args.max_new_tokens)
+
+    print("\n" + "=" * 70)
+    print(f"{'模型':<8}{'EM':>8}{'字符F1':>10}{'问题/秒':>10}{'tokens/秒':>12}{'耗时(s)':>10}")
+    print("-" * 70)
+    for name, r in results.items():
+        print(f"{name:<8}{r['exact_match']:>8.1%}{r['char_f1']:>10.3f}{r['questions_per_sec']:>10.2f}"
+              f"{r['tokens_per_sec']:>12.1f}{r['elapsed']:>10.1f}")
+    print("=" * 70)
+
+    if args.output:
+        report = {
+            "source": args.source,
+            "data": args.data if args.source == "jsonl" else args.db,
+            "lora": lora_path,
+            "batch_size": args.batch_size,
+            "max_new_tokens": args.max_new_tokens,
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ 结果已保存到 {args.output}")
@@ -0,0 +1,357 @@
+"""
+FAQ 知识库检索器
+一次性加载 faq 表并常驻内存，供 step5 / step7 等脚本共享
+"""
+
+import os
+import sqlite3
+import threading
+
+from config import DB_FILE, FAQ_RETRIEVER_BACKEND
+from bm25_index import BM25Index
+
+# 有 min_coverage 过滤时至少先取这么多候选再过滤，避免排第一的不达标时把后面达标的也丢掉
+CANDIDATE_POOL = 10
+
+
+# ==========================================
+# 常驻内存的 FAQ 检索器
+# ==========================================
+
+class FAQRetriever:
+    """
+    把 faq 表加载到内存里，按 id / 问题建立索引，
+    并对问题建立字符 n-gram 倒排索引（BM25 打分）。
+
+    每次查询前只做一次 os.stat 检查数据库文件是否变化：
+    - 文件没变：直接用内存数据
+    - 有变更日志 faq_changes（step6 建的库）且知识库代号没变：只重新读取日志里增删改过的行
+    - 其他情况（没有变更日志、数据库重建）：整表重新加载
+    刷新时先在新的 dict 里改好再替换引用，查询不会读到改了一半的数据。
+    """
+
+    def __init__(self, db_file=DB_FILE):
+        self.db_file = db_file
+        self.rows = {}           # id -> {"id", "category", "question", "answer"}
+        self.by_question = {}    # question -> id
+        self.index = BM25Index()  # 问题的倒排索引，只在持有 _lock 时读写
+        self._mtime = None
+        self._log_state = None   # (知识库代号, 已处理到的变更日志 seq)
+        self._lock = threading.Lock()
+        self.refresh()
+
+    # ---------- 数据加载 ----------
+
+    def _connect(self):
+        return sqlite3.connect(self.db_file)
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.db_file).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _read_log_state(conn):
+        """(知识库代号, 变更日志最大 seq)；数据库没有变更日志时返回 None"""
+        row = conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ('faq_changes', 'kb_meta')"
+        ).fetchone()
+        if row[0] != 2:
+            return None
+        generation = conn.execute("SELECT value FROM kb_meta WHERE key = 'generation'").fetchone()
+        max_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM faq_changes").fetchone()[0]
+        return generation[0] if generation else None, max_seq
+
+    @staticmethod
+    def _make_row(row_id, category, question, answer):
+        return {"id": row_id, "category": category, "question": question, "answer": answer}
+
+    def _full_reload(self, conn):
+        rows, by_question, index = {}, {}, BM25Index()
+        for row in conn.execute("SELECT id, category, question, answer FROM faq ORDER BY id"):
+            rows[row[0]] = self._make_row(*row)
+            by_question[row[2]] = row[0]
+            index.add(row[0], row[2])
+        self.index = index
+        self.rows, self.by_question = rows, by_question
+
+    def _apply_changes(self, conn, changed_ids):
+        """按变更日志更新：changed_ids 里还在表里的行重新读取，不在的删除"""
+        fetched = {}
+        for i in range(0, len(changed_ids), 500):
+            batch = changed_ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            for row in conn.execute(
+                f"SELECT id, category, question, answer FROM faq WHERE id IN ({placeholders})", batch
+            ):
+                fetched[row[0]] = row
+
+        rows, by_question = dict(self.rows), dict(self.by_question)
+        for row_id in changed_ids:
+            old = rows.pop(row_id, None)
+            if old is not None and by_question.get(old["question"]) == row_id:
+                del by_question[old["question"]]
+            if row_id in fetched:
+                rows[row_id] = self._make_row(*fetched[row_id])
+                by_question[rows[row_id]["question"]] = row_id
+                self.index.add(row_id, rows[row_id]["question"])
+            else:
+                self.index.remove(row_id)
+        self.rows, self.by_question = rows, by_question
+
+    def refresh(self):
+        """数据库文件有变化时刷新内存数据，返回是否发生了刷新"""
+        mtime = self._file_mtime()
+        if mtime is None or mtime == self._mtime:
+            return False
+
+        with self._lock:
+            if mtime == self._mtime:
+                return False
+            conn = self._connect()
+            try:
+                log_state = self._read_log_state(conn)
+                if (self._mtime is not None and log_state is not None and self._log_state is not None
+                        and log_state[0] == self._log_state[0] and log_state[1] >= self._log_state[1]):
+                    changed_ids = [r[0] for r in conn.execute(
+                        "SELECT DISTINCT faq_id FROM faq_changes WHERE seq > ? AND seq <= ?",
+                        (self._log_state[1], log_state[1])
+                    )]
+                    self._apply_changes(conn, changed_ids)
+                else:
+                    self._full_reload(conn)
+                self._log_state = log_state
+            finally:
+                conn.close()
+            self._mtime = mtime
+        return True
+
+    # ---------- 查询接口 ----------
+
+    def get(self, row_id):
+        self.refresh()
+        return self.rows.get(row_id)
+
+    def get_by_question(self, question):
+        self.refresh()
+        row = self.rows.get(self.by_question.get(question))
+        # 刷新可能正好发生在两次读取之间，问题对不上时当作没找到
+        return row if row is not None and row["question"] == question else None
+
+    def questions(self):
+        self.refresh()
+        return list(self.by_question.keys())
+
+    def search_topk(self, query, top_k=5, min_coverage=0.0):
+        """
+        BM25 检索，返回前 top_k 条记录（带 score / coverage 字段）
+        coverage 是查询词按 idf 加权的命中比例，用来过滤不相关的结果
+        """
+        if not isinstance(query, str):
+            query = str(query)
+        self.refresh()
+        pool = max(top_k, CANDIDATE_POOL) if min_coverage > 0 else top_k
+        with self._lock:
+            ranked = self.index.search(query, top_k=pool)
+            rows = self.rows
+        results = []
+        for row_id, score, coverage in ranked:
+            if coverage < min_coverage:
+                continue
+            hit = dict(rows[row_id])
+            hit["score"] = score
+            hit["coverage"] = coverage
+            results.append(hit)
+        return results[:top_k]
+
+    def search(self, query, min_coverage=0.25):
+        """返回和 query 最像的一条 FAQ 记录，找不到返回 None"""
+        results = self.search_topk(query, top_k=1, min_coverage=min_coverage)
+        return results[0] if results else None
+
+    def __len__(self):
+        self.refresh()
+        return len(self.rows)
+
+
+# ==========================================
+# SQLite FTS5 全文索引（检索在数据库内完成）
+# ==========================================
+
+FTS_TABLE = "faq_fts"
+
+_FTS_SCHEMA = [
+    # trigram 分词器对中文友好（按 3 字滑窗建索引），需要 SQLite >= 3.34
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        question, answer,
+        content='faq', content_rowid='id',
+        tokenize='trigram'
+    )
+    """,
+    # 用触发器保证 faq 表的增删改同步到全文索引
+    f"""
+    CREATE TRIGGER IF NOT EXISTS faq_fts_ai AFTER INSERT ON faq BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, question, answer) VALUES (new.id, new.question, new.answer);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS faq_fts_ad AFTER DELETE ON faq BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, question, answer) VALUES ('delete', old.id, old.question, old.answer);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS faq_fts_au AFTER UPDATE ON faq BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, question, answer) VALUES ('delete', old.id, old.question, old.answer);
+        INSERT INTO {FTS_TABLE}(rowid, question, answer) VALUES (new.id, new.question, new.answer);
+    END
+    """,
+]
+
+
+def create_fts_index(conn):
+    """在 faq 表旁边创建 FTS5 全文索引和同步触发器，并用现有数据重建索引"""
+    for sql in _FTS_SCHEMA:
+        conn.execute(sql)
+    conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    conn.commit()
+
+
+def has_fts_index(conn):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+    ).fetchone()
+    return row is not None
+
+
+def _fts_grams(text):
+    """去掉标点空白后切成 3 字滑窗；不足 3 个字时返回原文本"""
+    chars = "".join(ch for ch in str(text).lower() if ch.isalnum())
+    if len(chars) < 3:
+        return [chars] if chars else []
+    return list(dict.fromkeys(chars[i:i + 3] for i in range(len(chars) - 2)))
+
+
+class FTSRetriever:
+    """
+    基于 FTS5 的检索器，接口与 FAQRetriever.search / search_topk 一致。
+    匹配和 BM25 排序都在 SQLite 里完成，Python 只拿回前 top_k 条，
+    适合几十万行以上、不适合整表加载到内存的知识库。
+    """
+
+    def __init__(self, db_file=DB_FILE):
+        self.db_file = db_file
+        self._local = threading.local()
+
+    def _conn(self):
+        # sqlite3 连接不能跨线程共享（Gradio 会在工作线程里调用），每个线程各建一个
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file)
+            self._local.conn = conn
+        return conn
+
+    @property
+    def available(self):
+        try:
+            return has_fts_index(self._conn())
+        except sqlite3.Error:
+            return False
+
+    def search_topk(self, query, top_k=5, min_coverage=0.0):
+        """
+        coverage 为查询的 3 字片段在问题中的命中比例
+        """
+        if not isinstance(query, str):
+            query = str(query)
+        grams = _fts_grams(query)
+        if not grams:
+            return []
+
+        conn = self._conn()
+        pool = max(top_k, CANDIDATE_POOL) if min_coverage > 0 else top_k
+        if len(grams[0]) >= 3:
+            match_expr = " OR ".join('"' + g.replace('"', '""') + '"' for g in grams)
+            # bm25() 越小越相关；问题列权重高于答案列
+            cursor = conn.execute(
+                f"""
+                SELECT faq.id, faq.category, faq.question, faq.answer, -bm25({FTS_TABLE}, 2.0, 1.0) AS score
+                FROM {FTS_TABLE} JOIN faq ON faq.id = {FTS_TABLE}.rowid
+                WHERE {FTS_TABLE} MATCH ?
+                ORDER BY bm25({FTS_TABLE}, 2.0, 1.0)
+                LIMIT ?
+                """,
+                (match_expr, pool)
+            )
+        else:
+            # 少于 3 个字无法走 trigram 索引，退化为 LIKE 子串匹配
+            cursor = conn.execute(
+                "SELECT id, category, question, answer, 0.0 FROM faq WHERE question LIKE ? LIMIT ?",
+                (f"%{grams[0]}%", pool)
+            )
+
+        results = []
+        for row_id, category, question, answer, score in cursor.fetchall():
+            question_text = "".join(ch for ch in question.lower() if ch.isalnum())
+            coverage = sum(1 for g in grams if g in question_text) / len(grams)
+            if coverage < min_coverage:
+                continue
+            results.append({
+                "id": row_id,
+                "category": category,
+                "question": question,
+                "answer": answer,
+                "score": score,
+                "coverage": coverage,
+            })
+        return results[:top_k]
+
+    def search(self, query, min_coverage=0.25):
+        results = self.search_topk(query, top_k=1, min_coverage=min_coverage)
+        return results[0] if results else None
+
+
+# 进程内共享的检索器实例（按数据库路径区分）
+_retrievers = {}
+_retrievers_lock = threading.Lock()
+
+
+def get_retriever(db_file=DB_FILE, backend=None):
+    """
+    获取共享的检索器，同一个数据库只加载一次
+    backend: "memory" 内存 BM25（默认）/ "fts" SQLite FTS5 全文索引
+    """
+    backend = backend or FAQ_RETRIEVER_BACKEND
+    path = os.path.abspath(db_file)
+    with _retrievers_lock:
+        key = (path, backend)
+        if key not in _retrievers:
+            if backend == "fts":
+                retriever = FTSRetriever(db_file)
+                if not retriever.available:
+                    print(f"⚠️ {db_file} 中没有 {FTS_TABLE} 全文索引，请先运行 step6_create_large_db.py，改用内存检索")
+                    retriever = FAQRetriever(db_file)
+            else:
+                retriever = FAQRetriever(db_file)
+            _retrievers[key] = retriever
+        return _retrievers[key]
+
+
+if __name__ == "__main__":
+    memory_retriever = get_retriever(backend="memory")
+    log_state = memory_retriever._log_state
+    print(f"✅ 已加载 {len(memory_retriever)} 条 FAQ 记录 "
+          f"(变更日志 seq: {log_state[1] if log_state else '无变更日志'})")
+    retrievers = [("内存BM25", memory_retriever)]
+    fts_retriever = FTSRetriever()
+    if fts_retriever.available:
+        retrievers.append(("FTS5", fts_retriever))
+
+    for q in ["Wifi密码是多少啊？", "你们公司几点上班？", "老板是谁？"]:
+        for name, retriever in retrievers:
+            hit = retriever.search(q)
+            if hit:
+                print(f"[{name}] {q} -> {hit['question']} (BM25: {hit['score']:.2f}, 覆盖率: {hit['coverage']:.2f})")
+            else:
+                print(f"[{name}] {q} -> 未找到")
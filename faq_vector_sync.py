@@ -0,0 +1,260 @@
+"""
+FAQ 向量库增量同步
+把 company_data.db 里 faq 表的变化（新增 / 修改 / 删除）同步到向量库（Chroma 或 NumPy 后端），
+只对变化的行做 Embedding，可以每分钟定时运行。
+
+运行：
+    python faq_vector_sync.py              # 同步一次
+    python faq_vector_sync.py --interval 60  # 常驻，每 60 秒同步一次
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+from config import DB_FILE, CHROMA_DB_PATH
+
+# ==========================================
+# 数据库侧：变更日志
+# ==========================================
+
+CHANGE_LOG_SCHEMA = [
+    # 知识库“代号”：step6 每次重建数据库都会生成新的代号，同步端据此判断要不要全量对账
+    """
+    CREATE TABLE IF NOT EXISTS kb_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    """,
+    # 变更日志：每次增删改追加一行，seq 单调递增，作为同步水位线
+    """
+    CREATE TABLE IF NOT EXISTS faq_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        faq_id INTEGER NOT NULL,
+        op TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS faq_changes_ai AFTER INSERT ON faq BEGIN
+        INSERT INTO faq_changes (faq_id, op) VALUES (new.id, 'insert');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS faq_changes_au AFTER UPDATE ON faq BEGIN
+        INSERT INTO faq_changes (faq_id, op) VALUES (new.id, 'update');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS faq_changes_ad AFTER DELETE ON faq BEGIN
+        INSERT INTO faq_changes (faq_id, op) VALUES (old.id, 'delete');
+    END
+    """,
+]
+
+
+def create_change_log(conn):
+    """创建变更日志表和触发器，并写入新的知识库代号"""
+    for sql in CHANGE_LOG_SCHEMA:
+        conn.execute(sql)
+    conn.execute(
+        "INSERT OR REPLACE INTO kb_meta (key, value) VALUES ('generation', ?)",
+        (uuid.uuid4().hex,)
+    )
+    conn.commit()
+
+
+def row_hash(category, question, answer):
+    return hashlib.sha1(f"{category}\x1f{question}\x1f{answer}".encode("utf-8")).hexdigest()
+
+
+# ==========================================
+# 同步器
+# ==========================================
+
+class FAQVectorSync:
+    """
+    两种同步方式：
+    - 增量：数据库有变更日志且代号没变时，只读取 seq > 水位线 的变更
+    - 全量对账：首次同步 / 数据库被重建 / 旧数据库没有变更日志 / 换了 Embedding 模型时，
+      按内容哈希和向量库逐条比对，内容没变的行依然跳过 Embedding
+    model_id 是 Embedding 模型标识（onnx_embedder.resolve_embedding_model），记录在水位线和每条向量的元数据里，
+    换了模型 / 后端 / 量化方式时，旧模型算出的向量全部重新 Embedding
+    """
+
+    def __init__(self, collection, db_file=DB_FILE, state_path=None, batch_size=256, model_id=None):
+        self.collection = collection
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.model_id = model_id
+        self.state_path = state_path or os.path.join(
+            CHROMA_DB_PATH, f"faq_sync_state_{collection.name}.json"
+        )
+
+    # ---------- 水位线 ----------
+
+    def load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {"generation": None, "last_seq": 0, "model_id": None}
+
+    def save_state(self, state):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    # ---------- 计算需要同步的内容（不需要 Embedding 模型） ----------
+
+    @staticmethod
+    def _has_change_log(conn):
+        row = conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ('faq_changes', 'kb_meta')"
+        ).fetchone()
+        return row[0] == 2
+
+    @staticmethod
+    def _fetch_rows(conn, faq_ids=None):
+        sql = "SELECT id, category, question, answer FROM faq"
+        if faq_ids is None:
+            return conn.execute(sql).fetchall()
+        rows = []
+        faq_ids = list(faq_ids)
+        for i in range(0, len(faq_ids), 500):
+            batch = faq_ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows.extend(conn.execute(f"{sql} WHERE id IN ({placeholders})", batch).fetchall())
+        return rows
+
+    def plan(self):
+        """
+        返回同步计划：
+        {"mode", "upserts": [(id, category, question, answer), ...], "deletes": [向量库 id, ...], "state": 新水位线}
+        """
+        state = self.load_state()
+        conn = sqlite3.connect(self.db_file)
+        try:
+            if self._has_change_log(conn):
+                generation = conn.execute("SELECT value FROM kb_meta WHERE key = 'generation'").fetchone()
+                generation = generation[0] if generation else None
+                max_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM faq_changes").fetchone()[0]
+                new_state = {"generation": generation, "last_seq": max_seq, "model_id": self.model_id}
+                incremental = (
+                    state.get("model_id") == self.model_id
+                    and state["generation"] == generation
+                    and state["last_seq"] <= max_seq
+                    and (self.collection.count() > 0 or state["last_seq"] == 0)
+                )
+                if incremental:
+                    changed_ids = [r[0] for r in conn.execute(
+                        "SELECT DISTINCT faq_id FROM faq_changes WHERE seq > ? AND seq <= ?",
+                        (state["last_seq"], max_seq)
+                    )]
+                    rows = self._fetch_rows(conn, changed_ids)
+                    alive = {r[0] for r in rows}
+                    return {
+                        "mode": "incremental",
+                        "upserts": rows,
+                        "deletes": [f"faq_{i}" for i in changed_ids if i not in alive],
+                        "state": new_state,
+                    }
+            else:
+                new_state = {"generation": None, "last_seq": 0, "model_id": self.model_id}
+
+            rows = self._fetch_rows(conn)
+        finally:
+            conn.close()
+
+        # 全量对账：比较内容哈希和算出向量的模型
+        stored = self.collection.get(include=["metadatas"])
+        stored_key = {
+            doc_id: ((meta or {}).get("content_hash"), (meta or {}).get("embedding_model"))
+            for doc_id, meta in zip(stored["ids"], stored["metadatas"])
+        }
+        desired_ids = set()
+        upserts = []
+        for row in rows:
+            doc_id = f"faq_{row[0]}"
+            desired_ids.add(doc_id)
+            if stored_key.get(doc_id) != (row_hash(*row[1:]), self.model_id):
+                upserts.append(row)
+        deletes = [doc_id for doc_id in stored_key if doc_id not in desired_ids]
+        return {"mode": "full", "upserts": upserts, "deletes": deletes, "state": new_state}
+
+    # ---------- 执行同步 ----------
+
+    def _metadata(self, row):
+        meta = {"faq_id": row[0], "category": row[1], "question": row[2], "content_hash": row_hash(*row[1:])}
+        if self.model_id is not None:
+            meta["embedding_model"] = self.model_id
+        return meta
+
+    def apply(self, plan, embedder):
+        """按计划分批 Embedding 并写入向量库；embedder 只有在有新增/修改时才会用到"""
+        for i in range(0, len(plan["upserts"]), self.batch_size):
+            batch = plan["upserts"][i:i + self.batch_size]
+            embeddings = embedder.encode([r[2] for r in batch])
+            self.collection.upsert(
+                ids=[f"faq_{r[0]}" for r in batch],
+                embeddings=[list(map(float, e)) for e in embeddings],
+                documents=[r[3] for r in batch],
+                metadatas=[self._metadata(r) for r in batch],
+            )
+        for i in range(0, len(plan["deletes"]), self.batch_size):
+            self.collection.delete(ids=plan["deletes"][i:i + self.batch_size])
+        self.save_state(plan["state"])
+        return {"mode": plan["mode"], "upserted": len(plan["upserts"]), "deleted": len(plan["deletes"])}
+
+    def sync(self, embedder):
+        return self.apply(self.plan(), embedder)
+
+
+# ==========================================
+# 命令行：定时同步
+# ==========================================
+
+if __name__ == "__main__":
+    from config import (setup_environment, EMBEDDING_MODEL, EMBEDDING_CACHE_DIR, EMBEDDING_BACKEND,
+                        ONNX_EMBEDDING_DIR, ONNX_EMBEDDING_INT8, VECTOR_STORE_BACKEND, VECTOR_STORE_DTYPE)
+
+    parser = argparse.ArgumentParser(description="同步 FAQ 表到向量库")
+    parser.add_argument("--interval", type=int, default=0, help="常驻模式下的同步间隔（秒），0 表示只同步一次")
+    parser.add_argument("--collection", default="company_kb")
+    args = parser.parse_args()
+
+    setup_environment()
+    from vector_store import open_vector_store
+
+    space = "cosine" if VECTOR_STORE_BACKEND == "numpy" else "l2"
+    store = open_vector_store(VECTOR_STORE_BACKEND, CHROMA_DB_PATH, args.collection, space=space, dtype=VECTOR_STORE_DTYPE)
+    from onnx_embedder import load_embedding_model, resolve_embedding_model
+
+    # 只确定模型标识，不加载模型：换了 Embedding 后端 / 量化方式时 plan 会安排全部重新 Embedding
+    _, model_id = resolve_embedding_model(EMBEDDING_MODEL, EMBEDDING_BACKEND, ONNX_EMBEDDING_DIR, ONNX_EMBEDDING_INT8)
+    syncer = FAQVectorSync(store, model_id=model_id)
+    embedder = None
+
+    while True:
+        start = time.time()
+        plan = syncer.plan()
+        if plan["upserts"] and embedder is None:
+            # 没有变化时不加载 Embedding 模型，定时任务几乎零开销
+            from embedding_cache import CachedEmbedder
+            model, model_id = load_embedding_model(EMBEDDING_MODEL, EMBEDDING_BACKEND, ONNX_EMBEDDING_DIR,
+                                                   ONNX_EMBEDDING_INT8)
+            embedder = CachedEmbedder(model, model_id, EMBEDDING_CACHE_DIR)
+            if model_id != syncer.model_id:
+                # ONNX Runtime 加载失败退回了 SentenceTransformer，按实际的模型重新对账
+                syncer.model_id = model_id
+                plan = syncer.plan()
+        report = syncer.apply(plan, embedder)
+        print(f"✅ [{report['mode']}] 更新 {report['upserted']} 条 / 删除 {report['deleted']} 条 "
+              f"(耗时 {time.time() - start:.2f}s)")
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,72 @@
+"""
+对话历史管理：按 token 预算裁剪多轮对话
+用真实的 tokenizer 计数，始终保留 system 提示词和本轮用户消息（含参考资料），
+剩余预算从最近的对话往前保留，超出的旧对话按整轮丢弃，
+这样长会话的 prompt 长度有上限，每轮延迟保持稳定。
+"""
+
+from config import HISTORY_MAX_PROMPT_TOKENS
+
+
+class HistoryManager:
+    def __init__(self, tokenizer, max_prompt_tokens=HISTORY_MAX_PROMPT_TOKENS):
+        self.tokenizer = tokenizer
+        self.max_prompt_tokens = max_prompt_tokens
+        self._overhead = None
+
+    def count(self, messages):
+        """按聊天模板渲染后的真实 token 数（含生成提示）"""
+        text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return len(self.tokenizer(text).input_ids)
+
+    def _text_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False).input_ids)
+
+    def message_tokens(self, message):
+        """单条消息的 token 数 = 内容 + 模板给每条消息加的固定开销（<|im_start|>role ... <|im_end|>）"""
+        if self._overhead is None:
+            base = [{"role": "system", "content": "x"}]
+            full = base + [{"role": "user", "content": "x"}]
+            render = lambda msgs: self.tokenizer.apply_chat_template(msgs, tokenize=False)
+            self._overhead = self._text_tokens(render(full)) - self._text_tokens(render(base)) - self._text_tokens("x")
+        return self._text_tokens(message["content"]) + self._overhead
+
+    @staticmethod
+    def _split_turns(history):
+        """按用户消息切分成轮：[[user, assistant], [user, assistant], ...]"""
+        turns = []
+        for msg in history:
+            if msg["role"] == "user" or not turns:
+                turns.append([])
+            turns[-1].append(msg)
+        return turns
+
+    def fit(self, system_messages, history, current):
+        """
+        返回 (messages, report)
+        - system_messages / current 总是保留
+        - history 从最近一轮往前保留，直到放不下为止
+        report: {"prompt_tokens", "history_tokens", "trimmed_tokens", "dropped_turns"}
+        """
+        budget = self.max_prompt_tokens - self.count(list(system_messages) + [current])
+
+        kept, kept_tokens, trimmed_tokens, dropped = [], 0, 0, 0
+        turns = self._split_turns(history)
+        for i in range(len(turns) - 1, -1, -1):
+            tokens = sum(self.message_tokens(m) for m in turns[i])
+            if kept_tokens + tokens > budget:
+                # 更早的对话全部丢弃，保证保留下来的是连续的最近几轮
+                dropped = i + 1
+                trimmed_tokens = sum(self.message_tokens(m) for turn in turns[:i + 1] for m in turn)
+                break
+            kept = turns[i] + kept
+            kept_tokens += tokens
+
+        messages = list(system_messages) + kept + [current]
+        report = {
+            "prompt_tokens": self.count(messages),
+            "history_tokens": kept_tokens,
+            "trimmed_tokens": trimmed_tokens,
+            "dropped_turns": dropped,
+        }
+        return messages, report
@@ -0,0 +1,93 @@
+"""
+混合检索：词法检索 (BM25) + 向量检索 (BGE)，用倒数排名融合 (RRF) 合并结果
+"""
+
+import time
+
+
+class HybridRetriever:
+    """
+    lexical_search(query, top_k) / vector_search(query, top_k) 都返回 dict 列表，
+    两路结果通过 key_fn 取出的主键对齐（默认按 "id"）。
+
+    快速通道：词法检索的第一名足够“确定”时（覆盖率高、且明显领先第二名），
+    直接返回词法结果，完全不调用 Embedding 模型。
+    """
+
+    def __init__(self, lexical_search, vector_search, key_fn=None, rrf_k=60,
+                 candidate_k=10, fast_path=True, fast_path_coverage=0.6, fast_path_margin=2.0):
+        self.lexical_search = lexical_search
+        self.vector_search = vector_search
+        self.key_fn = key_fn or (lambda hit: hit["id"])
+        self.rrf_k = rrf_k                    # RRF 平滑常数，越大排名靠后的结果权重越接近
+        self.candidate_k = candidate_k        # 每一路取多少候选参与融合
+        self.fast_path = fast_path
+        self.fast_path_coverage = fast_path_coverage
+        self.fast_path_margin = fast_path_margin
+        self.stats = {"queries": 0, "fast_path": 0}
+
+    def _is_decisive(self, lexical_hits):
+        if not self.fast_path or not lexical_hits:
+            return False
+        top = lexical_hits[0]
+        if top.get("coverage", 0.0) < self.fast_path_coverage:
+            return False
+        if len(lexical_hits) == 1:
+            return True
+        second = lexical_hits[1]["score"]
+        return second <= 0 or top["score"] >= self.fast_path_margin * second
+
+    def search(self, query, top_k=3, vector_hits=None):
+        """
+        vector_hits: 可选，调用方已经批量算好的向量检索结果（批量查询时使用），
+                     传入后不再调用 vector_search
+        返回 (hits, timings)
+        hits: 融合后的前 top_k 条，附带 rrf_score / lexical_rank / vector_rank
+        timings: 各阶段耗时 (ms) 以及是否走了快速通道
+        """
+        self.stats["queries"] += 1
+        timings = {"fast_path": False}
+        start = time.perf_counter()
+
+        t0 = time.perf_counter()
+        lexical_hits = self.lexical_search(query, max(top_k, self.candidate_k))
+        timings["lexical_ms"] = (time.perf_counter() - t0) * 1000
+
+        if self._is_decisive(lexical_hits):
+            self.stats["fast_path"] += 1
+            timings["fast_path"] = True
+            timings["vector_ms"] = 0.0
+            timings["fusion_ms"] = 0.0
+            timings["total_ms"] = (time.perf_counter() - start) * 1000
+            hits = []
+            for rank, hit in enumerate(lexical_hits[:top_k], start=1):
+                hit = dict(hit)
+                hit.update(rrf_score=1.0 / (self.rrf_k + rank), lexical_rank=rank, vector_rank=None)
+                hits.append(hit)
+            return hits, timings
+
+        t0 = time.perf_counter()
+        if vector_hits is None:
+            vector_hits = self.vector_search(query, max(top_k, self.candidate_k))
+        timings["vector_ms"] = (time.perf_counter() - t0) * 1000
+
+        t0 = time.perf_counter()
+        fused = {}
+        for field, ranked in (("lexical_rank", lexical_hits), ("vector_rank", vector_hits)):
+            for rank, hit in enumerate(ranked, start=1):
+                key = self.key_fn(hit)
+                entry = fused.get(key)
+                if entry is None:
+                    entry = dict(hit)
+                    entry.update(rrf_score=0.0, lexical_rank=None, vector_rank=None)
+                    fused[key] = entry
+                else:
+                    # 两路字段合并（例如词法的 score 和向量的 distance 都保留）
+                    for name, value in hit.items():
+                        entry.setdefault(name, value)
+                entry[field] = rank
+                entry["rrf_score"] += 1.0 / (self.rrf_k + rank)
+        hits = sorted(fused.values(), key=lambda h: h["rrf_score"], reverse=True)[:top_k]
+        timings["fusion_ms"] = (time.perf_counter() - t0) * 1000
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
+        return hits, timings
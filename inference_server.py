@@ -0,0 +1,142 @@
+"""
+常驻本地推理服务
+只加载一次基座模型（可选挂载 LoRA，并可按请求切换 config.LORA_ADAPTERS 里的其它 LoRA），
+通过本地 HTTP 提供生成接口，
+step1 / step4 / step5 / step7 / step8 检测到服务在线时会直接调用，不再各自加载模型。
+
+运行：
+    python inference_server.py            # 基座模型 + fine_tuned_model（如存在）
+    python inference_server.py --no-lora  # 只加载基座模型
+    python inference_server.py --batch-size 1  # 关闭连续批处理，请求逐个生成
+
+接口：
+    GET  /health    -> {"base_model", "adapter", "merged", "adapters"}  merged=True 时 LoRA 已合并进权重（如 int8 量化），
+                       不能用 use_adapter=false 按基座模型回答
+    GET  /stats     -> {"prefix_cache", "session_cache", "scheduler", "adapters"}  缓存命中 / 吞吐 / LoRA 加载统计
+    POST /generate  {"messages", "max_new_tokens", "use_adapter", "session_id", "adapter", "generate_kwargs"}
+                    -> {"text", "elapsed"}；adapter 为 config.LORA_ADAPTERS 中的名字，不传则用 --lora
+    POST /generate_stream  参数同上 -> 每生成一段文本返回一行 {"text"}（NDJSON 流式输出）
+"""
+
+import argparse
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from config import (setup_environment, BATCH_SCHEDULER_MAX_BATCH, FINE_TUNED_MODEL_DIR, INFERENCE_SERVER_URL,
+                    LORA_ADAPTERS)
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    llm = None  # 并发请求由 LocalLLM 的连续批处理调度器合并解码
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {
+                "base_model": self.llm.base_model_name,
+                "adapter": self.llm.adapter,
+                "merged": self.llm.merged,
+                "adapters": self.llm.adapters.names(),
+            })
+        elif self.path == "/stats":
+            self._send_json(200, self.llm.stats())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def _read_request(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length).decode("utf-8"))
+        return dict(
+            messages=request["messages"],
+            max_new_tokens=request.get("max_new_tokens", 256),
+            use_adapter=request.get("use_adapter", True),
+            session_id=request.get("session_id"),
+            adapter=request.get("adapter"),
+            **request.get("generate_kwargs", {}),
+        )
+
+    def do_POST(self):
+        if self.path == "/generate_stream":
+            self._stream()
+            return
+        if self.path != "/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            start = time.time()
+            text = self.llm.chat(**self._read_request())
+            self._send_json(200, {"text": text, "elapsed": time.time() - start})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+
+    def _stream(self):
+        try:
+            pieces = self.llm.chat_stream(**self._read_request())
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        # 不带 Content-Length，写完后关闭连接 (HTTP/1.0)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.end_headers()
+        try:
+            for text in pieces:
+                self.wfile.write(json.dumps({"text": text}, ensure_ascii=False).encode("utf-8") + b"\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            print(f"[推理服务] {self.address_string()} 客户端已断开，停止生成")
+        except Exception as e:
+            self.wfile.write(json.dumps({"error": str(e)}, ensure_ascii=False).encode("utf-8") + b"\n")
+        finally:
+            pieces.close()  # 客户端断开时让 chat_stream 取消生成，不再占用 batch 里的位置
+
+    def log_message(self, format, *args):
+        # 只打印简短日志
+        print(f"[推理服务] {self.address_string()} {format % args}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="常驻本地推理服务")
+    parser.add_argument("--lora", default=FINE_TUNED_MODEL_DIR, help="LoRA 权重目录")
+    parser.add_argument("--no-lora", action="store_true", help="只加载基座模型")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SCHEDULER_MAX_BATCH,
+                        help="连续批处理最多同时解码的请求数，1 表示不开启")
+    args = parser.parse_args()
+
+    setup_environment()
+    from llm_service import load_local_llm
+
+    lora_path = None if args.no_lora or not os.path.exists(args.lora) else args.lora
+    # PyTorch 后端不用合并模型，保持 LoRA 可关闭 / 切换；ONNX 后端或 CPU_PRECISION="int8" 时 LoRA 已合并，
+    # /health 返回 merged=True，需要基座模型的脚本会改为本地加载
+    InferenceHandler.llm = load_local_llm(lora_path, use_merged=False)
+    # 其它 LoRA 只注册，第一次被请求时才加载，共用同一份基座模型
+    if InferenceHandler.llm.merged and LORA_ADAPTERS:
+        print("⚠️ LoRA 已合并进模型权重（CPU_PRECISION=\"int8\" 等），不注册 LORA_ADAPTERS 里的其它 LoRA")
+    for name, path in (LORA_ADAPTERS.items() if not InferenceHandler.llm.merged else ()):
+        if os.path.exists(path):
+            try:
+                InferenceHandler.llm.register_adapter(name, path)
+            except ValueError as e:
+                print(f"⚠️ 跳过 LoRA [{name}]: {e}")
+                continue
+            print(f"已注册 LoRA [{name}]: {path}")
+    InferenceHandler.llm.start_scheduler(args.batch_size)
+
+    url = urlparse(INFERENCE_SERVER_URL)
+    server = ThreadingHTTPServer((url.hostname, url.port), InferenceHandler)
+    print(f"✅ 推理服务已启动: {INFERENCE_SERVER_URL} (Ctrl+C 退出)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n推理服务已停止")
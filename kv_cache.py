@@ -0,0 +1,146 @@
+"""
+KV Cache 工具函数
+- 把 transformers 的 Cache 对象和按层的 (key, value) 张量互相转换，
+  供连续批处理调度器等需要手动拼接 / 裁剪 KV Cache 的代码使用
+- PrefixKVCache：固定系统提示词的 KV Cache 只算一次，之后的请求只需 prefill 后缀
+- SessionKVCache：多轮对话按会话保留 KV Cache，下一轮只 prefill 新增的部分
+"""
+
+import threading
+from collections import OrderedDict
+
+from transformers import DynamicCache
+
+
+def cache_to_layers(cache):
+    """Cache 对象 -> [(key, value), ...]，每个张量形状为 [batch, heads, seq_len, head_dim]"""
+    if hasattr(cache, "layers"):  # transformers >= 4.56
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    if hasattr(cache, "key_cache"):  # 旧版 DynamicCache
+        return list(zip(cache.key_cache, cache.value_cache))
+    return [(k, v) for k, v in cache]  # legacy tuple 格式
+
+
+def layers_to_cache(layers):
+    """[(key, value), ...] -> DynamicCache"""
+    cache = DynamicCache()
+    for layer_idx, (key, value) in enumerate(layers):
+        cache.update(key, value, layer_idx)
+    return cache
+
+
+def layers_nbytes(layers):
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in layers)
+
+
+class PrefixKVCache:
+    """
+    前缀 KV Cache（LRU，按内存上限淘汰）
+    key 是前缀的 token id（加上 LoRA 开关等会影响 KV 的状态），value 是按层的 (key, value) 张量。
+    缓存的张量只读：layers_to_cache 生成的新 Cache 在 update 时会拼接出新张量，不会改动缓存。
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "tokens_saved": 0}
+
+    def get(self, prefix_ids, compute, tag=None):
+        """
+        返回前缀对应的 layers；未命中时调用 compute(prefix_ids) 计算并缓存
+        tag 用来区分同一前缀在不同模型状态下的 KV（例如关闭 LoRA 时）
+        """
+        key = (tag, tuple(prefix_ids))
+        with self._lock:
+            layers = self._entries.get(key)
+            if layers is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["tokens_saved"] += len(prefix_ids)
+                return layers
+            self.stats["misses"] += 1
+
+        layers = compute(prefix_ids)
+        size = layers_nbytes(layers)
+        if size > self.max_bytes:
+            return layers
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = layers
+                self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self.nbytes -= layers_nbytes(old)
+                self.stats["evictions"] += 1
+        return layers
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+def common_prefix_len(a, b):
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class SessionKVCache:
+    """
+    按会话保留上一轮结束时的 KV Cache（prompt + 已生成的回答）
+    - lookup：和新一轮 prompt 取最长公共前缀，只复用前缀部分；
+      历史被编辑 / 清空时公共前缀变短甚至为 0，自然退回完整重算
+    - 所有会话共用一个内存上限，超出时淘汰最久没用的会话
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()  # session_id -> (token_ids, layers, nbytes)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "tokens_reused": 0}
+
+    def lookup(self, session_id, token_ids, tag=None):
+        """返回 (可复用的 token 数, 裁剪后的 layers)，没有可复用的部分返回 None"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[0][0] != tag:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(session_id)
+            (_, cached_ids), layers, _ = entry
+            # 至少留一个 token 做 prefill，才能拿到下一个 token 的 logits
+            n = min(common_prefix_len(cached_ids, token_ids), len(token_ids) - 1)
+            if n <= 0:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            self.stats["tokens_reused"] += n
+        return n, [(k[:, :, :n], v[:, :, :n]) for k, v in layers]
+
+    def store(self, session_id, token_ids, layers, tag=None):
+        """token_ids 是 layers 覆盖的 token（长度等于 KV 的序列长度）"""
+        size = layers_nbytes(layers)
+        with self._lock:
+            old = self._entries.pop(session_id, None)
+            if old is not None:
+                self.nbytes -= old[2]
+            if size > self.max_bytes:
+                return
+            self._entries[session_id] = ((tag, list(token_ids)), layers, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, _, old_size) = self._entries.popitem(last=False)
+                self.nbytes -= old_size
+                self.stats["evictions"] += 1
+
+    def drop(self, session_id):
+        with self._lock:
+            old = self._entries.pop(session_id, None)
+            if old is not None:
+                self.nbytes -= old[2]
@@ -0,0 +1,530 @@
+"""
+统一的语言模型调用入口
+- LocalLLM：在当前进程里加载基座模型（可选挂载 LoRA），可开启连续批处理支持多人并发，
+  系统提示词、多轮对话的 KV Cache 会缓存复用
+- OnnxLLM：用 ONNX Runtime 运行 onnx_export.py 导出的模型，接口与 LocalLLM 相同
+- RemoteLLM：调用常驻的本地推理服务 (inference_server.py)，不用再加载模型
+- load_llm：推理服务在运行就用 RemoteLLM，否则按 LLM_BACKEND 本地加载
+"""
+
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+
+from config import (ADAPTER_CACHE_MB, ASSISTED_DRAFT_MODEL, ASSISTED_NUM_TOKENS, ASSISTED_TARGET_MODEL,
+                    BASE_MODEL, BATCH_SCHEDULER_MAX_BATCH, CPU_PRECISION, INFERENCE_SERVER_URL, LLM_BACKEND,
+                    PREFIX_CACHE_MB, SESSION_KV_CACHE_MB, USE_INFERENCE_SERVER, USE_MERGED_MODEL)
+
+# 访问本机服务不走系统代理（否则 localhost 请求可能被代理拦截）
+_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+
+# ==========================================
+# 本地模型
+# ==========================================
+
+class LocalLLM:
+    """
+    在当前进程加载模型；lora_path 存在时挂载 LoRA 权重
+    调用 start_scheduler() 后，多个线程同时 chat 会合并到同一个 batch 里解码
+    register_adapter() 注册更多 LoRA 后，每个请求可以用 adapter="名字" 选择，共用同一份基座模型
+    传入 draft_model 时开启辅助解码：小模型起草、本模型验证，贪心解码结果和不开启时一致
+    messages 以 system 消息开头时，system 部分的 KV Cache 只计算一次，之后只 prefill 剩下的部分
+    传入 session_id 时按会话保留 KV Cache，多轮对话每轮只 prefill 新增的部分
+    （开启辅助解码时这两种 KV 复用都关闭）
+    """
+
+    # 调度器支持的生成参数，其它参数（如 repetition_penalty）走普通 generate
+    SCHEDULER_KWARGS = {"do_sample", "temperature", "top_p", "top_k"}
+
+    def __init__(self, base_model=BASE_MODEL, lora_path=None, prefix_cache_mb=PREFIX_CACHE_MB,
+                 session_cache_mb=SESSION_KV_CACHE_MB, use_merged=False, adapter_cache_mb=ADAPTER_CACHE_MB,
+                 draft_model=None, num_assistant_tokens=ASSISTED_NUM_TOKENS, cpu_precision=CPU_PRECISION):
+        """
+        use_merged=True 时，如果 merge_adapter.py 导出的合并模型是最新的，直接加载合并后的权重
+        （加载更快、推理没有额外的 LoRA 计算，但不能再临时关闭 LoRA）
+        cpu_precision：在 CPU 上运行时把模型转成 fp32 / bf16 / int8（见 cpu_quantization.py），None 保持原精度
+        """
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        from merge_adapter import find_merged_model
+        from runtime_profile import model_load_kwargs
+
+        self.base_model_name = base_model
+        merged_dir = find_merged_model(lora_path, base_model=base_model) if use_merged else None
+        model_path = merged_dir or base_model
+        print(f"正在加载模型: {model_path}")
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        # 有运行时配置 (runtime_profile.py) 时按本机实测最快的精度 / 注意力实现加载
+        model = AutoModelForCausalLM.from_pretrained(model_path, **model_load_kwargs(self.device))
+
+        self.adapter = None
+        self.merged = merged_dir is not None
+        if self.merged:
+            self.adapter = lora_path
+            print(f"✅ 已加载合并 LoRA 后的模型: {merged_dir}")
+        elif lora_path:
+            from peft import PeftModel
+            model = PeftModel.from_pretrained(model, lora_path)
+            self.adapter = lora_path
+            print(f"✅ 已挂载 LoRA 权重: {lora_path}")
+
+        self.cpu_precision = cpu_precision if self.device == "cpu" else None
+        if self.cpu_precision:
+            from cpu_quantization import prepare_cpu_model
+            if self.cpu_precision == "int8" and self.adapter is not None and not self.merged:
+                # 量化后的 Linear 不能再挂 / 切换 LoRA，先把 LoRA 合并进权重
+                model = model.merge_and_unload()
+                self.merged = True
+                print("LoRA 已合并进权重（int8 量化需要）")
+            model = prepare_cpu_model(model, self.cpu_precision)
+            print(f"✅ CPU 推理精度: {self.cpu_precision}")
+        self.model = model.to(self.device)
+        self.model.eval()
+        print(f"✅ 模型运行在: {self.device}")
+
+        self.assistant = None
+        if draft_model:
+            # 草稿模型必须和主模型使用同一个 tokenizer（例如 Qwen2.5-0.5B 给 Qwen2.5-1.5B 起草）
+            assistant = AutoModelForCausalLM.from_pretrained(draft_model, **model_load_kwargs(self.device))
+            if self.cpu_precision:
+                assistant = prepare_cpu_model(assistant, self.cpu_precision)
+            self.assistant = assistant.to(self.device)
+            self.assistant.eval()
+            self.assistant.generation_config.num_assistant_tokens = num_assistant_tokens
+            print(f"✅ 已开启辅助解码，草稿模型: {draft_model}")
+        self._init_state(prefix_cache_mb, session_cache_mb, adapter_cache_mb)
+
+    def _init_state(self, prefix_cache_mb, session_cache_mb, adapter_cache_mb):
+        """模型加载完之后的公共状态：模型锁、调度器、KV Cache、LoRA 注册表（OnnxLLM 也复用）"""
+        from adapter_registry import AdapterRegistry
+        from kv_cache import PrefixKVCache, SessionKVCache
+
+        self.model_lock = threading.Lock()  # 调度器和普通 generate 共用一个模型，前向计算互斥
+        self.scheduler = None
+        if self.assistant is not None and (prefix_cache_mb > 0 or session_cache_mb > 0):
+            # 辅助解码不支持预先填充的 past_key_values（草稿模型的 KV 和主模型对不上，输出会出错），
+            # 开启辅助解码时关闭 prefix / 会话 KV 复用，每次请求完整 prefill
+            print("⚠️ 辅助解码模式下不复用 prefix / 会话 KV Cache")
+            prefix_cache_mb = session_cache_mb = 0
+        self.prefix_cache = PrefixKVCache(int(prefix_cache_mb * 1024 * 1024)) if prefix_cache_mb > 0 else None
+        self.session_cache = SessionKVCache(int(session_cache_mb * 1024 * 1024)) if session_cache_mb > 0 else None
+        self.adapters = AdapterRegistry(max_bytes=int(adapter_cache_mb * 1024 * 1024))
+
+    def start_scheduler(self, max_batch_size=BATCH_SCHEDULER_MAX_BATCH):
+        """开启连续批处理调度器（多用户并发时总吞吐随并发数增长）"""
+        from batch_scheduler import ContinuousBatchScheduler
+
+        if self.scheduler is None and max_batch_size > 1:
+            self.scheduler = ContinuousBatchScheduler(
+                self.model, self.tokenizer, self.device,
+                max_batch_size=max_batch_size, model_lock=self.model_lock,
+            )
+            print(f"✅ 已开启连续批处理 (最大 batch: {max_batch_size})")
+        return self.scheduler
+
+    def register_adapter(self, name, path):
+        """注册一个 LoRA（第一次被请求时才加载）"""
+        if self.merged:
+            raise ValueError("合并模型不支持再挂载其它 LoRA，请使用基座模型 + LoRA 的方式加载")
+        self.adapters.register(name, path)
+
+    def stats(self):
+        return {
+            "prefix_cache": dict(self.prefix_cache.stats) if self.prefix_cache is not None else None,
+            "session_cache": dict(self.session_cache.stats) if self.session_cache is not None else None,
+            "scheduler": self.scheduler.throughput() if self.scheduler is not None else None,
+            "adapters": dict(self.adapters.stats, loaded=list(self.adapters.loaded)),
+        }
+
+    def build_inputs(self, messages):
+        text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return self.tokenizer([text], return_tensors="pt").to(self.device)
+
+    def _system_prefix_ids(self, messages, input_ids):
+        """system 消息部分的 token；没有 system 消息、或切分后 token 对不上时返回 None"""
+        if not messages or messages[0].get("role") != "system":
+            return None
+        text = self.tokenizer.apply_chat_template(messages[:1], tokenize=False)
+        prefix_ids = self.tokenizer(text).input_ids
+        n = len(prefix_ids)
+        if n == 0 or n >= len(input_ids) or input_ids[:n] != prefix_ids:
+            return None
+        return prefix_ids
+
+    def _prefix(self, messages, inputs, adapter, session_id=None):
+        """
+        选择可复用的 KV Cache，返回 (前缀 token 数, layers)，没有可复用的返回 None（完整 prefill）
+        1. 会话缓存：上一轮的 prompt + 回答，和本轮取最长公共前缀
+        2. 系统提示词缓存：相同 system 消息只算一次
+        """
+        input_ids = inputs.input_ids[0].tolist()
+        session_hit = None
+        if session_id is not None and self.session_cache is not None:
+            session_hit = self.session_cache.lookup(session_id, input_ids, tag=adapter)
+
+        prefix_ids = self._system_prefix_ids(messages, input_ids) if self.prefix_cache is not None else None
+        if session_hit is not None and (prefix_ids is None or session_hit[0] >= len(prefix_ids)):
+            return session_hit
+        if prefix_ids is None:
+            return None
+        layers = self.prefix_cache.get(prefix_ids, lambda ids: self._prefill(ids, adapter), tag=adapter)
+        return len(prefix_ids), layers
+
+    def _prefill(self, token_ids, adapter):
+        import torch
+        from kv_cache import cache_to_layers
+
+        input_ids = torch.tensor([token_ids], device=self.device)
+        with self.model_lock, torch.no_grad(), self._activate(adapter):
+            out = self.model(input_ids=input_ids, use_cache=True)
+        return cache_to_layers(out.past_key_values)
+
+    def _remember(self, session_id, token_ids, layers, adapter):
+        """保存本轮结束时的 KV Cache，供同一会话的下一轮复用"""
+        if session_id is not None and self.session_cache is not None and layers:
+            self.session_cache.store(session_id, token_ids, layers, tag=adapter)
+
+    @property
+    def default_adapter(self):
+        """模型平时的状态：挂载了 lora_path 时是它，否则是基座模型 (None)"""
+        from adapter_registry import DEFAULT_ADAPTER
+        return DEFAULT_ADAPTER if self.adapter is not None else None
+
+    def _select_adapter(self, use_adapter, adapter=None):
+        """
+        本次生成使用的 LoRA：None 表示基座模型，default_adapter 是 lora_path 挂载的 LoRA，
+        其它是 register_adapter 注册的名字
+        """
+        if adapter is not None and adapter != self.default_adapter:
+            if adapter not in self.adapters.paths:
+                raise KeyError(f"未注册的 LoRA: {adapter}")
+            return adapter
+        if use_adapter or self.adapter is None:
+            return self.default_adapter
+        if self.merged:
+            raise ValueError("LoRA 已合并进模型权重，无法临时关闭；需要基座模型回答时请不要使用合并模型")
+        return None
+
+    @contextmanager
+    def _activate(self, adapter):
+        """
+        临时切换到指定的 LoRA，结束后恢复 default_adapter（调用方需持有 model_lock）
+        调度器直接调用底层模型，所以平时必须保持 default_adapter 的状态
+        """
+        if adapter == self.default_adapter:
+            yield
+            return
+        if adapter is None:
+            with self.model.disable_adapter():
+                yield
+            return
+
+        self.model = self.adapters.load(self.model, adapter)
+        self.model.set_adapter(adapter)
+        if self.default_adapter is None:
+            self.model.base_model.enable_adapter_layers()
+        try:
+            yield
+        finally:
+            if self.default_adapter is None:
+                self.model.base_model.disable_adapter_layers()
+            else:
+                self.model.set_adapter(self.default_adapter)
+
+    def _use_scheduler(self, adapter, gen_kwargs):
+        # 辅助解码每次只能处理一条序列，开启后不走批处理调度器
+        return (self.scheduler is not None and self.assistant is None and adapter == self.default_adapter
+                and set(gen_kwargs) <= self.SCHEDULER_KWARGS)
+
+    def _submit(self, inputs, max_new_tokens, prefix, session_id, gen_kwargs):
+        return self.scheduler.submit(
+            inputs.input_ids[0].tolist(), max_new_tokens,
+            prefix=prefix, keep_cache=session_id is not None and self.session_cache is not None, **gen_kwargs
+        )
+
+    def _generate(self, inputs, adapter, prefix=None, session_id=None, **gen_kwargs):
+        import torch
+        from transformers import DynamicCache
+        from kv_cache import cache_to_layers, layers_to_cache
+
+        cache = None
+        if prefix is not None:
+            cache = layers_to_cache(prefix[1])
+        elif session_id is not None and self.session_cache is not None:
+            cache = DynamicCache()
+        if cache is not None:
+            gen_kwargs["past_key_values"] = cache  # generate 会原地更新这个 Cache
+        if self.assistant is not None and inputs.input_ids.shape[0] == 1:
+            gen_kwargs.setdefault("assistant_model", self.assistant)
+        with self.model_lock, torch.no_grad(), self._activate(adapter):
+            outputs = self.model.generate(**inputs, **gen_kwargs)
+
+        if cache is not None and session_id is not None:
+            layers = cache_to_layers(cache)
+            self._remember(session_id, outputs[0][:layers[0][0].shape[2]].tolist(), layers, adapter)
+        return outputs
+
+    def chat(self, messages, max_new_tokens=256, use_adapter=True, session_id=None, adapter=None, **gen_kwargs):
+        """
+        根据对话消息生成回答，返回新生成的文本
+        use_adapter=False 时临时关闭 LoRA，按基座模型回答
+        session_id：多轮对话的会话 id，传入后会保留本轮的 KV Cache，下一轮只 prefill 新增部分
+        adapter：使用 register_adapter 注册的某个 LoRA（不走批处理调度器，逐个生成）
+        """
+        inputs = self.build_inputs(messages)
+        adapter = self._select_adapter(use_adapter, adapter)
+        prefix = self._prefix(messages, inputs, adapter, session_id)
+        if self._use_scheduler(adapter, gen_kwargs):
+            request = self._submit(inputs, max_new_tokens, prefix, session_id, gen_kwargs)
+            generated = request.wait()
+            self._remember(session_id, request.cache_ids, request.cache_layers, adapter)
+            return self.tokenizer.decode(generated, skip_special_tokens=True)
+
+        outputs = self._generate(inputs, adapter, prefix, session_id, max_new_tokens=max_new_tokens, **gen_kwargs)
+        new_tokens = outputs[0][inputs.input_ids.shape[1]:]
+        return self.tokenizer.decode(new_tokens, skip_special_tokens=True)
+
+    def chat_stream(self, messages, max_new_tokens=256, use_adapter=True, session_id=None, adapter=None,
+                    **gen_kwargs):
+        """
+        流式生成：边生成边 yield 新增的文本片段，参数同 chat
+        调用方提前关闭生成器（close() 或不再迭代被回收）时停止生成，不再占用模型
+        """
+        inputs = self.build_inputs(messages)
+        adapter = self._select_adapter(use_adapter, adapter)
+        prefix = self._prefix(messages, inputs, adapter, session_id)
+        if self._use_scheduler(adapter, gen_kwargs):
+            request = self._submit(inputs, max_new_tokens, prefix, session_id, gen_kwargs)
+            try:
+                yield from self._decode_stream(request)
+            finally:
+                # 调用方提前停止迭代（客户端断开、点了停止）时，调度器不再为这条请求解码
+                request.cancel()
+            self._remember(session_id, request.cache_ids, request.cache_layers, adapter)
+            return
+
+        import torch
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        cancelled = threading.Event()
+
+        class Cancel(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return torch.full((input_ids.shape[0],), cancelled.is_set(), dtype=torch.bool,
+                                  device=input_ids.device)
+
+        stopping = StoppingCriteriaList([*gen_kwargs.pop("stopping_criteria", []), Cancel()])
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+
+        def run():
+            try:
+                self._generate(inputs, adapter, prefix, session_id, max_new_tokens=max_new_tokens,
+                               streamer=streamer, stopping_criteria=stopping, **gen_kwargs)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()  # 生成出错时结束流，避免调用方一直等待
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            for text in streamer:
+                if text:
+                    yield text
+        finally:
+            cancelled.set()  # 正常结束时无影响；提前停止迭代时 generate 在下一步停止
+        thread.join()
+        if errors:
+            raise errors[0]
+
+    def chat_batch(self, batch_messages, max_new_tokens=256, use_adapter=True, adapter=None, **gen_kwargs):
+        """
+        一次生成多组对话的回答（左侧补齐后合并成一个 batch），返回 (回答列表, 每条生成的 token 数)
+        适合离线评测等一次性提交很多问题的场景
+        """
+        texts = [
+            self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            for messages in batch_messages
+        ]
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        pad_token_id = self.tokenizer.pad_token_id
+        inputs = self.tokenizer(texts, return_tensors="pt", padding=True, padding_side="left").to(self.device)
+        adapter = self._select_adapter(use_adapter, adapter)
+        outputs = self._generate(inputs, adapter, max_new_tokens=max_new_tokens, pad_token_id=pad_token_id,
+                                 **gen_kwargs)
+
+        eos = self.model.generation_config.eos_token_id
+        stop_ids = set(eos if isinstance(eos, (list, tuple)) else [eos]) | {pad_token_id}
+        answers, counts = [], []
+        for row in outputs[:, inputs.input_ids.shape[1]:].tolist():
+            # 提前结束的序列后面是补齐用的 pad，不计入生成的 token
+            n = next((i for i, t in enumerate(row) if t in stop_ids), len(row))
+            answers.append(self.tokenizer.decode(row[:n], skip_special_tokens=True))
+            counts.append(n)
+        return answers, counts
+
+    def _decode_stream(self, token_ids):
+        """逐个 token 增量解码；多字节字符没解码完整（末尾是 \ufffd）时先不输出"""
+        ids, text = [], ""
+        for token_id in token_ids:
+            ids.append(token_id)
+            new_text = self.tokenizer.decode(ids, skip_special_tokens=True)
+            if new_text.endswith("\ufffd") or len(new_text) <= len(text):
+                continue
+            yield new_text[len(text):]
+            text = new_text
+
+
+class OnnxLLM(LocalLLM):
+    """
+    ONNX Runtime 后端：加载 onnx_export.py 导出的模型（带 KV Cache），chat / chat_stream / chat_batch 与 LocalLLM 相同
+    LoRA 在导出时已合并，不支持临时关闭 / 切换 LoRA、连续批处理、KV Cache 复用和辅助解码
+    """
+
+    def __init__(self, onnx_dir, lora_path=None):
+        from optimum.onnxruntime import ORTModelForCausalLM
+        from transformers import AutoTokenizer
+
+        print(f"正在加载 ONNX 模型: {onnx_dir}")
+        self.base_model_name = BASE_MODEL
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+        self.model = ORTModelForCausalLM.from_pretrained(onnx_dir, use_cache=True)
+        self.device = "cpu"
+        self.cpu_precision = None
+        self.adapter = lora_path
+        self.merged = lora_path is not None
+        self.assistant = None
+        self._init_state(prefix_cache_mb=0, session_cache_mb=0, adapter_cache_mb=0)
+        print(f"✅ ONNX Runtime 后端已就绪{'（已合并 LoRA）' if self.merged else ''}")
+
+    def start_scheduler(self, max_batch_size=BATCH_SCHEDULER_MAX_BATCH):
+        print("⚠️ ONNX 后端不支持连续批处理，请求将逐个生成")
+        return None
+
+    def register_adapter(self, name, path):
+        raise ValueError("ONNX 后端不支持挂载其它 LoRA，请使用 LLM_BACKEND=\"torch\"")
+
+
+# ==========================================
+# 推理服务客户端
+# ==========================================
+
+class RemoteLLM:
+    """通过 HTTP 调用 inference_server.py，接口与 LocalLLM.chat / chat_stream 一致"""
+
+    def __init__(self, url=INFERENCE_SERVER_URL, use_adapter=True, timeout=600):
+        self.url = url.rstrip("/")
+        self.use_adapter = use_adapter
+        self.timeout = timeout
+        self.info = self.health(self.url)
+
+    @staticmethod
+    def health(url=INFERENCE_SERVER_URL, timeout=0.5):
+        """服务在线返回 /health 的内容，否则返回 None"""
+        try:
+            with _opener.open(url.rstrip("/") + "/health", timeout=timeout) as resp:
+                return json.loads(resp.read().decode("utf-8"))
+        except (urllib.error.URLError, OSError, ValueError):
+            return None
+
+    def stats(self):
+        """推理服务的前缀缓存 / 批处理统计"""
+        with _opener.open(self.url + "/stats", timeout=self.timeout) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+
+    def _request(self, path, messages, max_new_tokens, use_adapter, session_id, adapter, gen_kwargs):
+        payload = {
+            "messages": messages,
+            "max_new_tokens": max_new_tokens,
+            "use_adapter": self.use_adapter if use_adapter is None else use_adapter,
+            "session_id": session_id,
+            "adapter": adapter,
+            "generate_kwargs": gen_kwargs,
+        }
+        req = urllib.request.Request(
+            self.url + path,
+            data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        return _opener.open(req, timeout=self.timeout)
+
+    def chat(self, messages, max_new_tokens=256, use_adapter=None, session_id=None, adapter=None, **gen_kwargs):
+        with self._request("/generate", messages, max_new_tokens, use_adapter, session_id, adapter,
+                           gen_kwargs) as resp:
+            return json.loads(resp.read().decode("utf-8"))["text"]
+
+    def chat_stream(self, messages, max_new_tokens=256, use_adapter=None, session_id=None, adapter=None,
+                    **gen_kwargs):
+        """服务端每生成一段文本返回一行 JSON (NDJSON)"""
+        with self._request("/generate_stream", messages, max_new_tokens, use_adapter, session_id, adapter,
+                           gen_kwargs) as resp:
+            for line in resp:
+                if not line.strip():
+                    continue
+                chunk = json.loads(line.decode("utf-8"))
+                if "error" in chunk:
+                    raise RuntimeError(chunk["error"])
+                yield chunk["text"]
+
+
+def assisted_kwargs(lora_path=None):
+    """
+    config 开启辅助解码时返回 LocalLLM 的参数：ASSISTED_TARGET_MODEL 作为主模型，ASSISTED_DRAFT_MODEL 起草
+    LoRA 是基于另一个基座训练的（例如 0.5B 上训练的 LoRA）时不能挂到主模型上，跳过它
+    """
+    if not ASSISTED_TARGET_MODEL:
+        return {"lora_path": lora_path}
+    if lora_path:
+        with open(os.path.join(lora_path, "adapter_config.json"), "r", encoding="utf-8") as f:
+            lora_base = json.load(f).get("base_model_name_or_path")
+        if lora_base != ASSISTED_TARGET_MODEL:
+            print(f"⚠️ LoRA {lora_path} 基于 {lora_base} 训练，与辅助解码的主模型不一致，已跳过")
+            lora_path = None
+    return {"base_model": ASSISTED_TARGET_MODEL, "draft_model": ASSISTED_DRAFT_MODEL, "lora_path": lora_path}
+
+
+def load_local_llm(lora_path=None, use_merged=USE_MERGED_MODEL, backend=LLM_BACKEND):
+    """按 backend 在本进程加载模型；ONNX 模型不存在或与当前 LoRA 不一致时退回 PyTorch"""
+    if backend == "onnx":
+        from onnx_export import find_onnx_model
+        onnx_dir = find_onnx_model(lora_path)
+        if onnx_dir is not None:
+            return OnnxLLM(onnx_dir, lora_path)
+        print("⚠️ 未找到匹配的 ONNX 模型（python onnx_export.py 导出），改用 PyTorch 后端")
+    return LocalLLM(use_merged=use_merged, **assisted_kwargs(lora_path))
+
+
+def load_llm(lora_path=None, prefer_server=USE_INFERENCE_SERVER, use_merged=USE_MERGED_MODEL):
+    """
+    获取语言模型：
+    1. 推理服务在线、且（需要 LoRA 时）服务挂载了 LoRA、（需要基座模型时）服务的 LoRA 没有合并进权重
+       -> RemoteLLM，省去加载模型的时间
+    2. 否则在本进程加载（LLM_BACKEND="onnx" 时优先用导出的 ONNX 模型）；
+       有最新的合并模型时直接加载合并模型；lora_path 不存在时退回基座模型
+    """
+    if lora_path and not os.path.exists(lora_path):
+        print(f"⚠️ 未找到 LoRA 权重 {lora_path}，使用基座模型")
+        lora_path = None
+
+    if prefer_server:
+        info = RemoteLLM.health()
+        if info is not None and lora_path and not info.get("adapter"):
+            print("⚠️ 推理服务未挂载 LoRA，改为本地加载")
+        elif info is not None and not lora_path and info.get("merged"):
+            # 合并后的权重无法关闭 LoRA，use_adapter=False 的请求会失败
+            print("⚠️ 推理服务的 LoRA 已合并进模型权重，无法按基座模型回答，改为本地加载")
+        elif info is not None:
+            print(f"✅ 已连接本地推理服务 {INFERENCE_SERVER_URL} (模型: {info.get('base_model')})")
+            return RemoteLLM(use_adapter=bool(lora_path))
+
+    start = time.time()
+    llm = load_local_llm(lora_path, use_merged)
+    print(f"模型加载耗时: {time.time() - start:.1f}s（提示：先运行 python inference_server.py 可常驻模型）")
+    return llm
@@ -0,0 +1,147 @@
+"""
+把 LoRA 权重合并进基座模型，导出独立的 safetensors 模型
+合并后加载时不再需要 PeftModel，推理时也省去每一层额外的 LoRA 矩阵乘法。
+导出目录里的 merge_manifest.json 记录基座模型和 LoRA 权重的哈希，
+load_llm 发现合并模型比 LoRA 权重新、且哈希一致时会自动使用它。
+
+运行：
+    python merge_adapter.py                       # 合并 fine_tuned_model -> fine_tuned_model_merged
+    python merge_adapter.py --lora ./other_adapter --output ./other_merged
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+
+from config import BASE_MODEL, FINE_TUNED_MODEL_DIR, MERGED_MODEL_DIR
+
+MANIFEST_FILE = "merge_manifest.json"
+
+# ==========================================
+# 哈希
+# ==========================================
+
+def files_digest(paths):
+    """按文件名排序后依次计算 sha256（文件名也参与哈希）"""
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def adapter_files(lora_path):
+    return [
+        os.path.join(lora_path, name)
+        for name in ("adapter_config.json", "adapter_model.safetensors", "adapter_model.bin")
+        if os.path.exists(os.path.join(lora_path, name))
+    ]
+
+
+def base_files(base_model):
+    """基座模型是本地目录时返回 config + 权重文件；是 Hub 模型名时返回 None"""
+    if not os.path.isdir(base_model):
+        return None
+    paths = glob.glob(os.path.join(base_model, "*.safetensors")) + glob.glob(os.path.join(base_model, "*.bin"))
+    return paths + [os.path.join(base_model, "config.json")]
+
+
+def base_digest(base_model):
+    """基座模型是本地目录时哈希 config + 权重文件；是 Hub 模型名时只记录名字"""
+    paths = base_files(base_model)
+    return files_digest(paths) if paths is not None else None
+
+
+def files_signature(paths):
+    """文件名 -> [大小, 修改时间]：没变时加载时不用重新计算基座模型的哈希（权重文件很大）"""
+    return {os.path.basename(p): [os.path.getsize(p), os.stat(p).st_mtime_ns] for p in sorted(paths)}
+
+
+def base_matches(manifest, base_model):
+    """基座模型的文件和合并时一致：大小 / 修改时间都没变直接认为一致，否则重新计算哈希比较"""
+    expected = manifest.get("base_sha256")
+    paths = base_files(base_model)
+    if expected is None or paths is None:
+        # 合并时基座是 Hub 模型名（没有本地文件可以哈希），只能按名字判断
+        return expected is None and paths is None
+    if manifest.get("base_files") == files_signature(paths):
+        return True
+    return files_digest(paths) == expected
+
+# ==========================================
+# 合并导出
+# ==========================================
+
+def export_merged(base_model=BASE_MODEL, lora_path=FINE_TUNED_MODEL_DIR, output_dir=MERGED_MODEL_DIR):
+    from peft import PeftModel
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    start = time.time()
+    print(f"正在加载基座模型: {base_model}")
+    model = AutoModelForCausalLM.from_pretrained(base_model, dtype="auto")
+    tokenizer = AutoTokenizer.from_pretrained(base_model)
+    print(f"正在合并 LoRA 权重: {lora_path}")
+    model = PeftModel.from_pretrained(model, lora_path).merge_and_unload()
+
+    os.makedirs(output_dir, exist_ok=True)
+    model.save_pretrained(output_dir, safe_serialization=True)
+    tokenizer.save_pretrained(output_dir)
+
+    manifest = {
+        "base_model": base_model,
+        "base_sha256": base_digest(base_model),
+        "base_files": files_signature(base_files(base_model)) if os.path.isdir(base_model) else None,
+        "adapter": os.path.abspath(lora_path),
+        "adapter_sha256": files_digest(adapter_files(lora_path)),
+        "created_at": time.time(),
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"✅ 合并模型已保存到 {output_dir} (耗时 {time.time() - start:.1f}s)")
+    return manifest
+
+# ==========================================
+# 加载时检查
+# ==========================================
+
+def find_merged_model(lora_path, merged_dir=MERGED_MODEL_DIR, base_model=BASE_MODEL):
+    """
+    合并模型可用时返回它的目录，否则返回 None：
+    - manifest 记录的基座模型和当前配置一致，基座模型的权重文件也和合并时一致（哈希）
+    - 合并时间晚于 LoRA 权重的修改时间，且 LoRA 权重的哈希一致（重新训练后需要重新合并）
+    """
+    manifest_path = os.path.join(merged_dir, MANIFEST_FILE)
+    if not lora_path or not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    files = adapter_files(lora_path)
+    if not files or manifest.get("base_model") != base_model:
+        return None
+    if not base_matches(manifest, base_model):
+        print(f"⚠️ 合并模型 {merged_dir} 与当前基座模型的权重不一致，可运行 python merge_adapter.py 重新合并")
+        return None
+    if manifest.get("created_at", 0) < max(os.path.getmtime(p) for p in files) \
+            or manifest.get("adapter_sha256") != files_digest(files):
+        print(f"⚠️ 合并模型 {merged_dir} 已过期（LoRA 权重有更新），可运行 python merge_adapter.py 重新合并")
+        return None
+    return merged_dir
+
+
+if __name__ == "__main__":
+    from config import setup_environment
+
+    parser = argparse.ArgumentParser(description="合并 LoRA 权重并导出独立模型")
+    parser.add_argument("--base", default=BASE_MODEL, help="基座模型")
+    parser.add_argument("--lora", default=FINE_TUNED_MODEL_DIR, help="LoRA 权重目录")
+    parser.add_argument("--output", default=MERGED_MODEL_DIR, help="合并模型输出目录")
+    args = parser.parse_args()
+
+    setup_environment()
+    export_merged(args.base, args.lora, args.output)
@@ -0,0 +1,296 @@
+"""
+ONNX Runtime 版 Embedding 模型（bge-small-zh 等 SentenceTransformer 模型）
+- 导出：SentenceTransformer 模型 -> ONNX，可选 int8 权重动态量化
+- 推理：tokenizers 分词 + ONNX Runtime 前向 + numpy 池化 / 归一化，不需要 PyTorch
+- OnnxEmbedder.encode 与 SentenceTransformer.encode 接口一致，可以直接交给 CachedEmbedder
+池化方式和是否归一化读取原模型的 SentenceTransformer 配置（bge 是 CLS 池化 + 归一化）。
+
+注意：本模块也会被 deepseek_integration 引用，和 embedding_cache.py 一样不在模块级导入 config
+
+依赖：pip install optimum[onnxruntime]（导出需要；推理只需要 onnxruntime + tokenizers）
+
+运行：
+    python onnx_embedder.py                     # 导出 fp32 + int8，并和 SentenceTransformer 对比一致性 / 速度
+    python onnx_embedder.py --skip-export --num-texts 500 --output embed_bench.json
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+CONFIG_FILE = "embedder_config.json"
+FP32_FILE = "model.onnx"
+INT8_FILE = "model_int8.onnx"
+
+# ==========================================
+# 导出
+# ==========================================
+
+def _st_file(model_path, name):
+    """SentenceTransformer 配置文件的本地路径（Hub 模型名会先下载），不存在返回 None"""
+    if os.path.isdir(model_path):
+        path = os.path.join(model_path, name)
+        return path if os.path.exists(path) else None
+    try:
+        from huggingface_hub import hf_hub_download
+        return hf_hub_download(model_path, name)
+    except Exception:
+        return None
+
+
+def read_st_config(model_path):
+    """读取池化方式（cls / mean）、是否归一化、最大长度；没有 SentenceTransformer 配置时用 mean + 归一化"""
+    pooling, normalize, max_length = "mean", True, 512
+    modules_path = _st_file(model_path, "modules.json")
+    if modules_path:
+        with open(modules_path, "r", encoding="utf-8") as f:
+            modules = json.load(f)
+        normalize = any(m["type"].endswith("Normalize") for m in modules)
+        for m in modules:
+            if m["type"].endswith("Pooling"):
+                pooling_path = _st_file(model_path, f"{m['path']}/config.json")
+                if pooling_path:
+                    with open(pooling_path, "r", encoding="utf-8") as f:
+                        pooling = "cls" if json.load(f).get("pooling_mode_cls_token") else "mean"
+    st_config = _st_file(model_path, "sentence_bert_config.json")
+    if st_config:
+        with open(st_config, "r", encoding="utf-8") as f:
+            max_length = json.load(f).get("max_seq_length") or max_length
+    return {"pooling": pooling, "normalize": normalize, "max_length": max_length}
+
+
+def export_embedder(model_path, output_dir, quantize=True):
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+
+    start = time.time()
+    print(f"正在导出 Embedding 模型: {model_path}")
+    model = ORTModelForFeatureExtraction.from_pretrained(model_path, export=True)
+    model.save_pretrained(output_dir)
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    tokenizer.save_pretrained(output_dir)  # 包含 tokenizer.json，推理时直接用 tokenizers 加载
+
+    if quantize:
+        # 只量化权重，激活在运行时动态量化，不需要校准数据
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(os.path.join(output_dir, FP32_FILE), os.path.join(output_dir, INT8_FILE),
+                         weight_type=QuantType.QInt8)
+
+    config = dict(read_st_config(model_path), source=model_path, dim=model.config.hidden_size,
+                  pad_token=tokenizer.pad_token, pad_token_id=tokenizer.pad_token_id)
+    with open(os.path.join(output_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    print(f"✅ ONNX Embedding 模型已保存到 {output_dir} (池化: {config['pooling']}, "
+          f"int8: {'是' if quantize else '否'}, 耗时 {time.time() - start:.1f}s)")
+    return config
+
+# ==========================================
+# 推理
+# ==========================================
+
+class OnnxEmbedder:
+    """接口与 SentenceTransformer.encode 一致，返回 float32 numpy 数组"""
+
+    def __init__(self, model_dir, quantized=True, num_threads=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.source = self.config["source"]
+        self.pooling = self.config["pooling"]
+        self.normalize = self.config["normalize"]
+        self.dim = self.config["dim"]
+
+        int8_path = os.path.join(model_dir, INT8_FILE)
+        self.quantized = quantized and os.path.exists(int8_path)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            # 和 PyTorch 在同一进程：只用分到的线程数，空闲时不自旋等待，避免占着核拖慢大模型
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+            options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+        self.session = ort.InferenceSession(int8_path if self.quantized else os.path.join(model_dir, FP32_FILE),
+                                            options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"] or 0,
+                                      pad_token=self.config["pad_token"] or "[PAD]")
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _embed(self, texts, normalize):
+        encodings = self.tokenizer.encode_batch(texts)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": np.array([e.ids for e in encodings], dtype=np.int64), "attention_mask": mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        hidden = self.session.run(None, feeds)[0]  # last_hidden_state: (batch, seq, dim)
+
+        if self.pooling == "cls":
+            vectors = hidden[:, 0]
+        else:
+            weights = mask[:, :, None].astype(np.float32)
+            vectors = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+        if normalize:
+            vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors.astype(np.float32)
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, normalize_embeddings=None, **kwargs):
+        """kwargs 里 SentenceTransformer 的其它参数（convert_to_numpy 等）忽略，总是返回 numpy"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        normalize = self.normalize if normalize_embeddings is None else normalize_embeddings
+
+        result = np.zeros((len(texts), self.dim), dtype=np.float32)
+        # 按长度排序后分批，同一批长度相近，padding 更少
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        for i in range(0, len(texts), batch_size):
+            idx = order[i:i + batch_size]
+            result[idx] = self._embed([texts[j] for j in idx], normalize)
+        return result[0] if single else result
+
+
+def resolve_embedding_model(model_name, backend="torch", onnx_dir=None, quantized=True):
+    """
+    不加载模型，返回 (要用的 ONNX 目录或 None, 模型标识)
+    模型标识用于向量缓存和向量库的同步状态：ONNX / int8 的向量和原模型有微小差别，单独区分，
+    换了后端或量化方式时向量库据此重新 Embedding，不和旧向量混用
+    """
+    if backend == "onnx":
+        config_path = os.path.join(onnx_dir or "", CONFIG_FILE)
+        if os.path.exists(config_path):
+            with open(config_path, "r", encoding="utf-8") as f:
+                source = json.load(f)["source"]
+            if source == model_name:
+                int8 = quantized and os.path.exists(os.path.join(onnx_dir, INT8_FILE))
+                return onnx_dir, f"{model_name}|onnx{'-int8' if int8 else ''}"
+            print(f"⚠️ {onnx_dir} 是从 {source} 导出的，与 {model_name} 不一致")
+        print("⚠️ 未找到可用的 ONNX Embedding 模型（python onnx_embedder.py 导出），改用 SentenceTransformer")
+    return None, model_name
+
+
+def load_embedding_model(model_name, backend="torch", onnx_dir=None, quantized=True):
+    """
+    返回 (模型, 模型标识)，模型都有 encode 接口，标识见 resolve_embedding_model
+    backend="onnx" 时使用 onnx_dir 里导出的模型；没导出或导出的不是 model_name 时退回 SentenceTransformer
+    """
+    onnx_path, model_id = resolve_embedding_model(model_name, backend, onnx_dir, quantized)
+    if onnx_path is not None:
+        from runtime_profile import embedding_threads
+        try:
+            # 和大模型同一进程时只用运行时配置分给 Embedding 的线程数，避免两个线程池抢核
+            model = OnnxEmbedder(onnx_path, quantized, num_threads=embedding_threads())
+        except ImportError as e:
+            print(f"⚠️ 无法使用 ONNX Runtime ({e})，改用 SentenceTransformer")
+            model_id = model_name
+        else:
+            print(f"✅ 使用 ONNX Runtime Embedding ({'int8' if model.quantized else 'fp32'}): {onnx_path}")
+            return model, model_id
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name), model_id
+
+# ==========================================
+# 一致性 / 速度对比
+# ==========================================
+
+def load_texts(path, limit):
+    """训练数据里的问题和答案，作为入库文本 / 查询的样本"""
+    texts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for message in json.loads(line)["messages"]:
+                if message["role"] != "system" and message["content"] not in texts:
+                    texts.append(message["content"])
+            if len(texts) >= limit:
+                break
+    return texts[:limit]
+
+
+def cosine_drift(reference, vectors):
+    """逐条 1 - cos(原模型向量, 新向量)"""
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return 1 - (reference * vectors).sum(axis=1)
+
+
+def measure_throughput(model, texts, batch_size, num_queries):
+    """批量编码（入库）和逐条编码（查询）的速度"""
+    model.encode(texts[:batch_size], batch_size=batch_size)  # 预热
+    start = time.perf_counter()
+    model.encode(texts, batch_size=batch_size)
+    batch_time = time.perf_counter() - start
+
+    queries = texts[:num_queries]
+    start = time.perf_counter()
+    for query in queries:
+        model.encode(query)
+    single_time = time.perf_counter() - start
+    return {
+        "batch_texts_per_sec": len(texts) / batch_time,
+        "single_queries_per_sec": len(queries) / single_time,
+        "single_query_ms": single_time / len(queries) * 1000,
+    }
+
+
+if __name__ == "__main__":
+    from config import setup_environment, EMBEDDING_MODEL, ONNX_EMBEDDING_DIR, TRAIN_DATA_LARGE
+
+    parser = argparse.ArgumentParser(description="导出 ONNX Embedding 模型并对比一致性 / 速度")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--onnx-dir", default=ONNX_EMBEDDING_DIR)
+    parser.add_argument("--no-int8", action="store_true", help="不导出 int8 量化版本")
+    parser.add_argument("--skip-export", action="store_true", help="使用已导出的模型")
+    parser.add_argument("--data", default=TRAIN_DATA_LARGE)
+    parser.add_argument("--num-texts", type=int, default=256)
+    parser.add_argument("--num-queries", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--output", help="把结果写入 json 文件")
+    args = parser.parse_args()
+
+    setup_environment()
+    if not args.skip_export:
+        export_embedder(args.model, args.onnx_dir, quantize=not args.no_int8)
+
+    from sentence_transformers import SentenceTransformer
+
+    texts = load_texts(args.data, args.num_texts)
+    print(f"\n测试文本: {len(texts)} 条，批大小 {args.batch_size}，单条查询 {min(args.num_queries, len(texts))} 次")
+    reference_model = SentenceTransformer(args.model)
+    reference = np.asarray(reference_model.encode(texts, batch_size=args.batch_size), dtype=np.float32)
+
+    variants = {"sentence_transformers": reference_model, "onnx_fp32": OnnxEmbedder(args.onnx_dir, quantized=False)}
+    if os.path.exists(os.path.join(args.onnx_dir, INT8_FILE)):
+        variants["onnx_int8"] = OnnxEmbedder(args.onnx_dir, quantized=True)
+
+    results = {}
+    for name, model in variants.items():
+        result = measure_throughput(model, texts, args.batch_size, args.num_queries)
+        if name != "sentence_transformers":
+            drift = cosine_drift(reference, model.encode(texts, batch_size=args.batch_size))
+            result.update(drift_mean=float(drift.mean()), drift_max=float(drift.max()))
+        results[name] = result
+
+    base = results["sentence_transformers"]
+    print("\n" + "=" * 50)
+    for name, r in results.items():
+        drift = f" | cos 偏差 平均 {r['drift_mean']:.2e} 最大 {r['drift_max']:.2e}" if "drift_mean" in r else ""
+        print(f"{name:22s} 批量 {r['batch_texts_per_sec']:7.1f} 条/s "
+              f"({r['batch_texts_per_sec'] / base['batch_texts_per_sec']:.2f}x) | "
+              f"单条 {r['single_query_ms']:6.2f} ms ({base['single_query_ms'] / r['single_query_ms']:.2f}x){drift}")
+    print("=" * 50)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"model": args.model, "num_texts": len(texts), "results": results}, f,
+                      ensure_ascii=False, indent=2)
+        print(f"✅ 结果已保存到 {args.output}")
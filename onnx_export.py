@@ -0,0 +1,98 @@
+"""
+把模型导出成 ONNX（带 KV Cache 输入输出），用 ONNX Runtime 在 CPU 上推理
+导出的图会把 past_key_values 作为输入、present 作为输出，解码时每步只算新 token；
+ONNX Runtime 会做算子融合、常量折叠等图优化，CPU 上通常比 PyTorch eager 快。
+指定 LoRA 时先合并进权重（复用 merge_adapter.py 导出的合并模型），再导出。
+导出目录里的 onnx_manifest.json 记录来源，load_llm 在 LLM_BACKEND="onnx" 时据此判断能否使用。
+
+依赖：pip install optimum[onnxruntime]
+
+运行：
+    python onnx_export.py                              # 基座模型 + fine_tuned_model -> onnx_model
+    python onnx_export.py --no-lora                    # 只导出基座模型
+    python onnx_export.py --lora ./other_adapter --output ./other_onnx
+"""
+
+import argparse
+import json
+import os
+import time
+
+from config import BASE_MODEL, FINE_TUNED_MODEL_DIR, MERGED_MODEL_DIR, ONNX_MODEL_DIR
+from merge_adapter import adapter_files, export_merged, files_digest, find_merged_model
+
+MANIFEST_FILE = "onnx_manifest.json"
+
+# ==========================================
+# 导出
+# ==========================================
+
+def export_onnx(base_model=BASE_MODEL, lora_path=None, output_dir=ONNX_MODEL_DIR, merged_dir=MERGED_MODEL_DIR):
+    from optimum.onnxruntime import ORTModelForCausalLM
+    from transformers import AutoTokenizer
+
+    start = time.time()
+    source = base_model
+    if lora_path:
+        # ONNX 图里没有 LoRA 分支，先把 LoRA 合并进权重
+        source = find_merged_model(lora_path, merged_dir, base_model)
+        if source is None:
+            export_merged(base_model, lora_path, merged_dir)
+            source = merged_dir
+
+    print(f"正在导出 ONNX (带 KV Cache): {source}")
+    model = ORTModelForCausalLM.from_pretrained(source, export=True, use_cache=True)
+    model.save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(source).save_pretrained(output_dir)
+
+    manifest = {
+        "base_model": base_model,
+        "adapter": os.path.abspath(lora_path) if lora_path else None,
+        "adapter_sha256": files_digest(adapter_files(lora_path)) if lora_path else None,
+        "created_at": time.time(),
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"✅ ONNX 模型已保存到 {output_dir} (耗时 {time.time() - start:.1f}s)")
+    return manifest
+
+# ==========================================
+# 加载时检查
+# ==========================================
+
+def find_onnx_model(lora_path=None, onnx_dir=ONNX_MODEL_DIR, base_model=BASE_MODEL):
+    """
+    导出的 ONNX 模型和当前配置一致时返回它的目录，否则返回 None：
+    - 基座模型一致
+    - 需要 LoRA 时，导出时合并的 LoRA 和当前 LoRA 权重的哈希一致；不需要 LoRA 时导出的也必须是基座模型
+    """
+    manifest_path = os.path.join(onnx_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest.get("base_model") != base_model:
+        return None
+    if not lora_path:
+        return onnx_dir if manifest.get("adapter") is None else None
+    files = adapter_files(lora_path)
+    if not files or manifest.get("adapter_sha256") != files_digest(files):
+        print(f"⚠️ ONNX 模型 {onnx_dir} 与当前 LoRA 权重不一致，可运行 python onnx_export.py 重新导出")
+        return None
+    return onnx_dir
+
+
+if __name__ == "__main__":
+    from config import setup_environment
+
+    parser = argparse.ArgumentParser(description="导出带 KV Cache 的 ONNX 模型")
+    parser.add_argument("--base", default=BASE_MODEL, help="基座模型")
+    parser.add_argument("--lora", default=FINE_TUNED_MODEL_DIR, help="LoRA 权重目录（先合并再导出）")
+    parser.add_argument("--no-lora", action="store_true", help="只导出基座模型")
+    parser.add_argument("--output", default=ONNX_MODEL_DIR, help="ONNX 模型输出目录")
+    args = parser.parse_args()
+
+    setup_environment()
+    lora_path = None if args.no_lora or not os.path.exists(args.lora) else args.lora
+    export_onnx(args.base, lora_path, args.output)
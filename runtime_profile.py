@@ -0,0 +1,271 @@
+"""
+运行时调优配置：线程数、模型精度、注意力实现
+在本机实测一次（python runtime_profile.py），把最快的组合写入 RUNTIME_PROFILE_FILE，
+之后 config.setup_environment() 会自动应用线程设置，LocalLLM 按配置的精度 / 注意力实现加载模型。
+- 线程数：多核机器上默认线程数 = 逻辑核数，Embedding 和大模型在同一进程时会互相抢核；
+  速度相差不到 5% 时选更少的线程，给其它计算留出余量
+- Embedding 线程数：导出了 ONNX Embedding（python onnx_embedder.py）时，让它在后台持续编码，
+  同时测大模型的生成速度，选不明显拖慢大模型的最大线程数；没有导出时用剩下的核数（至少 1）
+- 精度：CPU 比较 float32 / bfloat16，GPU 比较 float16 / bfloat16
+- 注意力：sdpa (scaled_dot_product_attention) vs eager
+换了机器（CPU 核数、GPU、torch 版本不同）时配置自动失效，需要重新运行。
+
+运行：
+    python runtime_profile.py                       # 用 BASE_MODEL 实测并保存
+    python runtime_profile.py --max-new-tokens 64 --repeats 5
+"""
+
+import argparse
+import json
+import os
+import platform
+import time
+
+_active = None  # 当前进程已应用的配置
+
+# ==========================================
+# 读取 / 应用
+# ==========================================
+
+def physical_cores():
+    try:
+        import psutil
+        return psutil.cpu_count(logical=False) or os.cpu_count()
+    except ImportError:
+        return os.cpu_count()
+
+
+def machine_info():
+    """用来判断配置是不是在这台机器上测出来的"""
+    import torch
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "gpu": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        "torch": torch.__version__,
+    }
+
+
+def load_profile(path):
+    """读取配置；文件不存在或不是本机测出来的返回 None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        profile = json.load(f)
+    if profile.get("machine") != machine_info():
+        print(f"⚠️ {path} 不是在本机（或当前 torch 版本下）测出来的，已忽略，可运行 python runtime_profile.py 重新生成")
+        return None
+    return profile
+
+
+def apply_profile(profile):
+    """
+    设置线程数；精度和注意力实现由 model_load_kwargs() 在加载模型时使用
+    torch.set_num_threads 同时限制 torch 内部 OpenMP / MKL 的线程数
+    （OMP_NUM_THREADS 等环境变量要在 import torch 之前设置才生效，读配置时 torch 已经导入，所以不用它们）
+    """
+    global _active
+    import torch
+
+    torch.set_num_threads(profile["num_threads"])
+    try:
+        torch.set_num_interop_threads(profile["num_interop_threads"])
+    except RuntimeError:
+        pass  # 已经有过并行计算后不能再修改，保持原值
+    _active = profile
+    return profile
+
+
+def embedding_threads():
+    """
+    和大模型同一进程时 ONNX Runtime Embedding 的线程数（没有配置时返回 None，用 ONNX Runtime 默认值）
+    两个线程池各开满核数会互相抢核，所以 Embedding 只用实测出来的份额
+    """
+    if _active is None:
+        return None
+    return _active.get("embedding_threads") or max(1, physical_cores() - _active["num_threads"])
+
+
+def model_load_kwargs(device):
+    """AutoModelForCausalLM.from_pretrained 的 dtype / attn_implementation 参数；没有配置时保持默认"""
+    if _active is None or _active.get("device") != device:
+        return {"dtype": "auto"}
+    return {"dtype": _active["dtype"], "attn_implementation": _active["attn_implementation"]}
+
+# ==========================================
+# 实测
+# ==========================================
+
+def decode_speed(model, inputs, max_new_tokens, repeats):
+    """固定生成 max_new_tokens 个 token，取 repeats 次里最快的 tokens/秒"""
+    import torch
+
+    with torch.no_grad():
+        model.generate(**inputs, max_new_tokens=4, do_sample=False)  # 预热
+        best = 0.0
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model.generate(**inputs, max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens, do_sample=False)
+            best = max(best, max_new_tokens / (time.perf_counter() - start))
+    return best
+
+
+def thread_candidates():
+    cores = physical_cores()
+    candidates = {cores}
+    n = 1
+    while n < cores:
+        candidates.add(n)
+        n *= 2
+    return sorted(candidates)
+
+
+def colocated_speed(model, inputs, max_new_tokens, repeats, embedder, texts):
+    """后台线程不停地用 embedder 编码 texts，同时测大模型的生成速度，返回 (tokens/秒, 编码条数/秒)"""
+    import threading
+
+    stop = threading.Event()
+    encoded = [0]
+
+    def embed_loop():
+        while not stop.is_set():
+            embedder.encode(texts)
+            encoded[0] += len(texts)
+
+    thread = threading.Thread(target=embed_loop, daemon=True)
+    start = time.perf_counter()
+    thread.start()
+    try:
+        speed = decode_speed(model, inputs, max_new_tokens, repeats)
+    finally:
+        stop.set()
+        thread.join()
+    return speed, encoded[0] / (time.perf_counter() - start)
+
+
+def probe_embedding_threads(model, inputs, max_new_tokens, repeats, tolerance, num_threads,
+                            embedder_dir, quantized, texts):
+    """
+    大模型用 num_threads 线程时，Embedding 可以用几个线程：
+    选同时运行时大模型速度下降不超过 tolerance 的最大线程数；没有 ONNX Embedding 时返回剩下的核数
+    """
+    fallback = max(1, physical_cores() - num_threads)
+    try:
+        from onnx_embedder import CONFIG_FILE, OnnxEmbedder
+        if not embedder_dir or not os.path.exists(os.path.join(embedder_dir, CONFIG_FILE)):
+            raise FileNotFoundError(embedder_dir)
+        embedders = {n: OnnxEmbedder(embedder_dir, quantized, num_threads=n) for n in thread_candidates()}
+    except (ImportError, OSError) as e:
+        print(f"  ⚠️ 没有可用的 ONNX Embedding ({e})，Embedding 线程数取剩下的核数: {fallback}")
+        return fallback, {}
+
+    solo = decode_speed(model, inputs, max_new_tokens, repeats)
+    results = {}
+    best = 1
+    for n, embedder in embedders.items():
+        speed, embed_rate = colocated_speed(model, inputs, max_new_tokens, repeats, embedder, texts)
+        results[n] = {"llm_tokens_per_sec": speed, "embeddings_per_sec": embed_rate}
+        print(f"  Embedding {n:3d} 线程: 大模型 {speed:6.1f} tokens/s (单独 {solo:.1f}) | "
+              f"Embedding {embed_rate:6.1f} 条/s")
+        if speed >= solo * (1 - tolerance):
+            best = n
+    return best, {"solo_llm_tokens_per_sec": solo, "threads": results}
+
+
+def probe(model_path, messages, max_new_tokens=32, repeats=3, tolerance=0.05, embedder_dir=None,
+          embedder_int8=True):
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    inputs = tokenizer.apply_chat_template(messages, add_generation_prompt=True, return_tensors="pt",
+                                           return_dict=True).to(device)
+
+    def load(dtype, attn):
+        model = AutoModelForCausalLM.from_pretrained(model_path, dtype=getattr(torch, dtype),
+                                                     attn_implementation=attn)
+        return model.to(device).eval()
+
+    # 1. 线程数（只影响 CPU 计算）：float32 + sdpa 下逐个测
+    thread_results = {}
+    num_threads = torch.get_num_threads()
+    if device == "cpu":
+        model = load("float32", "sdpa")
+        for n in thread_candidates():
+            torch.set_num_threads(n)
+            thread_results[n] = decode_speed(model, inputs, max_new_tokens, repeats)
+            print(f"  {n:3d} 线程: {thread_results[n]:6.1f} tokens/s")
+        fastest = max(thread_results.values())
+        num_threads = min(n for n, speed in thread_results.items() if speed >= fastest * (1 - tolerance))
+        torch.set_num_threads(num_threads)
+
+        # 1.1 和 Embedding 同时运行（step7 / step8 的实际情况）时 Embedding 能分到几个线程
+        texts = [m["content"] for m in messages if m["role"] != "system"] * 8
+        embedding_threads, colocated_results = probe_embedding_threads(
+            model, inputs, max_new_tokens, repeats, tolerance, num_threads, embedder_dir, embedder_int8, texts
+        )
+        del model
+    else:
+        embedding_threads, colocated_results = None, {}
+    torch.set_num_threads(num_threads)
+
+    # 2. 精度 × 注意力实现
+    dtypes = ["float32", "bfloat16"] if device == "cpu" else ["float16"]
+    if device == "cuda" and torch.cuda.is_bf16_supported():
+        dtypes.append("bfloat16")
+    variant_results = {}
+    for dtype in dtypes:
+        for attn in ("sdpa", "eager"):
+            model = load(dtype, attn)
+            variant_results[f"{dtype}/{attn}"] = decode_speed(model, inputs, max_new_tokens, repeats)
+            print(f"  {dtype:9s} {attn:5s}: {variant_results[f'{dtype}/{attn}']:6.1f} tokens/s")
+            del model
+            if device == "cuda":
+                torch.cuda.empty_cache()
+    best = max(variant_results, key=variant_results.get)
+    dtype, attn = best.split("/")
+
+    return {
+        "device": device,
+        "num_threads": num_threads,
+        # eager 推理基本用不到 inter-op 并行，设为 1 避免额外的线程池和 intra-op 线程抢核
+        "num_interop_threads": 1,
+        "embedding_threads": embedding_threads,
+        "dtype": dtype,
+        "attn_implementation": attn,
+        "model": model_path,
+        "machine": machine_info(),
+        "created_at": time.time(),
+        "results": {"threads": thread_results, "colocated": colocated_results, "variants": variant_results},
+    }
+
+
+if __name__ == "__main__":
+    from config import (setup_environment, BASE_MODEL, ONNX_EMBEDDING_DIR, ONNX_EMBEDDING_INT8, RUNTIME_PROFILE_FILE,
+                        TRAIN_DATA_LARGE)
+    from bench_generation import load_prompts
+
+    parser = argparse.ArgumentParser(description="实测本机最快的线程数 / 精度 / 注意力实现")
+    parser.add_argument("--model", default=BASE_MODEL)
+    parser.add_argument("--output", default=RUNTIME_PROFILE_FILE)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--embedding-dir", default=ONNX_EMBEDDING_DIR,
+                        help="ONNX Embedding 目录，用来实测和大模型同时运行时 Embedding 的线程数")
+    args = parser.parse_args()
+
+    setup_environment(apply_runtime_profile=False)  # 实测时不能套用旧配置
+    print(f"模型: {args.model}\n物理核数: {physical_cores()}\n")
+    profile = probe(args.model, load_prompts(TRAIN_DATA_LARGE, 1)[0], args.max_new_tokens, args.repeats,
+                    embedder_dir=args.embedding_dir, embedder_int8=ONNX_EMBEDDING_INT8)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+
+    print("\n" + "=" * 50)
+    print(f"设备: {profile['device']} | 线程: {profile['num_threads']} | "
+          f"Embedding 线程: {profile['embedding_threads'] or '-'} | 精度: {profile['dtype']} | "
+          f"注意力: {profile['attn_implementation']}")
+    print("=" * 50)
+    print(f"✅ 已保存到 {args.output}，之后各脚本调用 setup_environment() 时自动应用")
@@ -108,3 +108,4 @@ trainer.train()
 print(f"训练完成！正在保存模型到 {output_dir} ...")
 trainer.save_model(output_dir)
 print("阶段三完成！你的专属模型已经诞生了。")
+print("提示：运行 python merge_adapter.py 把 LoRA 合并进基座模型，之后加载和推理都会更快。")
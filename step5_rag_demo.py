@@ -7,10 +7,8 @@ from config import setup_environment, BASE_MODEL, DB_FILE
 # 设置环境（镜像源、缓存路径等）
 setup_environment()
 
-import sqlite3
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
-import difflib
+from faq_retriever import get_retriever
+from llm_service import load_llm
 
 # ==========================================
 # 阶段五：RAG (检索增强生成) - 实时连接数据库
@@ -21,34 +19,20 @@ db_file = DB_FILE
 model_name = BASE_MODEL
 
 print("正在加载基座模型 (这次不需要微调的权重，因为我们要演示它如何'查'资料)...")
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForCausalLM.from_pretrained(model_name, dtype="auto")
-
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model = model.to(device)
-print(f"模型加载完成，运行在: {device}")
+# 推理服务 (inference_server.py) 在运行时直接连接服务，不再重复加载模型
+llm = load_llm()
 
 # 2. 定义检索函数 (模拟 AI 去数据库里“找”资料的过程)
+# 知识库只在启动时加载一次并常驻内存，数据库文件变化时自动增量刷新
+retriever = get_retriever(db_file)
+
 def search_database(query):
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    
-    # 获取数据库里所有的问题
-    cursor.execute("SELECT question, answer FROM faq")
-    all_data = cursor.fetchall()
-    conn.close()
-    
-    # 简单的相似度匹配 (在实际生产中，这里会用“向量数据库”技术)
-    questions = [row[0] for row in all_data]
+    # 字符 n-gram + BM25 相似度匹配 (在实际生产中，还会结合“向量数据库”技术)
     # 找到和用户问题最像的那条数据库记录
-    matches = difflib.get_close_matches(query, questions, n=1, cutoff=0.4)
+    hit = retriever.search(query)
     
-    if matches:
-        best_match = matches[0]
-        # 找到对应答案
-        for q, a in all_data:
-            if q == best_match:
-                return f"找到相关资料：\n问题：{q}\n答案：{a}"
+    if hit:
+        return f"找到相关资料：\n问题：{hit['question']}\n答案：{hit['answer']}"
     
     return "数据库中未找到相关资料。"
 
@@ -77,18 +61,7 @@ def ask_ai_with_rag(user_question):
     ]
     
     # 第三步：生成 (Generate)
-    text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-    inputs = tokenizer([text], return_tensors="pt").to(device)
-    
-    generated_ids = model.generate(
-        input_ids=inputs.input_ids,
-        attention_mask=inputs.attention_mask,
-        max_new_tokens=128
-    )
-    generated_ids = [
-        output_ids[len(input_ids):] for input_ids, output_ids in zip(inputs.input_ids, generated_ids)
-    ]
-    return tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+    return llm.chat(messages, max_new_tokens=128, use_adapter=False)
 
 # 4. 测试
 test_questions = [
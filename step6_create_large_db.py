@@ -4,6 +4,8 @@ import sqlite3
 
 # 导入统一配置
 from config import DB_FILE, TRAIN_DATA_LARGE
+from faq_retriever import create_fts_index
+from faq_vector_sync import create_change_log
 
 """
 阶段六：构建更大的企业知识库数据库 + JSONL 训练集
@@ -11,7 +13,9 @@ from config import DB_FILE, TRAIN_DATA_LARGE
 这个脚本会：
 1. 重建 company_data.db（覆盖旧的 FAQ 内容，生成更丰富的知识库）
 2. 向 FAQ 表写入 45 条覆盖多个业务场景的问答
-3. 导出更大的训练数据集 train_data_large.jsonl
+3. 创建 FTS5 全文索引 faq_fts（trigram 分词，触发器自动同步）
+4. 创建变更日志 faq_changes（供 faq_vector_sync.py 增量同步向量库）
+5. 导出更大的训练数据集 train_data_large.jsonl
 运行：python step6_create_large_db.py
 """
 
@@ -36,6 +40,17 @@ cursor.execute(
     """
 )
 
+# FTS5 全文索引：在插入数据前建好，之后 faq 表的增删改由触发器同步
+try:
+    create_fts_index(conn)
+    print("✅ 已创建 FTS5 全文索引 faq_fts (trigram)")
+except sqlite3.OperationalError as e:
+    print(f"⚠️ 当前 SQLite 不支持 FTS5 trigram 分词 (需要 3.34+)，跳过全文索引: {e}")
+
+# 变更日志：记录 faq 表的每次增删改，向量库据此只同步变化的行
+create_change_log(conn)
+print("✅ 已创建变更日志 faq_changes")
+
 # 更丰富的企业知识库（可根据需要再扩展）
 dataset = [
     # 公司制度
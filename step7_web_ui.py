@@ -1,18 +1,18 @@
 import os
 import sys
+import time
+from contextlib import closing
 
 # 导入统一配置
-from config import setup_environment, BASE_MODEL, FINE_TUNED_MODEL_DIR, DB_FILE
+from config import setup_environment, BASE_MODEL, FINE_TUNED_MODEL_DIR, DB_FILE, BATCH_SCHEDULER_MAX_BATCH
 
 # 设置环境（镜像源、缓存路径等）
 setup_environment()
 
 import gradio as gr
-import sqlite3
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from peft import PeftModel
-import difflib
+from faq_retriever import get_retriever
+from history_manager import HistoryManager
+from llm_service import load_llm
 
 # ==========================================
 # 阶段七：Web UI (Gradio + RAG + LoRA)
@@ -25,46 +25,40 @@ db_file = DB_FILE
 
 print("正在初始化系统...")
 
-# 1. 加载模型
+# 1. 加载模型（推理服务在运行时直接连接服务；LoRA 不存在时使用基座模型）
 print("正在加载模型...")
-tokenizer = AutoTokenizer.from_pretrained(base_model_name)
-base_model = AutoModelForCausalLM.from_pretrained(base_model_name, dtype="auto")
+llm = load_llm(lora_path=lora_path)
+if hasattr(llm, "start_scheduler"):
+    # 本进程加载的模型：开启连续批处理，多人同时提问时合并解码
+    llm.start_scheduler(BATCH_SCHEDULER_MAX_BATCH)
 
-try:
-    model = PeftModel.from_pretrained(base_model, lora_path)
-    print("✅ 微调权重加载成功")
-except:
-    print("⚠️ 使用基座模型")
-    model = base_model
+# 对话历史按 token 预算裁剪（连接推理服务时本进程没有模型，只加载 tokenizer 计数）
+if hasattr(llm, "tokenizer"):
+    tokenizer = llm.tokenizer
+else:
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(base_model_name)
+history_manager = HistoryManager(tokenizer)
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model = model.to(device)
-print(f"✅ 运行在: {device}")
+# 2. 数据库检索（知识库常驻内存，数据库变化时自动刷新）
+retriever = get_retriever(db_file)
 
-# 2. 数据库检索
 def search_database(query):
     if not isinstance(query, str):
         query = str(query)
     try:
-        conn = sqlite3.connect(db_file)
-        cursor = conn.cursor()
-        cursor.execute("SELECT question, answer FROM faq")
-        all_data = cursor.fetchall()
-        conn.close()
-        
-        questions = [row[0] for row in all_data]
-        matches = difflib.get_close_matches(query, questions, n=1, cutoff=0.4)
-        
-        if matches:
-            for q, a in all_data:
-                if q == matches[0]:
-                    return f"问题：{q}\n答案：{a}"
+        hit = retriever.search(query)
+        if hit:
+            return f"问题：{hit['question']}\n答案：{hit['answer']}"
         return None
     except Exception as e:
         return None
 
 # 3. 生成回答
-def generate_response(message, history):
+SYSTEM_PROMPT = "你是FutureAI公司的助手。有参考资料时根据参考资料回答。"
+
+def build_messages(message, history):
+    """检索 + 构建对话消息，返回 (messages, rag_status)"""
     # 提取文本
     if isinstance(message, list):
         message = " ".join([item.get('text', '') for item in message if isinstance(item, dict)])
@@ -74,31 +68,44 @@ def generate_response(message, history):
     retrieved = search_database(message)
     
     # 构建Prompt
+    # 参考资料只放在本轮用户消息里，system 提示词固定不变，
+    # 这样下一轮的历史部分（除上一轮的用户消息外）和本轮请求一致，可以复用本轮的 KV Cache
     if retrieved:
-        system_prompt = f"你是FutureAI公司的助手。根据参考资料回答：\n{retrieved}"
+        user_prompt = f"参考资料：\n{retrieved}\n\n问题：{message}"
         rag_status = f"✅ 找到资料：\n{retrieved}"
     else:
-        system_prompt = "你是FutureAI公司的助手。"
+        user_prompt = message
         rag_status = "❌ 未找到相关资料"
     
-    # 构建消息
-    messages = [{"role": "system", "content": system_prompt}]
+    # 构建消息（历史超出 token 预算时丢弃最早的几轮）
+    previous = []
     for msg in history:
         if isinstance(msg, dict):
-            messages.append({"role": msg.get("role", "user"), "content": str(msg.get("content", ""))})
-    messages.append({"role": "user", "content": message})
-    
-    # 生成
-    text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-    inputs = tokenizer([text], return_tensors="pt").to(device)
-    
-    with torch.no_grad():
-        outputs = model.generate(
-            **inputs, max_new_tokens=256, temperature=0.7, top_p=0.9
-        )
-    
-    response = tokenizer.decode(outputs[0][len(inputs.input_ids[0]):], skip_special_tokens=True)
-    return response, rag_status
+            previous.append({"role": msg.get("role", "user"), "content": str(msg.get("content", ""))})
+    messages, report = history_manager.fit(
+        [{"role": "system", "content": SYSTEM_PROMPT}], previous, {"role": "user", "content": user_prompt}
+    )
+    if report["trimmed_tokens"]:
+        print(f"[历史裁剪] 丢弃最早 {report['dropped_turns']} 轮 / {report['trimmed_tokens']} tokens，"
+              f"prompt {report['prompt_tokens']} tokens")
+        rag_status += f"\n\n📝 对话较长，已省略最早的 {report['dropped_turns']} 轮对话（{report['trimmed_tokens']} tokens）"
+    return messages, rag_status
+
+def generate_response(message, history, session_id=None):
+    """
+    流式生成：每次 yield (当前已生成的回答, rag_status)
+    第一次 yield 在检索完成后立即返回（回答为空），界面可以先显示 RAG 结果
+    session_id 相同的多轮对话会复用上一轮的 KV Cache
+    """
+    messages, rag_status = build_messages(message, history)
+    response = ""
+    yield response, rag_status
+    # 页面关闭 / 点了停止时 Gradio 会关闭本生成器，closing 保证模型端的生成同时被取消
+    with closing(llm.chat_stream(messages, max_new_tokens=256, session_id=session_id,
+                                 temperature=0.7, top_p=0.9)) as pieces:
+        for piece in pieces:
+            response += piece
+            yield response, rag_status
 
 # 4. Gradio界面
 with gr.Blocks(title="FutureAI 智能助手") as demo:
@@ -110,29 +117,52 @@ with gr.Blocks(title="FutureAI 智能助手") as demo:
             msg = gr.Textbox(label="输入问题", placeholder="例如：Wifi密码是多少？")
             with gr.Row():
                 submit = gr.Button("发送", variant="primary")
+                stop = gr.Button("停止")
                 clear = gr.Button("清除")
         
         with gr.Column(scale=1):
             rag_info = gr.Textbox(label="RAG检索状态", lines=8, interactive=False)
+            latency_info = gr.Textbox(label="响应耗时", lines=2, interactive=False)
     
     def user_input(message, history):
         return "", history + [{"role": "user", "content": message}]
     
-    def bot_response(history):
+    def bot_response(history, request: gr.Request):
         if not history:
-            return history, ""
+            yield history, "", ""
+            return
+        start = time.perf_counter()
         user_msg = history[-1]["content"]
-        response, rag_data = generate_response(user_msg, history[:-1])
-        history.append({"role": "assistant", "content": response})
-        return history, rag_data
+        history.append({"role": "assistant", "content": ""})
+        
+        # 检索完成后 generate_response 会先 yield 一次空回答，RAG 面板立即更新
+        ttft = None
+        session_id = request.session_hash if request else None  # 每个浏览器页面一个会话
+        with closing(generate_response(user_msg, history[:-2], session_id)) as responses:
+            for response, rag_data in responses:
+                if response and ttft is None:
+                    ttft = time.perf_counter() - start
+                history[-1]["content"] = response
+                status = f"首字延迟 (TTFT): {ttft:.2f}s\n⏳ 生成中..." if ttft is not None else "⏳ 生成中..."
+                yield history, rag_data, status
+        
+        total = time.perf_counter() - start
+        ttft_text = f"{ttft:.2f}s" if ttft is not None else "-"
+        latency = f"首字延迟 (TTFT): {ttft_text}\n总耗时: {total:.2f}s"
+        print(f"[耗时] TTFT {ttft_text} / 总计 {total:.2f}s")
+        yield history, rag_data, latency
     
-    msg.submit(user_input, [msg, chatbot], [msg, chatbot]).then(
-        bot_response, [chatbot], [chatbot, rag_info]
+    msg_event = msg.submit(user_input, [msg, chatbot], [msg, chatbot]).then(
+        bot_response, [chatbot], [chatbot, rag_info, latency_info]
     )
-    submit.click(user_input, [msg, chatbot], [msg, chatbot]).then(
-        bot_response, [chatbot], [chatbot, rag_info]
+    submit_event = submit.click(user_input, [msg, chatbot], [msg, chatbot]).then(
+        bot_response, [chatbot], [chatbot, rag_info, latency_info]
     )
-    clear.click(lambda: ([], ""), None, [chatbot, rag_info])
+    stop.click(None, None, None, cancels=[msg_event, submit_event])
+    clear.click(lambda: ([], "", ""), None, [chatbot, rag_info, latency_info])
+
+# Gradio 默认每个事件只并发处理 1 个请求，放开后并发请求才能进入同一个 batch
+demo.queue(default_concurrency_limit=BATCH_SCHEDULER_MAX_BATCH)
 
 if __name__ == "__main__":
     import os
@@ -2,16 +2,20 @@ import os
 import sys
 
 # 导入统一配置
-from config import setup_environment, BASE_MODEL, EMBEDDING_MODEL, DB_FILE, CHROMA_DB_PATH
+from config import (setup_environment, BASE_MODEL, EMBEDDING_MODEL, DB_FILE, CHROMA_DB_PATH, EMBEDDING_CACHE_DIR,
+                    QUERY_EMBEDDING_CACHE_MB, QUERY_EMBEDDING_CACHE_TTL, VECTOR_STORE_BACKEND, VECTOR_STORE_DTYPE,
+                    EMBEDDING_BACKEND, ONNX_EMBEDDING_DIR, ONNX_EMBEDDING_INT8)
 
 # 设置环境（镜像源、缓存路径等）
 setup_environment()
 
-import sqlite3
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from sentence_transformers import SentenceTransformer
-import chromadb
+from faq_retriever import get_retriever
+from hybrid_retriever import HybridRetriever
+from embedding_cache import CachedEmbedder
+from onnx_embedder import load_embedding_model
+from faq_vector_sync import FAQVectorSync
+from vector_store import open_vector_store
+from llm_service import load_llm
 
 # ==========================================
 # 阶段八：向量检索 RAG (BGE + Chroma)
@@ -30,54 +34,43 @@ print("="*50)
 # 1. 加载Embedding模型（直接使用 config.py 中配置的本地路径）
 print("\n[1/4] 加载 Embedding 模型...")
 print(f"模型路径: {embedding_model_name}")
-embedder = SentenceTransformer(embedding_model_name)
+# EMBEDDING_BACKEND="onnx" 时用 ONNX Runtime 版本（见 onnx_embedder.py）
+embedding_model, embedding_model_id = load_embedding_model(
+    embedding_model_name, EMBEDDING_BACKEND, ONNX_EMBEDDING_DIR, ONNX_EMBEDDING_INT8
+)
+# 外面包一层缓存：入库文本走磁盘缓存（同样的文本只编码一次），查询走内存 LRU
+embedder = CachedEmbedder(
+    embedding_model, embedding_model_id, EMBEDDING_CACHE_DIR,
+    query_cache_bytes=QUERY_EMBEDDING_CACHE_MB * 1024 * 1024,
+    query_cache_ttl=QUERY_EMBEDDING_CACHE_TTL,
+)
 print("✅ Embedding 模型就绪")
 
-# 2. 初始化向量数据库
-print("\n[2/4] 初始化向量数据库...")
-client = chromadb.PersistentClient(path=chroma_path)
-
-try:
-    collection = client.get_collection("company_kb")
+# 2. 初始化向量数据库（chroma: HNSW 近似检索 / numpy: 精确暴力检索，见 config.py）
+print(f"\n[2/4] 初始化向量数据库 ({VECTOR_STORE_BACKEND})...")
+space = "cosine" if VECTOR_STORE_BACKEND == "numpy" else "l2"
+collection = open_vector_store(VECTOR_STORE_BACKEND, chroma_path, "company_kb", space=space, dtype=VECTOR_STORE_DTYPE)
+if collection.count():
     print(f"✅ 已有 {collection.count()} 条向量")
-except:
-    collection = client.create_collection("company_kb")
+else:
     print("✅ 创建新向量库")
 
-# 3. 向量化知识库
-if collection.count() == 0:
-    print("\n[3/4] 向量化知识库...")
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    cursor.execute("SELECT question, answer FROM faq")
-    rows = cursor.fetchall()
-    conn.close()
-    
-    questions = [r[0] for r in rows]
-    embeddings = embedder.encode(questions, show_progress_bar=True)
-    
-    collection.add(
-        ids=[f"faq_{i}" for i in range(len(rows))],
-        embeddings=embeddings.tolist(),
-        documents=[r[1] for r in rows],
-        metadatas=[{"question": r[0]} for r in rows]
-    )
-    print(f"✅ 已向量化 {len(rows)} 条记录")
-else:
-    print("\n[3/4] 跳过向量化（已有数据）")
+# 3. 同步知识库到向量库（只对新增/修改的行做 Embedding，并同步删除）
+print("\n[3/4] 同步知识库...")
+syncer = FAQVectorSync(collection, db_file, model_id=embedding_model_id)  # 换了 Embedding 模型时全部重新 Embedding
+report = syncer.sync(embedder)
+print(f"✅ [{report['mode']}] 更新 {report['upserted']} 条 / 删除 {report['deleted']} 条 "
+      f"(缓存命中 {embedder.hits} / 新编码 {embedder.misses})，当前共 {collection.count()} 条向量")
 
 # 4. 加载语言模型（直接使用 config.py 中配置的本地路径）
 print("\n[4/4] 加载语言模型...")
 print(f"模型路径: {model_name}")
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForCausalLM.from_pretrained(model_name, dtype="auto")
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model = model.to(device)
-print(f"✅ 模型运行在: {device}")
+# 推理服务 (inference_server.py) 在运行时直接连接服务，不再重复加载模型
+llm = load_llm()
 
 # 向量检索函数
 def vector_search(query, top_k=2):
-    embedding = embedder.encode(query)
+    embedding = embedder.encode_query(query)
     results = collection.query(query_embeddings=[embedding.tolist()], n_results=top_k)
     
     docs = []
@@ -90,9 +83,21 @@ def vector_search(query, top_k=2):
             })
     return docs
 
+# 混合检索：BM25 词法检索 + 向量检索，RRF 融合
+# 词法结果足够确定时走快速通道，不调用 Embedding 模型
+lexical_retriever = get_retriever(db_file)
+hybrid = HybridRetriever(
+    lexical_search=lambda q, k: lexical_retriever.search_topk(q, top_k=k, min_coverage=0.25),
+    vector_search=vector_search,
+    key_fn=lambda hit: hit['question'],
+)
+
+def hybrid_search(query, top_k=2):
+    return hybrid.search(query, top_k=top_k)
+
 # RAG生成函数
 def rag_generate(question):
-    docs = vector_search(question)
+    docs, timings = hybrid_search(question)
     
     if docs:
         context = "\n".join([f"问：{d['question']}\n答：{d['answer']}" for d in docs])
@@ -101,13 +106,8 @@ def rag_generate(question):
         system = "你是FutureAI公司的助手。"
     
     messages = [{"role": "system", "content": system}, {"role": "user", "content": question}]
-    text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-    inputs = tokenizer([text], return_tensors="pt").to(device)
-    
-    with torch.no_grad():
-        outputs = model.generate(**inputs, max_new_tokens=200)
-    
-    return tokenizer.decode(outputs[0][len(inputs.input_ids[0]):], skip_special_tokens=True), docs
+    answer = llm.chat(messages, max_new_tokens=200, use_adapter=False)
+    return answer, docs, timings
 
 # 测试
 print("\n" + "="*50)
@@ -118,10 +118,18 @@ test_questions = ["密码是啥？", "年假怎么算？", "怎么报销？", "C
 
 for q in test_questions:
     print(f"\n问: {q}")
-    answer, docs = rag_generate(q)
+    answer, docs, timings = rag_generate(q)
     if docs:
-        print(f"检索: {docs[0]['question'][:30]}... (距离:{docs[0]['distance']:.3f})")
+        top = docs[0]
+        detail = f"距离:{top['distance']:.3f}" if 'distance' in top else f"BM25:{top['score']:.2f}"
+        print(f"检索: {top['question'][:30]}... ({detail})")
+    route = "词法快速通道" if timings['fast_path'] else "混合检索"
+    print(f"耗时: {route} 共 {timings['total_ms']:.1f}ms "
+          f"(词法 {timings['lexical_ms']:.1f}ms / 向量 {timings['vector_ms']:.1f}ms / 融合 {timings['fusion_ms']:.1f}ms)")
     print(f"答: {answer}")
 
+stats = embedder.query_cache.stats()
+print(f"\n查询向量缓存: 命中 {stats['hits']} / 未命中 {stats['misses']} (命中率 {stats['hit_rate']:.0%})")
+
 print("\n" + "="*50)
 print("✅ 阶段八完成！向量库已保存到 ./chroma_db")
@@ -7,93 +7,121 @@ from config import setup_environment, BASE_MODEL
 # 设置环境（镜像源、缓存路径等）
 setup_environment()
 
-import time
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+from transformers import AutoTokenizer, AutoModelForCausalLM
 
 # ==========================================
-# 阶段九：4bit 量化对比
+# 阶段九：量化对比
+# GPU: FP16 vs 8bit vs 4bit (bitsandbytes)
+# CPU: fp32 vs bf16 vs int8 动态量化 (bitsandbytes 只支持 GPU)
 # ==========================================
 
+from bench_generation import benchmark, benchmark_in_subprocess, load_prompts, print_result, save_report
+from cpu_quantization import CPU_PRECISIONS
+
+NUM_PROMPTS = 10      # 从 train_data_large.jsonl 取的测试问题数
+REPEATS = 3           # 每个问题重复生成的轮数（之前先预热）
+MAX_NEW_TOKENS = 50
+REPORT_FILE = "step9_benchmark.json"
+
 model_name = BASE_MODEL
+device = "cuda" if torch.cuda.is_available() else "cpu"
 
 print("="*50)
-print("阶段九：量化技术对比 (FP16 vs 8bit vs 4bit)")
+if device == "cuda":
+    print("阶段九：量化技术对比 (FP16 vs 8bit vs 4bit)")
+else:
+    print("阶段九：CPU 量化对比 (fp32 vs bf16 vs int8)")
 print("="*50)
 
 # 系统信息
 print(f"\nGPU: {'✅ ' + torch.cuda.get_device_name(0) if torch.cuda.is_available() else '❌ 未检测到'}")
+if device == "cpu":
+    print(f"CPU 线程数: {torch.get_num_threads()}")
 
 tokenizer = AutoTokenizer.from_pretrained(model_name)
-device = "cuda" if torch.cuda.is_available() else "cpu"
 
-# 测试prompt
-test_prompt = "FutureAI公司的Wifi密码是多少？"
-messages = [{"role": "user", "content": test_prompt}]
-text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+# 测试prompt：训练数据里的 FAQ 问题
+prompts = load_prompts(limit=NUM_PROMPTS)
+print(f"测试问题: {len(prompts)} 条 × {REPEATS} 轮，每条最多生成 {MAX_NEW_TOKENS} tokens")
+
+def show_result(name, result):
+    print(f"\n[{name}] 权重: {result['weights_mb']:.0f} MB")
+    print_result(name, result)
+    print(f"  回答: {result['sample_response'][-80:]}")
+    return result
 
 def test_model(model, name):
-    """测试模型显存和速度"""
-    inputs = tokenizer([text], return_tensors="pt").to(device)
-    mem = torch.cuda.memory_allocated() / 1024**2 if torch.cuda.is_available() else 0
-    
-    start = time.time()
-    with torch.no_grad():
-        outputs = model.generate(**inputs, max_new_tokens=50)
-    elapsed = time.time() - start
-    
-    response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    print(f"\n[{name}]")
-    print(f"  显存: {mem:.0f} MB | 耗时: {elapsed:.2f}s")
-    print(f"  回答: {response[-80:]}")
-    return mem, elapsed
+    """预热 + 多轮重复测试：TTFT、prefill/decode 速度、延迟分位数、峰值内存"""
+    result = benchmark(model, tokenizer, prompts, device, repeats=REPEATS, max_new_tokens=MAX_NEW_TOKENS)
+    # 权重本身占用的显存
+    result["weights_mb"] = torch.cuda.memory_allocated() / 1024**2
+    return show_result(name, result)
 
 results = {}
 
-# 方案A: FP16
-print("\n" + "-"*50)
-print("测试 FP16 (全精度)")
-model_fp = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float16)
 if device == "cuda":
-    model_fp = model_fp.to(device)
-results['FP16'] = test_model(model_fp, "FP16")
-del model_fp
-torch.cuda.empty_cache() if torch.cuda.is_available() else None
-
-# 方案B: 8bit
-print("\n" + "-"*50)
-print("测试 8bit 量化")
-config_8bit = BitsAndBytesConfig(load_in_8bit=True)
-model_8bit = AutoModelForCausalLM.from_pretrained(
-    model_name, quantization_config=config_8bit, device_map="auto"
-)
-results['8bit'] = test_model(model_8bit, "8bit")
-del model_8bit
-torch.cuda.empty_cache() if torch.cuda.is_available() else None
-
-# 方案C: 4bit
-print("\n" + "-"*50)
-print("测试 4bit 量化 (NF4)")
-config_4bit = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_compute_dtype=torch.bfloat16,
-    bnb_4bit_use_double_quant=True
-)
-model_4bit = AutoModelForCausalLM.from_pretrained(
-    model_name, quantization_config=config_4bit, device_map="auto"
-)
-results['4bit'] = test_model(model_4bit, "4bit")
+    from transformers import BitsAndBytesConfig
+
+    # 方案A: FP16
+    print("\n" + "-"*50)
+    print("测试 FP16 (全精度)")
+    model_fp = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float16).to(device)
+    results['FP16'] = test_model(model_fp, "FP16")
+    del model_fp
+    torch.cuda.empty_cache()
+
+    # 方案B: 8bit
+    print("\n" + "-"*50)
+    print("测试 8bit 量化")
+    config_8bit = BitsAndBytesConfig(load_in_8bit=True)
+    model_8bit = AutoModelForCausalLM.from_pretrained(
+        model_name, quantization_config=config_8bit, device_map="auto"
+    )
+    results['8bit'] = test_model(model_8bit, "8bit")
+    del model_8bit
+    torch.cuda.empty_cache()
+
+    # 方案C: 4bit
+    print("\n" + "-"*50)
+    print("测试 4bit 量化 (NF4)")
+    config_4bit = BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_compute_dtype=torch.bfloat16,
+        bnb_4bit_use_double_quant=True
+    )
+    model_4bit = AutoModelForCausalLM.from_pretrained(
+        model_name, quantization_config=config_4bit, device_map="auto"
+    )
+    results['4bit'] = test_model(model_4bit, "4bit")
+else:
+    # CPU 上 FP16 矩阵乘法很慢，以 fp32 为基准
+    # 每种精度在单独的子进程里测：同一进程里前一个模型释放的内存不一定还给系统，峰值 RSS 会互相影响
+    for precision in CPU_PRECISIONS:
+        print("\n" + "-"*50)
+        print(f"测试 {precision}")
+        result = benchmark_in_subprocess(precision, model_name, num_prompts=NUM_PROMPTS, repeats=REPEATS,
+                                         max_new_tokens=MAX_NEW_TOKENS)[precision]
+        results[precision] = show_result(precision, result)
 
 # 总结
 print("\n" + "="*50)
 print("量化效果对比")
 print("="*50)
 
-fp_mem, fp_time = results['FP16']
-for name, (mem, t) in results.items():
-    mem_save = (1 - mem/fp_mem) * 100 if fp_mem > 0 else 0
-    print(f"{name:5s}: 显存 {mem:6.0f} MB (↓{mem_save:4.0f}%) | 速度 {t:.2f}s")
+base = next(iter(results.values()))
+for name, r in results.items():
+    mem_save = (1 - r["weights_mb"] / base["weights_mb"]) * 100 if base["weights_mb"] > 0 else 0
+    speedup = r["decode_tokens_per_sec"] / base["decode_tokens_per_sec"] if base["decode_tokens_per_sec"] else 0
+    print(f"{name:5s}: 权重 {r['weights_mb']:6.0f} MB (↓{mem_save:4.0f}%) | "
+          f"decode {r['decode_tokens_per_sec']:6.1f} tok/s ({speedup:.2f}x) | "
+          f"TTFT p50 {r['ttft_p50'] * 1000:5.0f} ms | 延迟 p95 {r['latency_p95']:.2f}s")
+save_report(REPORT_FILE, device, results)
 
-print("\n💡 结论：4bit量化可节省约75%显存，速度略慢但可接受")
+if device == "cuda":
+    print("\n💡 结论：4bit量化可节省约75%显存，速度略慢但可接受")
+else:
+    print("\n💡 结论：int8 动态量化权重内存约为 fp32 的 1/4；选好精度后在 config.py 设置 CPU_PRECISION，"
+          "step4 / step7 / 推理服务都会按它加载模型")
 print("✅ 阶段九完成！")
@@ -0,0 +1,249 @@
+"""
+向量库后端
+step8 和 deepseek_integration/RAGSystem 共用同一套接口（与 Chroma collection 的常用方法一致）：
+    count / get / upsert / delete / query
+
+- ChromaVectorStore：Chroma PersistentClient + HNSW 近似检索，适合大库
+- NumpyVectorStore：暴力精确检索，矩阵以 .npy 保存、按 memmap 加载，
+  元数据放在同名 .json 里；几十到几千条的小库启动快、结果精确
+"""
+
+import json
+import os
+
+import numpy as np
+
+
+class VectorStore:
+    """向量库接口，返回值格式与 Chroma 保持一致"""
+
+    name = None
+
+    def count(self):
+        raise NotImplementedError
+
+    def get(self, ids=None, where=None, include=None):
+        raise NotImplementedError
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def query(self, query_embeddings, n_results=10):
+        raise NotImplementedError
+
+
+# ==========================================
+# Chroma 后端
+# ==========================================
+
+class ChromaVectorStore(VectorStore):
+
+    def __init__(self, path, name, space="l2"):
+        import chromadb
+
+        self.name = name
+        self.client = chromadb.PersistentClient(path=path)
+        # 已存在的集合沿用原来的距离度量；新建时才用 space
+        self.collection = self.client.get_or_create_collection(name=name, metadata={"hnsw:space": space})
+
+    def count(self):
+        return self.collection.count()
+
+    def get(self, ids=None, where=None, include=None):
+        kwargs = {"ids": ids, "where": where}
+        if include is not None:
+            kwargs["include"] = include
+        return self.collection.get(**kwargs)
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids):
+        self.collection.delete(ids=ids)
+
+    def query(self, query_embeddings, n_results=10):
+        return self.collection.query(query_embeddings=query_embeddings, n_results=n_results)
+
+
+# ==========================================
+# NumPy 精确检索后端
+# ==========================================
+
+class NumpyVectorStore(VectorStore):
+    """
+    所有向量放在一个 (N, dim) 矩阵里：
+    - cosine：写入时先归一化，检索 = 一次矩阵乘法 + argpartition 取 top-k
+    - l2：检索时用 |a|^2 - 2a·b + |b|^2 计算平方欧氏距离（与 Chroma 的 l2 一致）
+    dtype 可选 float16 以减半内存，计算时再转 float32
+    """
+
+    def __init__(self, path, name, space="cosine", dtype="float32"):
+        self.name = name
+        self.matrix_path = os.path.join(path, f"{name}.npy")
+        self.meta_path = os.path.join(path, f"{name}.json")
+        os.makedirs(path, exist_ok=True)
+
+        self.space = space
+        self.dtype = np.dtype(dtype)
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        self._matrix = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            # 已存在的库沿用保存时的度量和精度
+            self.space = meta["space"]
+            self.dtype = np.dtype(meta["dtype"])
+            self.ids = meta["ids"]
+            self.documents = meta["documents"]
+            self.metadatas = meta["metadatas"]
+            if self.ids:
+                self._matrix = np.load(self.matrix_path, mmap_mode="r")
+        self._row = {doc_id: i for i, doc_id in enumerate(self.ids)}
+
+    # ---------- 持久化 ----------
+
+    def _save(self):
+        tmp_matrix = self.matrix_path + ".tmp.npy"
+        tmp_meta = self.meta_path + ".tmp"
+        matrix = self._matrix if self._matrix is not None else np.zeros((0, 0), dtype=self.dtype)
+        np.save(tmp_matrix, matrix)
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({
+                "space": self.space,
+                "dtype": self.dtype.name,
+                "ids": self.ids,
+                "documents": self.documents,
+                "metadatas": self.metadatas,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_matrix, self.matrix_path)
+        os.replace(tmp_meta, self.meta_path)
+
+    def _writable_matrix(self):
+        # memmap 是只读的，修改前先拷到内存（同时释放对旧文件的映射，Windows 下才能替换文件）
+        if isinstance(self._matrix, np.memmap):
+            self._matrix = np.array(self._matrix)
+        return self._matrix
+
+    def _prepare(self, embeddings):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        if self.space == "cosine":
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+        return vectors
+
+    # ---------- 接口实现 ----------
+
+    def count(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _match(metadata, where):
+        if not where:
+            return True
+        return all((metadata or {}).get(k) == v for k, v in where.items())
+
+    def get(self, ids=None, where=None, include=None):
+        if ids is None:
+            rows = range(len(self.ids))
+        else:
+            rows = [self._row[i] for i in ids if i in self._row]
+        rows = [r for r in rows if self._match(self.metadatas[r], where)]
+        include = ["documents", "metadatas"] if include is None else include
+        result = {"ids": [self.ids[r] for r in rows]}
+        if "documents" in include:
+            result["documents"] = [self.documents[r] for r in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self.metadatas[r] for r in rows]
+        if "embeddings" in include:
+            result["embeddings"] = [np.asarray(self._matrix[r], dtype=np.float32) for r in rows]
+        return result
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        if not ids:
+            return
+        vectors = self._prepare(embeddings).astype(self.dtype)
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+
+        matrix = self._writable_matrix()
+        if matrix is None:
+            matrix = np.zeros((0, vectors.shape[1]), dtype=self.dtype)
+        new_rows = []
+        for i, doc_id in enumerate(ids):
+            row = self._row.get(doc_id)
+            if row is None:
+                self._row[doc_id] = len(self.ids)
+                self.ids.append(doc_id)
+                self.documents.append(documents[i])
+                self.metadatas.append(metadatas[i])
+                new_rows.append(i)
+            else:
+                matrix[row] = vectors[i]
+                self.documents[row] = documents[i]
+                self.metadatas[row] = metadatas[i]
+        if new_rows:
+            matrix = np.concatenate([matrix, vectors[new_rows]], axis=0)
+        self._matrix = matrix
+        self._save()
+
+    def delete(self, ids):
+        drop = {self._row[i] for i in ids if i in self._row}
+        if not drop:
+            return
+        keep = [r for r in range(len(self.ids)) if r not in drop]
+        self._matrix = self._writable_matrix()[keep]
+        self.ids = [self.ids[r] for r in keep]
+        self.documents = [self.documents[r] for r in keep]
+        self.metadatas = [self.metadatas[r] for r in keep]
+        self._row = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self._save()
+
+    def query(self, query_embeddings, n_results=10):
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        queries = self._prepare(query_embeddings)
+        if not self.ids:
+            for _ in range(len(queries)):
+                for key in result:
+                    result[key].append([])
+            return result
+
+        matrix = np.asarray(self._matrix, dtype=np.float32)
+        scores = queries @ matrix.T  # (Q, N)
+        if self.space == "cosine":
+            distances = 1.0 - scores
+        else:
+            distances = (
+                (matrix * matrix).sum(axis=1)[None, :]
+                - 2.0 * scores
+                + (queries * queries).sum(axis=1)[:, None]
+            )
+
+        k = min(n_results, len(self.ids))
+        for row_distances in distances:
+            # argpartition 取出 top-k（无序），再只对这 k 个排序
+            top = np.argpartition(row_distances, k - 1)[:k]
+            top = top[np.argsort(row_distances[top])]
+            result["ids"].append([self.ids[r] for r in top])
+            result["documents"].append([self.documents[r] for r in top])
+            result["metadatas"].append([self.metadatas[r] for r in top])
+            result["distances"].append([float(row_distances[r]) for r in top])
+        return result
+
+
+def open_vector_store(backend, path, name, space="l2", dtype="float32"):
+    """
+    backend: "chroma" 或 "numpy"
+    space: 新建库时使用的距离度量（"l2" / "cosine"）
+    """
+    if backend == "numpy":
+        return NumpyVectorStore(path, name, space=space, dtype=dtype)
+    if backend == "chroma":
+        return ChromaVectorStore(path, name, space=space)
+    raise ValueError(f"未知的向量库后端: {backend}")